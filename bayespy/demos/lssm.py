@@ -27,6 +27,8 @@ Demonstrate linear Gaussian state-space model.
 Some of the functions in this module are re-usable: 
   * ``model`` can be used to construct the classical linear state-space model.
   * ``infer`` can be used to apply linear state-space model to given data.
+  * ``infer_online`` can be used to apply linear state-space model to a
+    stream of data.
 """
 
 import numpy as np
@@ -40,6 +42,7 @@ from bayespy.nodes import SumMultiply
 from bayespy.inference.vmp.nodes.gamma import diagonal
 
 from bayespy.utils import random
+from bayespy.utils import misc
 
 from bayespy.inference.vmp.vmp import VB
 from bayespy.inference.vmp import transformations
@@ -47,15 +50,25 @@ from bayespy.inference.vmp import transformations
 import bayespy.plot as bpplt
 
 
-def model(M=10, N=100, D=3):
+def model(M=10, N=100, D=3, plates_multiplier=None):
     """
     Construct linear state-space model.
 
     See, for instance, the following publication:
     "Fast variational Bayesian linear state-space model"
     Luttinen (ECML 2013)
+
+    If plates_multiplier is given, the chain is considered as a sub-chain of
+    a longer chain for stochastic variational inference.  The multiplier is
+    the ratio of the lengths of the full chain and the sub-chain.
     """
 
+    if plates_multiplier is None:
+        kwargs = {}
+    else:
+        kwargs = {'plates': (1,),
+                  'plates_multiplier': (plates_multiplier,)}
+
     # Dynamics matrix with ARD
     alpha = Gamma(1e-5,
                   1e-5,
@@ -78,8 +91,9 @@ def model(M=10, N=100, D=3):
                             np.ones(D),          # innovation
                             n=N,                 # time instances
                             plotter=bpplt.GaussianMarkovChainPlotter(scale=2),
-                            name='X')
-    X.initialize_from_value(np.random.randn(N,D))
+                            name='X',
+                            **kwargs)
+    X.initialize_from_value(np.random.randn(*(X.plates+(N,D))))
 
     # Mixing matrix from latent space to observation space using ARD
     gamma = Gamma(1e-5,
@@ -209,6 +223,125 @@ def infer(y, D,
     return Q
 
 
+def infer_online(y, D,
+                 lag=10,
+                 n_eff=None,
+                 delay=1,
+                 forgetting_rate=0.7,
+                 mask=True,
+                 verbose=False):
+    """
+    Apply linear state-space model to a stream of data.
+
+    The columns of y are processed one at a time as if they arrived one by
+    one.  The states are estimated with a fixed-lag smoother: the posterior
+    of a window of the lag+1 latest states is updated using the latest
+    observations and the Kalman filtered distribution of the state preceding
+    the window.  The global variables (A, alpha, C, gamma, tau) are updated
+    with stochastic natural gradient steps as if the full chain consisted of
+    n_eff/(lag+1) replications of the window (by default, n_eff is the
+    length of the stream).  Thus, the cost of a new sample is O(lag*D^3)
+    instead of O(N*D^3) of refitting the full chain.
+
+    Returns the posterior approximation of the window model and the
+    smoothed means of the states, that is, the posterior mean of x[n] given
+    the observations up to n+lag.
+    """
+
+    (M, N) = np.shape(y)
+    W = lag + 1
+    if n_eff is None:
+        n_eff = N
+    mask = np.broadcast_to(mask, (M, N)) & np.isfinite(y)
+
+    # Construct the model for the window
+    Q = model(M, W, D, plates_multiplier=n_eff/W)
+    Q.ignore_bound_checks = True
+    X = Q['X']
+    (mu_node, Lambda_node) = X.parents[:2]
+    global_nodes = ['A', 'alpha', 'C', 'gamma', 'tau']
+
+    # Kalman filtered distribution of the state preceding the window
+    x_prev = None
+    Cov_prev = None
+    y_window = np.zeros((M, W))
+    mask_window = np.zeros((M, W), dtype=bool)
+    x_smoothed = np.empty((N, D))
+    for n in range(N):
+
+        # Move the window forward
+        start = max(0, n - lag)
+        if n >= W:
+            (x_prev, Cov_prev) = _kalman_filter_step(Q,
+                                                     x_prev,
+                                                     Cov_prev,
+                                                     y_window[:,0],
+                                                     mask_window[:,0])
+            # Prior of the first state in the window
+            (A, V) = _dynamics(Q)
+            mu_node.set_value(np.dot(A, x_prev))
+            Lambda_node.set_value(np.linalg.inv(np.dot(np.dot(A, Cov_prev),
+                                                       A.T) + V))
+            y_window[:,:-1] = y_window[:,1:]
+            mask_window[:,:-1] = mask_window[:,1:]
+        y_window[:,n-start] = np.where(mask[:,n], y[:,n], 0)
+        mask_window[:,n-start] = mask[:,n]
+
+        # Fixed-lag smoothing of the window
+        Q['Y'].observe(y_window, mask=mask_window)
+        Q.update('X', verbose=verbose)
+        if n >= lag:
+            x_smoothed[n-lag] = X.get_moments()[0][0,0]
+
+        # Stochastic natural gradient step for the global variables
+        step = (n + delay) ** (-forgetting_rate)
+        Q.gradient_step(*global_nodes, scale=step)
+
+    # The last states are smoothed with a shorter lag
+    first = max(0, N-lag)
+    offset = max(0, N-W)
+    x_smoothed[first:] = X.get_moments()[0][0,first-offset:N-offset]
+
+    return (Q, x_smoothed)
+
+
+def _dynamics(Q):
+    """
+    Return the posterior mean of the dynamics matrix and the innovation
+    covariance.
+    """
+    A = Q['A'].get_moments()[0]
+    (v, _) = Q['X'].parents[3].get_moments()
+    V = np.diag(1/(v * np.ones(np.shape(A)[-1])))
+    return (A, V)
+
+
+def _kalman_filter_step(Q, x, Cov, y, mask):
+    """
+    Update the Kalman filtered distribution with one observation vector.
+
+    If x is None, the prior of the first state in the window is used.
+    """
+    (c, cc) = Q['C'].get_moments()
+    tau = Q['tau'].get_moments()[0]
+    c = c[...,0,:]
+    cc = cc[...,0,:,:]
+    # Normalized observation and its precision
+    y = tau * np.einsum('m,md->d', mask*y, c)
+    U = tau * np.einsum('m,mij->ij', mask, cc)
+    if x is None:
+        (mu0, _) = Q['X'].parents[0].get_moments()
+        (Lambda0, _) = Q['X'].parents[1].get_moments()
+        Cov0 = np.linalg.inv(Lambda0)
+    else:
+        (A, V) = _dynamics(Q)
+        mu0 = np.dot(A, x)
+        Cov0 = np.dot(np.dot(A, Cov), A.T) + V
+    (x, Cov) = misc.kalman_filter(y[None], U[None], [], [], mu0, Cov0)
+    # Force symmetric covariance (for numeric inaccuracy)
+    return (x[0], 0.5*Cov[0] + 0.5*Cov[0].T)
+
+
 def simulate_data(M, N):
     """
     Generate a dataset using linear state-space model.
@@ -154,7 +154,7 @@ class BinomialDistribution(ExponentialFamilyDistribution):
         Draw a random sample from the distribution.
         """
         p = random.logodds_to_probability(phi[0])
-        return np.random.binomial(self.N, p, size=plates)
+        return random.get_generator().binomial(self.N, p, size=plates)
 
     
 class Binomial(ExponentialFamily):
@@ -66,7 +66,7 @@ class CategoricalMoments(MultinomialMoments):
             raise ValueError("Invalid category index")
 
         u0 = np.zeros((np.size(x), self.D))
-        u0[[np.arange(np.size(x)), np.ravel(x)]] = 1
+        u0[np.arange(np.size(x)), np.ravel(x)] = 1
         u0 = np.reshape(u0, np.shape(x) + (self.D,))
 
         return [u0]
@@ -86,17 +86,29 @@ class CategoricalDistribution(MultinomialDistribution):
     Class for the VMP formulas of categorical variables.
     """    
 
-    def __init__(self, categories):
+    def __init__(self, categories, truncation=None):
         """
         Create VMP formula node for a categorical variable
 
         `categories` is the total number of categories.
+        `truncation` restricts the posterior approximation to the categories
+        with the largest probabilities: an integer gives the number of the
+        retained categories and a float in (0,1) gives the threshold for the
+        probabilities of the retained categories.
         """
         if not isinstance(categories, int):
             raise ValueError("Number of categories must be integer")
         if categories < 0:
             raise ValueError("Number of categoriess must be non-negative")
+        if truncation is not None:
+            if isinstance(truncation, (int, np.integer)):
+                if truncation < 1:
+                    raise ValueError("Number of retained categories must be "
+                                     "positive")
+            elif not 0 < truncation < 1:
+                raise ValueError("Truncation threshold must be in (0,1)")
         self.D = categories
+        self.truncation = truncation
         super().__init__(1)
         
 
@@ -117,8 +129,46 @@ class CategoricalDistribution(MultinomialDistribution):
     def compute_moments_and_cgf(self, phi, mask=True):
         """
         Compute the moments and :math:`g(\phi)`.
+
+        If truncation is used, the distribution is restricted to the retained
+        categories, thus the probabilities of the other categories are exactly
+        zero.  The moments are then given by the indices and the probabilities
+        of the retained categories (misc.SparseCounts).
         """
-        return super().compute_moments_and_cgf(phi, mask=mask)
+        if (self.truncation is None or
+            (isinstance(self.truncation, (int, np.integer)) and
+             self.truncation >= self.D)):
+            return super().compute_moments_and_cgf(phi, mask=mask)
+        if isinstance(self.truncation, (int, np.integer)):
+            # Retain the categories with the largest probabilities
+            ind = np.argpartition(-phi[0],
+                                  self.truncation-1,
+                                  axis=-1)[...,:self.truncation]
+            logp = np.take_along_axis(phi[0], ind, axis=-1)
+            logsum_p = misc.logsumexp(logp, axis=-1, keepdims=True)
+            p = np.exp(logp - logsum_p)
+            u0 = misc.SparseCounts(ind,
+                                   p / np.sum(p, axis=-1, keepdims=True),
+                                   self.D)
+            g = -np.squeeze(logsum_p, axis=-1)
+        else:
+            # Retain the categories with probabilities above the threshold
+            # (and always the most probable category)
+            max_phi = np.amax(phi[0], axis=-1, keepdims=True)
+            p = np.exp(phi[0] - max_phi)
+            threshold = np.minimum(self.truncation *
+                                   np.sum(p, axis=-1, keepdims=True),
+                                   1)
+            # Retain as many categories for each variable as are above the
+            # threshold for any variable
+            M = max(np.amax(np.sum(p >= threshold, axis=-1), initial=0), 1)
+            ind = np.argpartition(-p, M-1, axis=-1)[...,:M]
+            p = np.take_along_axis(p, ind, axis=-1)
+            p = np.where(p >= threshold, p, 0)
+            sum_p = np.sum(p, axis=-1, keepdims=True)
+            u0 = misc.SparseCounts(ind, p / sum_p, self.D)
+            g = -np.squeeze(max_phi + np.log(sum_p), axis=-1)
+        return ([u0], g)
 
         
     def compute_cgf_from_parents(self, u_p):
@@ -140,11 +190,10 @@ class CategoricalDistribution(MultinomialDistribution):
         if np.any(x < 0) or np.any(x >= self.D):
             raise ValueError("Invalid category index")
 
-        # Form a binary matrix with only one non-zero (1) in the last axis
-        u0 = np.zeros((np.size(x), self.D))
-        u0[[np.arange(np.size(x)), np.ravel(x)]] = 1
-        u0 = np.reshape(u0, np.shape(x) + (self.D,))
-        u = [u0]
+        # Represent the one-hot vectors by the indices only, so the memory
+        # and the computations scale with the number of observations instead
+        # of the number of categories
+        u = [misc.SparseCounts.from_indices(x, self.D)]
 
         # f(x) is zero
         f = 0
@@ -156,8 +205,7 @@ class CategoricalDistribution(MultinomialDistribution):
         """
         Draw a random sample from the distribution.
         """
-        logp = phi[0]
-        logp -= np.amax(logp, axis=-1, keepdims=True)
+        logp = phi[0] - np.amax(phi[0], axis=-1, keepdims=True)
         p = np.exp(logp)
         return random.categorical(p, size=plates)
 
@@ -180,6 +228,16 @@ class Categorical(ExponentialFamily):
     
         Probabilities for each category
 
+    truncation : int or float, optional
+
+        Restrict the posterior approximation to the most probable categories
+        of each variable: an integer gives the number of the retained
+        categories and a float in (0,1) the probability threshold for the
+        retained categories (the most probable category is always retained).
+        The probabilities of the other categories are exactly zero.  For
+        mixtures with many clusters, :class:`Mixture` then computes the
+        messages to the cluster parameters using only the retained clusters.
+
     See also
     --------
     Bernoulli, Multinomial, Dirichlet
@@ -187,18 +245,19 @@ class Categorical(ExponentialFamily):
 
 
     _parent_moments = [DirichletMoments()]
+    _prune_dims_parents = (0,)
 
 
-    def __init__(self, p, **kwargs):
+    def __init__(self, p, truncation=None, **kwargs):
         """
         Create Categorical node.
         """
-        super().__init__(p, **kwargs)
+        super().__init__(p, truncation=truncation, **kwargs)
 
 
     @classmethod
     @ensureparents
-    def _constructor(cls, p, **kwargs):
+    def _constructor(cls, p, truncation=None, **kwargs):
         """
         Constructs distribution and moments objects.
 
@@ -214,7 +273,7 @@ class Categorical(ExponentialFamily):
 
         parents = [p]
         moments = CategoricalMoments(D)
-        distribution = CategoricalDistribution(D)
+        distribution = CategoricalDistribution(D, truncation=truncation)
 
         return (parents,
                 kwargs,
@@ -224,13 +283,24 @@ class Categorical(ExponentialFamily):
                 distribution, 
                 moments, 
                 cls._parent_moments)
+
+
+    def _prune(self, axis, keep):
+        if isinstance(axis, int) and axis >= 0:
+            D = len(keep)
+            self._moments = CategoricalMoments(D)
+            self._distribution = CategoricalDistribution(
+                D,
+                truncation=self._distribution.truncation
+            )
+        super()._prune(axis, keep)
     
 
     def __str__(self):
         """
         Print the distribution using standard parameterization.
         """
-        p = self.u[0]
+        p = self.get_moments()[0]
         return ("%s ~ Categorical(p)\n"
                 "  p = \n"
                 "%s\n"
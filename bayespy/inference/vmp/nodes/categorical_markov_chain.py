@@ -76,15 +76,28 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
     """    
 
 
-    def __init__(self, categories, states):
+    def __init__(self, categories, states, time_homogeneous=False,
+                 transitions=None):
         """
         Create VMP formula node for a categorical variable
 
         `categories` is the total number of categories.
         `states` is the length of the chain.
+        `time_homogeneous` tells whether the transition matrix is shared by
+        all time instances.  Then, the transition matrix and the state
+        log-probabilities are stored separately in the natural parameters and
+        the pairwise probabilities are summed over time in the moments.
+        `transitions` is an optional boolean (K,K)-array of the allowed
+        transitions of a time-homogeneous chain.  Then, the transition
+        log-probabilities and the pairwise probabilities are stored only for
+        the allowed transitions in the order given by `np.nonzero`.
         """
         self.K = categories
         self.N = states
+        self.time_homogeneous = time_homogeneous
+        self.transitions = transitions
+        if transitions is not None:
+            (self.rows, self.cols) = np.nonzero(transitions)
 
     def compute_message_to_parent(self, parent, index, u, u_p0, u_P):
         """
@@ -93,6 +106,14 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         if index == 0:
             return [ u[0] ]
         elif index == 1:
+            if self.transitions is not None:
+                # Scatter the allowed transitions to the full matrix
+                zz = np.zeros(np.shape(u[1])[:-1] + (self.K,self.K))
+                zz[...,self.rows,self.cols] = u[1]
+                return [ zz[...,None,:,:] ]
+            if self.time_homogeneous:
+                # Add the time axis
+                return [ u[1][...,None,:,:] ]
             return [ u[1] ]
         else:
             raise ValueError("Parent index out of bounds")
@@ -115,6 +136,13 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         Compute the natural parameter vector given parent moments.
         """
         phi0 = u_p0[0]
+        if self.time_homogeneous:
+            # Remove the time axis
+            phi1 = (u_P[0] * np.ones((1,self.K,self.K)))[...,0,:,:]
+            if self.transitions is not None:
+                phi1 = phi1[...,self.rows,self.cols]
+            phi2 = np.zeros((self.N-1,self.K))
+            return [phi0, phi1, phi2]
         phi1 = u_P[0] * np.ones((self.N-1,self.K,self.K))
         return [phi0, phi1]
 
@@ -124,8 +152,17 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         """
         logp0 = phi[0]
         logP = phi[1]
-        (z0, zz, cgf) = random.alpha_beta_recursion(logp0, logP)
-        u = [z0, zz]
+        if self.time_homogeneous:
+            (z0, zz, z, cgf) = random.alpha_beta_recursion_homogeneous(
+                logp0,
+                logP,
+                phi[2],
+                transitions=self.transitions
+            )
+            u = [z0, zz, z]
+        else:
+            (z0, zz, cgf) = random.alpha_beta_recursion(logp0, logP)
+            u = [z0, zz]
         return (u, cgf)
 
     def compute_cgf_from_parents(self, u_p0, u_P):
@@ -150,6 +187,8 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         if index == 0:
             return plates
         elif index == 1:
+            if self.time_homogeneous:
+                return plates + (1, self.K)
             return plates + (self.N-1, self.K)
         else:
             raise ValueError("Parent index out of bounds")
@@ -172,39 +211,43 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
     def random(self, *phi, plates=None):
         """
         Draw a random sample from the distribution.
-        """
-        # Convert natural parameters to transition probabilities
-        p0 = np.exp(phi[0] - misc.logsumexp(phi[0], 
-                                            axis=-1,
-                                            keepdims=True))
-        P = np.exp(phi[1] - misc.logsumexp(phi[1],
-                                           axis=-1,
-                                           keepdims=True))
-        # Explicit broadcasting
-        P = P * np.ones(plates)[...,None,None,None]
-        # Allocate memory
-        Z = np.zeros(plates + (self.N,), dtype=np.int)
-        # Draw initial state
-        Z[...,0] = random.categorical(p0, size=plates)
-        # Create [0,1,2,...,len(plate_axis)] indices for each plate axis and
-        # make them broadcast properly
-        nplates = len(plates)
-        plates_ind = [np.arange(plate)[(Ellipsis,)+(nplates-i-1)*(None,)]
-                      for (i, plate) in enumerate(plates)]
-        plates_ind = tuple(plates_ind)
-        # Draw next states iteratively
-        for n in range(self.N-1):
-            # Select the transition probabilities for the current state but take
-            # into account the plates.  This leads to complex NumPy
-            # indexing.. :)
-            time_ind = min(n, np.shape(P)[-3]-1)
-            ind = plates_ind + (time_ind, Z[...,n], Ellipsis)
-            p = P[ind]
-            # Draw next state
-            z = random.categorical(P[ind])
-            Z[...,n+1] = z
-            
-        return Z
+
+        The states are drawn by forward filtering and backward sampling, thus
+        the samples are from the chain defined by the natural parameters
+        including the messages from the children (e.g., the posterior of an
+        HMM).  All plates are sampled at once.
+        """
+        if self.time_homogeneous:
+            return random.forward_filtering_backward_sampling_homogeneous(
+                phi[0],
+                phi[1],
+                phi[2],
+                transitions=self.transitions,
+                size=plates
+            )
+        return random.forward_filtering_backward_sampling(phi[0],
+                                                          phi[1],
+                                                          size=plates)
+
+
+    def compute_map_states(self, phi, consume=None, segment_length=None):
+        """
+        Compute the most probable state sequence by the Viterbi algorithm.
+
+        See :func:`bayespy.utils.random.viterbi` for the arguments.  Returns
+        the states and their unnormalized log-probability.
+        """
+        if self.time_homogeneous:
+            return random.viterbi_homogeneous(phi[0],
+                                              phi[1],
+                                              phi[2],
+                                              transitions=self.transitions,
+                                              consume=consume,
+                                              segment_length=segment_length)
+        return random.viterbi(phi[0],
+                              phi[1],
+                              consume=consume,
+                              segment_length=segment_length)
 
     
 class CategoricalMarkovChain(ExponentialFamily):
@@ -272,6 +315,27 @@ class CategoricalMarkovChain(ExponentialFamily):
     
         :math:`N`, the length of the chain.
 
+    time_homogeneous : bool, optional
+
+        If True, :math:`\mathbf{A}` must not vary in time.  Then, the
+        transition matrix is stored only once and the pairwise posterior
+        probabilities are summed over time instead of storing them for each
+        time instance.  The moments are the initial state probabilities, the
+        pairwise probabilities summed over time and the state probabilities
+        for :math:`n=1,\ldots,N-1`.  This reduces the memory usage from
+        :math:`O(NK^2)` to :math:`O(NK)`.
+
+    transitions : bool (K,K)-array, optional
+
+        The allowed state transitions, for instance, a banded or
+        left-to-right structure.  The other transition probabilities are
+        fixed to zero regardless of :math:`\mathbf{A}`, and the chain is
+        time-homogeneous.  The transition matrix is stored as a sparse matrix
+        and the pairwise posterior probabilities (summed over time) only for
+        the allowed transitions in the order given by ``np.nonzero``.  Thus,
+        the cost of a time step is proportional to the number of the allowed
+        transitions instead of :math:`K^2`.
+
     See also
     --------
     
@@ -284,16 +348,23 @@ class CategoricalMarkovChain(ExponentialFamily):
                        DirichletMoments())
 
 
-    def __init__(self, pi, A, states=None, **kwargs):
+    def __init__(self, pi, A, states=None, time_homogeneous=False,
+                 transitions=None, **kwargs):
         """
         Create categorical Markov chain
         """
-        super().__init__(pi, A, states=states, **kwargs)
+        super().__init__(pi,
+                         A,
+                         states=states,
+                         time_homogeneous=time_homogeneous,
+                         transitions=transitions,
+                         **kwargs)
 
 
     @classmethod
     @ensureparents
-    def _constructor(cls, p0, P, states=None, **kwargs):
+    def _constructor(cls, p0, P, states=None, time_homogeneous=False,
+                     transitions=None, **kwargs):
         """
         Constructs distribution and moments objects.
 
@@ -333,10 +404,37 @@ class CategoricalMarkovChain(ExponentialFamily):
         if len(P.plates) < 1 or P.plates[-1] != D:
             raise ValueError("Transition probability matrix is not square")
 
-        dims = ( (D,), (N-1,D,D) )
+        if transitions is not None:
+            transitions = np.asarray(transitions, dtype=bool)
+            if np.shape(transitions) != (D,D):
+                raise ValueError("Allowed transitions must be given as a "
+                                 "boolean %dx%d-array" % (D,D))
+            if not np.all(np.any(transitions, axis=-1)):
+                raise ValueError("Each state must have at least one allowed "
+                                 "transition")
+            # Sparse transitions are supported only for time-homogeneous
+            # chains
+            time_homogeneous = True
+
+        if time_homogeneous:
+            if len(P.plates) >= 2 and P.plates[-2] != 1:
+                raise ValueError("Transition probability matrix varies in "
+                                 "time but time homogeneity was requested")
+            if transitions is not None:
+                nnz = np.count_nonzero(transitions)
+                dims = ( (D,), (nnz,), (N-1,D) )
+            else:
+                dims = ( (D,), (D,D), (N-1,D) )
+        else:
+            dims = ( (D,), (N-1,D,D) )
 
         parents = [p0, P]
-        distribution = CategoricalMarkovChainDistribution(D, N)
+        distribution = CategoricalMarkovChainDistribution(
+            D,
+            N,
+            time_homogeneous=time_homogeneous,
+            transitions=transitions
+        )
         moments = CategoricalMarkovChainMoments(D)
         parent_moments = cls._parent_moments
 
@@ -350,6 +448,38 @@ class CategoricalMarkovChain(ExponentialFamily):
                 moments, 
                 parent_moments)
 
+
+    def map_states(self):
+        """
+        Return the most probable state sequence.
+
+        The sequence is computed by the Viterbi algorithm from the current
+        natural parameters, thus it is the most probable sequence under the
+        posterior approximation after the node has been updated.  All plates
+        are computed at once.
+        """
+        (z, _) = self._distribution.compute_map_states(self.phi)
+        return z * np.ones(self.plates+(1,), dtype=int)
+
+
+    def stream_map_states(self, consume, segment_length=None):
+        """
+        Compute the most probable state sequence in segments using bounded
+        memory.
+
+        The states are given to consume(start, z) segment by segment from the
+        last to the first one, where z contains the states
+        z[...,start:stop].  Only the back-pointers of one segment (of length
+        sqrt(N) by default) are in memory at a time, which is useful for very
+        long chains.  See :meth:`map_states`.
+        """
+        plates = self.plates
+        def consume_plates(start, z):
+            consume(start, z * np.ones(plates+(1,), dtype=int))
+        self._distribution.compute_map_states(self.phi,
+                                              consume=consume_plates,
+                                              segment_length=segment_length)
+
         
 class CategoricalMarkovChainToCategorical(Deterministic):
     """
@@ -375,9 +505,13 @@ class CategoricalMarkovChainToCategorical(Deterministic):
         """
         # Add time axis to p0
         p0 = u_Z[0][...,None,:]
-        # Sum joint probability arrays to marginal probability vectors
-        zz = u_Z[1]
-        p = np.sum(zz, axis=-2)
+        if len(u_Z) > 2:
+            # Time-homogeneous chain has the marginal probability vectors
+            p = u_Z[2]
+        else:
+            # Sum joint probability arrays to marginal probability vectors
+            zz = u_Z[1]
+            p = np.sum(zz, axis=-2)
 
         # Broadcast p0 and p to same shape, except the time axis
         plates_p0 = np.shape(p0)[:-2]
@@ -396,6 +530,9 @@ class CategoricalMarkovChainToCategorical(Deterministic):
         Compute the message to a parent.
         """
         m0 = m[0][...,0,:]
+        if len(self.parents[0].dims) > 2:
+            # Time-homogeneous chain gets the messages for the states
+            return [m0, None, m[0][...,1:,:]]
         m1 = m[0][...,1:,None,:]
         return [m0, m1]
     
@@ -418,7 +555,7 @@ class CategoricalMarkovChainToCategorical(Deterministic):
     
     def _plates_from_parent(self, index):
         if index == 0:
-            N = self.parents[0].dims[1][0]
+            N = self.parents[0].dims[-1][0]
             return self.parents[0].plates + (N+1,)
         else:
             raise ValueError("Parent index out of bounds")
@@ -23,7 +23,7 @@
 
 import numpy as np
 
-from .node import Node
+from .node import Node, prune_array
 
 class Constant(Node):
     r"""
@@ -35,6 +35,7 @@ class Constant(Node):
     def __init__(self, moments, x, **kwargs):
         self._moments = moments
         x = np.asanyarray(x)
+        self._value = x
         # Compute moments
         self.u = self._moments.compute_fixed_moments(x)
         # Dimensions of the moments
@@ -79,6 +80,23 @@ class Constant(Node):
         for (i, shape) in enumerate(shapes):
             if np.shape(self.u[i]) != shape:
                 raise ValueError("Incorrect shape for the array")
+        self._value = x
+        self._version += 1
+
+
+    def _prune_size(self, axis):
+        # The value must have the plate and variable axes of the moments
+        if np.ndim(self._value) != len(self.plates) + len(self.dims[0]):
+            raise NotImplementedError()
+        return super()._prune_size(axis)
+
+
+    def _prune(self, axis, keep):
+        x = prune_array(self._value, axis, keep, self.dims[0], len(self.dims[0]))
+        self._value = x
+        self.u = self._moments.compute_fixed_moments(x)
+        super()._prune(axis, keep)
+        self._version += 1
 
 
     def lower_bound_contribution(self, gradient=False, **kwargs):
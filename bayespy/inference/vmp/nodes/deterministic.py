@@ -76,9 +76,45 @@ class Deterministic(Node):
             id_list = id_list + parent._get_id_list()
         return id_list
     
+    # Cached moments and the versions of the parents they were computed from
+    _cached_moments = None
+    _cached_version = None
+
+    def _get_version(self):
+        """
+        Return the versions of the parents.
+
+        The moments of a deterministic node are a function of the moments of
+        its parents only, thus the versions of the parents identify the
+        moments.
+        """
+        return tuple(parent._get_version() for parent in self.parents)
+
+    def _message_to_parent_version(self, index):
+        """
+        Return a token which changes whenever the message to parent[index]
+        may change.
+
+        The message depends on the moments of the other parents, the mask and
+        the messages from the children.
+        """
+        return (self._mask_version,
+                tuple(parent._get_version()
+                      for (ind, parent) in enumerate(self.parents)
+                      if ind != index),
+                tuple((child, ind, child._message_to_parent_version(ind))
+                      for (child, ind) in self.children))
+
     def get_moments(self):
-        u_parents = self._message_from_parents()
-        return self._compute_moments(*u_parents)
+        # Recompute the moments only if some parent has changed since the
+        # moments were cached
+        version = self._get_version()
+        if self._cached_moments is None or version != self._cached_version:
+            u_parents = self._message_from_parents()
+            self._cached_moments = list(self._compute_moments(*u_parents))
+            self._cached_version = version
+        # Do not return a reference to the cached list
+        return list(self._cached_moments)
 
     def _compute_message_and_mask_to_parent(self, index, m_children, *u_parents):
         # The following methods should be implemented by sub-classes.
@@ -244,6 +244,7 @@ class Dirichlet(ExponentialFamily):
     _moments = DirichletMoments()
     _parent_moments = (DirichletPriorMoments(),)
     _distribution = DirichletDistribution()
+    _prune_dims_parents = (0,)
     
 
     @classmethod
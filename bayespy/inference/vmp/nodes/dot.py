@@ -330,8 +330,55 @@ class SumMultiply(Deterministic):
     def get_parameters(self):
         # Compute mean and variance
         u = self.get_moments()
-        u[1] -= u[0]**2
+        u[1] = u[1] - u[0]**2
         return u
+
+
+    def _prune_axis_to_parent(self, index, axis):
+        """
+        Map the variable axes to the parents by the keys.
+
+        The summed axes are referred to by ('key', key).
+        """
+        if isinstance(axis, int) and axis < 0:
+            return super()._prune_axis_to_parent(index, axis)
+        if isinstance(axis, int):
+            key = self.out_keys[axis]
+        elif isinstance(axis, tuple) and axis[0] == 'key':
+            key = axis[1]
+        else:
+            raise NotImplementedError()
+        if key not in self.in_keys[index]:
+            return None
+        axis = self.in_keys[index].index(key)
+        if self.parents[index].dims[0][axis] == 1:
+            return None
+        return axis
+
+
+    def _prune_axis_from_parent(self, index, axis):
+        if not isinstance(axis, int) or axis < 0:
+            return super()._prune_axis_from_parent(index, axis)
+        key = self.in_keys[index][axis]
+        if key in self.out_keys:
+            return self.out_keys.index(key)
+        return ('key', key)
+
+
+    def _prune_size(self, axis):
+        if isinstance(axis, tuple):
+            return max(parent.dims[0][keys.index(axis[1])]
+                       for (parent, keys) in zip(self.parents, self.in_keys)
+                       if axis[1] in keys)
+        return super()._prune_size(axis)
+
+
+    def _prune(self, axis, keep):
+        if isinstance(axis, tuple):
+            # Summed axes do not change the shape of this node
+            self._message_cache = {}
+        else:
+            super()._prune(axis, keep)
         
 
     def _message_to_parent(self, index):
@@ -509,6 +556,13 @@ class SumMultiply(Deterministic):
                                        plates_to=parent.plates)
 
             msg = msg + [m2, m3]
+
+        # Apply the plate multiplier (e.g., for stochastic variational
+        # inference) if the parent does not have the same multiplier
+        r = self.broadcasting_multiplier(self.plates_multiplier,
+                                         self._plates_multiplier_from_parent(index))
+        if r != 1:
+            msg = [r * m_i for m_i in msg]
             
         return msg
 
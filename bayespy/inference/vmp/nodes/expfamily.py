@@ -27,7 +27,7 @@ import numpy as np
 
 from bayespy.utils import misc
 
-from .node import ensureparents
+from .node import ensureparents, prune_array
 from .stochastic import Stochastic, Distribution
 
 class ExponentialFamilyDistribution(Distribution):
@@ -145,8 +145,7 @@ class ExponentialFamily(Stochastic):
                          **kwargs)
 
         if not initialize:
-            axes = len(self.plates)*(1,)
-            self.phi = [misc.nans(axes+dim) for dim in self.dims]
+            self.phi = self._nan_arrays()
 
 
     @classmethod
@@ -403,6 +402,20 @@ class ExponentialFamily(Stochastic):
         # ... and store them
         self._set_moments_and_cgf(u, g, mask=update_mask)
             
+    def _prune(self, axis, keep):
+        ndim = len(self.dims[0])
+        self.phi = [prune_array(phi, axis, keep, dim, ndim)
+                    for (phi, dim) in zip(self.phi, self.dims)]
+        self.g = prune_array(self.g, axis, keep, (), ndim)
+        self.f = prune_array(self.f, axis, keep, (), ndim)
+        super()._prune(axis, keep)
+        # Taking elements of a variable axis from the natural parameters
+        # conditions the distribution on the removed elements, thus the moments
+        # and the CGF must be recomputed.  The distribution object must have
+        # been updated for the new dimensions.
+        if isinstance(axis, int) and axis >= 0:
+            self._update_moments_and_cgf()
+
     def observe(self, x, *args, mask=True):
         """
         Fix moments, compute f and propagate mask.
@@ -487,10 +500,15 @@ class ExponentialFamily(Stochastic):
             axis_sum = tuple(range(-len(dims),0))
 
             # Compute the term
-            phi_q = np.where(latent_mask_i, phi_q, 0)
-            # Apply annealing
-            # TODO/FIXME: Use einsum here?
-            Z = np.sum((phi_p-T*phi_q) * u_q, axis=axis_sum)
+            if isinstance(u_q, misc.SparseCounts):
+                # Gather only the elements of the sparse moments
+                Z = (u_q.sum_product(phi_p)
+                     - T * np.where(latent_mask, u_q.sum_product(phi_q), 0))
+            else:
+                phi_q = np.where(latent_mask_i, phi_q, 0)
+                # Apply annealing
+                # TODO/FIXME: Use einsum here?
+                Z = np.sum((phi_p-T*phi_q) * u_q, axis=axis_sum)
 
             L = L + Z
 
@@ -518,7 +536,10 @@ class ExponentialFamily(Stochastic):
         for (phi_d, u_d, dims) in zip(self.phi, u, self.dims):
             axis_sum = tuple(range(-len(dims),0))
             # TODO/FIXME: Use einsum here?
-            Z = Z + np.sum(phi_d * u_d, axis=axis_sum)
+            if isinstance(u_d, misc.SparseCounts):
+                Z = Z + u_d.sum_product(phi_d)
+            else:
+                Z = Z + np.sum(phi_d * u_d, axis=axis_sum)
             #Z = Z + misc.sum_multiply(phi_d, u_d, axis=axis_sum)
 
         return (self.g + f + Z)
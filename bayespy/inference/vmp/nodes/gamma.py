@@ -36,6 +36,7 @@ from .node import Moments
 from .wishart import WishartMoments
 
 from bayespy.utils import misc
+from bayespy.utils import random
 
 
 def diagonal(alpha):
@@ -174,9 +175,9 @@ class GammaDistribution(ExponentialFamilyDistribution):
         r"""
         Draw a random sample from the distribution.
         """
-        return np.random.gamma(phi[1],
-                               -1/phi[0],
-                               size=plates)
+        return random.get_generator().gamma(phi[1],
+                                            -1/phi[0],
+                                            size=plates)
 
     
     def compute_gradient(self, g, u, phi):
@@ -240,6 +241,29 @@ class Gamma(ExponentialFamily):
         super().__init__(a, b, **kwargs)
 
 
+    def _dead_axes(self, mass=1e-3, precision=1e6):
+        """
+        Find the components of the last plate axis with large precisions.
+
+        A component is dead if its expected precision exceeds `precision` in
+        all the other plates, that is, the corresponding variables (e.g., the
+        columns of an ARD loading matrix) are switched off.
+        """
+        if (len(self.plates) == 0 or self.plates[-1] == 1
+            or np.any(self.observed)):
+            return []
+        # The moments may be broadcast along the plates (e.g., if the node
+        # has not been updated since it was initialized from the prior)
+        alpha = np.broadcast_to(self.u[0], self.plates)
+        alpha = np.reshape(alpha, (-1, self.plates[-1]))
+        keep = np.flatnonzero(np.min(alpha, axis=0) <= precision)
+        if len(keep) == 0:
+            keep = np.array([np.argmin(np.max(alpha, axis=0))])
+        if len(keep) == self.plates[-1]:
+            return []
+        return [(-1, keep)]
+
+
     def __str__(self):
         """
         Print the distribution using standard parameterization.
@@ -556,7 +556,7 @@ class GaussianDistribution(ExponentialFamilyDistribution):
         # Note that phi[1] is -0.5*inv(Cov)
         U = linalg.chol(-2*phi[1])
         mu = linalg.chol_solve(U, phi[0])
-        z = np.random.normal(0, 1, plates + np.shape(mu)[-1:])
+        z = random.get_generator().standard_normal(plates + np.shape(mu)[-1:])
         # Compute mu + U'*z
         z = misc.m_solve_triangular(U, z, trans='T', lower=False)
         return mu + z
@@ -832,7 +832,7 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
             var = -0.5 / phi1
             std = np.sqrt(var)
             mu = var * phi[0]
-            z = np.random.normal(0, 1, plates + dims)
+            z = random.get_generator().standard_normal(plates + dims)
             x = mu + std * z
         else:
             N = np.prod(dims)
@@ -847,7 +847,7 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
             phi0 = np.reshape(phi[0], plates_phi0 + (N,))
             mu = linalg.chol_solve(U, phi0)
             # Compute mu + U'*z
-            z = np.random.normal(0, 1, plates + (N,))
+            z = random.get_generator().standard_normal(plates + (N,))
             x = mu + linalg.solve_triangular(U, z,
                                              trans='T', 
                                              lower=False)
@@ -1223,7 +1223,8 @@ class Gaussian(ExponentialFamily):
             # Transform moments and g using R
             self.u[0] = mvdot(R, self.u[0])
             self.u[1] = dot(R, self.u[1], R.T)
-            self.g -= logdetR
+            self.g = self.g - logdetR
+            self._version += 1
 
     def rotate_matrix(self, R1, R2, inv1=None, logdet1=None, inv2=None, logdet2=None, Q=None):
         r"""
@@ -1425,6 +1426,40 @@ class GaussianARD(ExponentialFamily):
                 distribution,
                 moments,
                 parent_moments)
+
+
+    def _prune_axis_to_parent(self, index, axis):
+        if not isinstance(axis, int):
+            raise NotImplementedError()
+        # The leading variable axes which the mean does not have are the last
+        # plate axes of the parent
+        diff = self._distribution.ndim - self._distribution.ndim_mu
+        axis = axis - diff
+        parent = self.parents[index]
+        if axis < 0:
+            if len(parent.plates) < -axis or parent.plates[axis] == 1:
+                return None
+        elif parent.dims[0][axis] == 1:
+            return None
+        return axis
+
+
+    def _prune_axis_from_parent(self, index, axis):
+        if not isinstance(axis, int):
+            return None
+        diff = self._distribution.ndim - self._distribution.ndim_mu
+        return axis + diff
+
+
+    def _prune(self, axis, keep):
+        if axis >= 0:
+            shape = list(self._distribution.shape)
+            shape[axis] = len(keep)
+            self._distribution = GaussianARDDistribution(
+                tuple(shape),
+                self._distribution.ndim_mu
+            )
+        super()._prune(axis, keep)
         
 
     def initialize_from_parameters(self, mu, alpha):
@@ -1485,7 +1520,8 @@ class GaussianARD(ExponentialFamily):
                                       ndim=ndim)
         s = list(self.dims[0])
         s.pop(axis)
-        self.g -= logdetR * np.prod(s)
+        self.g = self.g - logdetR * np.prod(s)
+        self._version += 1
 
         return
 
@@ -2021,6 +2057,9 @@ class GaussianToGaussianGammaISO(Deterministic):
 
 
 
+    _prune_dims_parents = (0,)
+
+
     def __init__(self, X, **kwargs):
         r"""
         """
@@ -2063,6 +2102,9 @@ class GaussianGammaISOToGaussianGammaARD(Deterministic):
     """
 
 
+    _prune_dims_parents = (0,)
+
+
     def __init__(self, X, **kwargs):
         r"""
         """
@@ -2259,6 +2301,9 @@ class WrapToGaussianGammaARD(Deterministic):
     """
 
 
+    _prune_dims_parents = (0,)
+
+
     def __init__(self, mu_alpha, tau, **kwargs):
         r"""
         """
@@ -2428,6 +2473,27 @@ class WrapToGaussianGammaARD(Deterministic):
             raise ValueError("Invalid parent index")
 
 
+    def _prune_axis_to_parent(self, index, axis):
+        r"""
+        """
+        if index == 1 and isinstance(axis, int):
+            # The variable axes are the last plate axes of the precision
+            axis = axis - self.ndim
+            tau = self.parents[1]
+            if len(tau.plates) < -axis or tau.plates[axis] == 1:
+                return None
+            return axis
+        return super()._prune_axis_to_parent(index, axis)
+
+
+    def _prune_axis_from_parent(self, index, axis):
+        r"""
+        """
+        if index == 1 and isinstance(axis, int):
+            return axis + self.ndim
+        return super()._prune_axis_from_parent(index, axis)
+
+
 class WrapToGaussianWishart(Deterministic):
     r"""
     Wraps Gaussian and Wishart nodes into a Gaussian-Wishart node.
@@ -96,7 +96,13 @@ class TemplateGaussianMarkovChainDistribution(ExponentialFamilyDistribution):
         # sub-diagonal blocks so we would need to divide by two anyway.
         B = -phi[2]
 
-        (CovXnXn, CovXpXn, Xn, ldet) = linalg.block_banded_solve(A, B, y)
+        # For time-invariant chains, use the steady state of the recursions
+        # if it is reached quickly, otherwise use cyclic reduction
+        (CovXnXn, CovXpXn, Xn, ldet) = linalg.block_banded_solve(
+            A, B, y,
+            method='auto',
+            steady_state_tol=1e-12
+        )
 
         # Compute moments
         u0 = Xn
@@ -109,6 +115,72 @@ class TemplateGaussianMarkovChainDistribution(ExponentialFamilyDistribution):
         
         return (u, g)
 
+    def compute_moments_in_segments(self, phi_blocks, consume,
+                                    segment_length=None):
+        """
+        Compute the moments in segments using bounded memory.
+
+        The smoothing is performed with checkpointing so that only
+        O(sqrt(N)) time instances are kept in memory at a time.  Neither the
+        natural parameters nor the moments of the full chain are stored:
+        the natural parameters are requested and the moments are given to
+        the consumer segment by segment.
+
+        Parameters
+        ----------
+        phi_blocks : callable
+            Called as phi_blocks(start, stop) and returns the natural
+            parameters for the time instances start,...,stop-1, that is,
+            phi[0][...,start:stop,:], phi[1][...,start:stop,:,:] and
+            phi[2][...,start:min(stop,N-1),:,:].  It is called twice for
+            each segment.
+        consume : callable
+            Called as consume(start, u, phi) for each segment from the last
+            to the first one.  The moments u have the same form as the
+            moments of the full chain but they are for the time instances
+            start,...,stop, and phi are the natural parameters of the
+            segment as given by phi_blocks.  Consecutive segments overlap by
+            one time instance, thus each pairwise moment in u[2] is given
+            exactly once.
+        segment_length : int, optional
+            The length of the segments.  By default, sqrt(N).
+
+        Returns
+        -------
+        g
+            The cumulant-generating function.
+        """
+
+        g = [0]
+        # The natural parameters of the latest requested segment.  The
+        # backward recursion requests the blocks of a segment right before
+        # consuming the segment.
+        latest = [None]
+
+        def blocks(start, stop):
+            phi = phi_blocks(start, stop)
+            latest[0] = phi
+            return (-2*phi[1], -phi[2], phi[0])
+
+        def consume_segment(start, CovXnXn, CovXpXn, Xn):
+            phi = latest[0]
+            u0 = Xn
+            u1 = CovXnXn + Xn[...,:,np.newaxis] * Xn[...,np.newaxis,:]
+            u2 = CovXpXn + Xn[...,:-1,:,np.newaxis] * Xn[...,1:,np.newaxis,:]
+            # Skip the time instance which overlaps with the next segment
+            M = np.shape(phi[0])[-2]
+            g[0] = g[0] - 0.5 * np.einsum('...ij,...ij', Xn[...,:M,:], phi[0])
+            consume(start, [u0, u1, u2], phi)
+
+        ldet = linalg.block_banded_solve_checkpointed(
+            blocks,
+            self.N,
+            consume_segment,
+            segment_length=segment_length
+        )
+
+        return g[0] + 0.5*ldet
+
     def compute_cgf_from_parents(self, *u_parents):
         raise NotImplementedError()
         
@@ -176,8 +248,8 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
     """
 
     _moments = GaussianMarkovChainMoments()
-                                
-    
+
+
     def rotate(self, R, inv=None, logdet=None):
 
         if inv is not None:
@@ -209,9 +281,23 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
             u1 = linalg.dot(R, self.u[1], R.T)
             u2 = linalg.dot(R, self.u[2], R.T)
             self.u = [u0, u1, u2]
-            self.g -= N*logdetR
+            self.g = self.g - N*logdetR
+            self._version += 1
 
             
+def _slice_time(x, axis, start, stop):
+    """
+    Take the given time instances of a parent's moment array.
+
+    Time-invariant moments have no time axis or a unit time axis, thus they
+    are returned as they are.
+    """
+    if np.ndim(x) < -axis or np.shape(x)[axis] == 1:
+        return x
+    index = (Ellipsis, slice(start, stop)) + (-axis-1)*(slice(None),)
+    return x[index]
+
+
 def _compute_cgf_for_gaussian_markov_chain(mumu, Lambda, logdet_Lambda, 
                                            logdet_v, N):
     """
@@ -258,7 +344,7 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
             Moments of input signals.
         """
 
-        D = np.shape(u[0])[-1]
+        D = np.shape(u[1])[-1]
         
         if index == 0:   # mu
             Lambda = u_Lambda[0]
@@ -370,12 +456,38 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
            Shape of the variable part of phi.
 
         """
+        return self.compute_phi_blocks(0, self.N,
+                                       u_mu, u_Lambda, u_A, u_v, *u_inputs)
+
+    def compute_phi_blocks(self, start, stop, u_mu, u_Lambda, u_A, u_v, *u_inputs):
+        """
+        Compute the natural parameters of a segment using parents' moments.
+
+        Returns the natural parameters for the time instances
+        start,...,stop-1, that is, phi[0][...,start:stop,:],
+        phi[1][...,start:stop,:,:] and phi[2][...,start:min(stop,N-1),:,:].
+        Only the required transitions of time-varying parents are used, thus
+        the natural parameters of the full chain are never computed.
+        """
 
         # Dimensionality of the Gaussian states
         D = np.shape(u_mu[0])[-1]
 
         # Number of time instances in the process
         N = self.N
+
+        # Number of time instances and transitions from the segment
+        stop = min(stop, N)
+        M = stop - start
+        K = min(stop, N-1) - start
+
+        # Transitions into the time instances max(start,1),...,stop-1 and out
+        # of the time instances start,...,start+K-1
+        t_in = max(start, 1)
+        def transitions_in(x, axis):
+            return _slice_time(x, axis, t_in-1, stop-1)
+        def transitions_out(x, axis):
+            return _slice_time(x, axis, start, start+K)
         
         # Helpful variables (show shapes in comments)
         mu = u_mu[0]           # (..., D)
@@ -407,29 +519,42 @@ class GaussianMarkovChainDistribution(TemplateGaussianMarkovChainDistribution):
         plates_phi2 = misc.broadcasted_shape(np.shape(v)[:-2],
                                              np.shape(A)[:-3])
         
-        phi0 = np.zeros(plates_phi0+(N,D))
-        phi1 = np.zeros(plates_phi1+(N,D,D))
-        phi2 = np.zeros(plates_phi2+(N-1,D,D))
+        phi0 = np.zeros(plates_phi0+(M,D))
+        phi1 = np.zeros(plates_phi1+(M,D,D))
+        phi2 = np.zeros(plates_phi2+(K,D,D))
 
         # Parameters for x0
-        phi0[...,0,:] = np.einsum('...ik,...k->...i', Lambda, mu)
-        phi1[...,0,:,:] = Lambda
+        if start == 0:
+            phi0[...,0,:] = np.einsum('...ik,...k->...i', Lambda, mu)
+            phi1[...,0,:,:] = Lambda
 
         # Effect of the input signals
         if inputs is not None:
-            phi0[...,1:,:] += np.einsum('...i,...ij,...j->...i', v, B, inputs)
-            AB_v = np.einsum('...dij,...d->...ij', AB, v)
-            phi0[...,:-1,:] -= np.einsum('...ij,...j->...i', AB_v, inputs)
+            phi0[...,t_in-start:,:] += np.einsum('...i,...ij,...j->...i',
+                                                 transitions_in(v, -2),
+                                                 transitions_in(B, -3),
+                                                 transitions_in(inputs, -2))
+            AB_v = np.einsum('...dij,...d->...ij',
+                             transitions_out(AB, -4),
+                             transitions_out(v, -2))
+            phi0[...,:K,:] -= np.einsum('...ij,...j->...i',
+                                        AB_v,
+                                        transitions_out(inputs, -2))
 
         # Diagonal blocks: -0.5 * (V_i + A_{i+1}' * V_{i+1} * A_{i+1})
-        phi1[..., 1:, :, :] = v[...,np.newaxis]*np.identity(D)
-        phi1[..., :-1, :, :] += np.einsum('...kij,...k->...ij', AA, v)
+        phi1[..., t_in-start:, :, :] = (transitions_in(v, -2)[...,np.newaxis]
+                                        * np.identity(D))
+        phi1[..., :K, :, :] += np.einsum('...kij,...k->...ij',
+                                         transitions_out(AA, -4),
+                                         transitions_out(v, -2))
         phi1 *= -0.5
 
         # Super-diagonal blocks: 0.5 * A.T * V
         # However, don't multiply by 0.5 because there are both super- and
         # sub-diagonal blocks (sum them together)
-        phi2[..., :, :, :] = np.einsum('...ji,...j->...ij', A, v)
+        phi2[..., :, :, :] = np.einsum('...ji,...j->...ij',
+                                       transitions_out(A, -3),
+                                       transitions_out(v, -2))
 
         return (phi0, phi1, phi2)
 
@@ -593,6 +718,28 @@ class GaussianMarkovChain(_TemplateGaussianMarkovChain):
         :math:`N`, the length of the chain. Must be given if :math:`\mathbf{A}`
         and :math:`\boldsymbol{\nu}` are constant over time.
 
+    messages : callable, optional
+        If given, the node is in the streaming mode: the chain is smoothed in
+        segments using memory of O(sqrt(N)) time instances and the moments
+        of the full chain are never stored.  Then, the chain can not have
+        child nodes.  Instead, messages(start, stop) returns the messages
+        from the observations for the time instances start,...,stop-1 as a
+        list of three arrays (or scalars) with the shapes of the moments of
+        the segment, that is, (...,M,D), (...,M,D,D) and (...,K,D,D) where M
+        is stop-start and K is min(stop,N-1)-start.  :math:`\mathbf{A}` and
+        :math:`\boldsymbol{\nu}` must be constant over time.
+
+    consume : callable, optional
+        In the streaming mode, consume(start, u) is called after each update
+        for the moments of each segment from the last to the first one.  The
+        moments are for the time instances start,...,stop where stop is the
+        start of the next segment, thus consecutive segments overlap by one
+        time instance.
+
+    segment_length : int, optional
+        The length of the segments in the streaming mode.  By default,
+        sqrt(N).
+
     See also
     --------
     
@@ -601,11 +748,197 @@ class GaussianMarkovChain(_TemplateGaussianMarkovChain):
     """
 
 
-    def __init__(self, mu, Lambda, A, nu, n=None, inputs=None, **kwargs):
+    # The callables and the segment length of the streaming mode
+    _stream_messages = None
+    _stream_consume = None
+    _segment_length = None
+
+
+    def __init__(self, mu, Lambda, A, nu, n=None, inputs=None, messages=None,
+                 consume=None, segment_length=None, **kwargs):
         """
         Create GaussianMarkovChain node.
         """
+        self._stream_messages = messages
+        self._stream_consume = consume
+        self._segment_length = segment_length
         super().__init__(mu, Lambda, A, nu, n=n, inputs=inputs, **kwargs)
+        if messages is not None:
+            self._update_mask()
+
+
+    def _set_mask(self, mask):
+        # In the streaming mode, the messages are from observations of all
+        # the plates
+        if self._stream_messages is not None:
+            mask = True
+        super()._set_mask(mask)
+
+
+    def _nan_arrays(self):
+        # The arrays of the full chain are not allocated in the streaming mode
+        if self._stream_messages is not None:
+            return len(self.dims) * [None]
+        return super()._nan_arrays()
+
+
+    def get_moments(self):
+        if self._stream_messages is not None:
+            raise RuntimeError("The moments of a Gaussian Markov chain are "
+                               "not stored in the streaming mode. Use the "
+                               "consume callback instead.")
+        return super().get_moments()
+
+
+    def update(self, annealing=1.0):
+        if self._stream_messages is None:
+            return super().update(annealing=annealing)
+        u_parents = self._message_from_parents()
+        self._update_in_segments(u_parents,
+                                 self._stream_messages,
+                                 annealing=annealing)
+
+
+    def _initialize_from_parent_moments(self, *u_parents):
+        if self._stream_messages is None:
+            return super()._initialize_from_parent_moments(*u_parents)
+        self._update_in_segments(u_parents, None)
+
+
+    def _update_in_segments(self, u_parents, messages, annealing=1.0):
+        """
+        Smooth the chain in segments in the streaming mode.
+
+        Instead of the moments, the node stores the sums of the moments
+        which the messages to the parents are linear in, and the terms of the
+        lower bound which depend only on the posterior approximation.
+        """
+
+        for parent in self.parents[2:4]:
+            if len(parent.plates) >= 2 and parent.plates[-2] != 1:
+                raise ValueError("The dynamics matrix and the innovation "
+                                 "noise must be constant over time in the "
+                                 "streaming mode")
+        if len(self.parents) > 4:
+            raise NotImplementedError("Input signals are not supported in "
+                                      "the streaming mode")
+
+        # Initial state, the second moments summed over the time instances
+        # 0,...,N-2 and 1,...,N-1, and the cross moments summed over the
+        # transitions
+        sums = [0, 0, 0, 0, 0]
+        phi_u = 0
+
+        def phi_blocks(start, stop):
+            phi = self._distribution.compute_phi_blocks(start, stop,
+                                                        *u_parents)
+            if messages is not None:
+                m = messages(start, stop)
+                phi = [phi_i + annealing*m_i for (phi_i, m_i) in zip(phi, m)]
+            return [self.annealing * phi_i for phi_i in phi]
+
+        def consume(start, u, phi):
+            nonlocal phi_u
+            # The last time instance overlaps with the next segment
+            M = np.shape(phi[0])[-2]
+            K = np.shape(phi[2])[-3]
+            phi_u = (phi_u
+                     + np.einsum('...ni,...ni->...', phi[0], u[0][...,:M,:])
+                     + np.einsum('...nij,...nij->...', phi[1], u[1][...,:M,:,:])
+                     + np.einsum('...nij,...nij->...', phi[2], u[2]))
+            if start == 0:
+                sums[0] = u[0][...,0,:]
+                sums[1] = u[1][...,0,:,:]
+            sums[2] = sums[2] + np.sum(u[1][...,:K,:,:], axis=-3)
+            sums[3] = sums[3] + np.sum(u[1][...,max(start,1)-start:M,:,:],
+                                             axis=-3)
+            sums[4] = sums[4] + np.sum(u[2], axis=-3)
+            if self._stream_consume is not None:
+                self._stream_consume(start, u)
+
+        self.g = self._distribution.compute_moments_in_segments(
+            phi_blocks,
+            consume,
+            segment_length=self._segment_length
+        )
+        self._phi_u = phi_u
+        self._sums = sums
+        self._version += 1
+
+
+    def _compute_message_from_sums(self, index, *u_parents):
+        """
+        Compute a message to a parent in the streaming mode.
+
+        The messages to A and v are linear in the moments summed over the
+        transitions.  Thus, they are computed as for a chain of two time
+        instances whose second moments are the sums.  The messages are
+        summed over the transitions.
+        """
+        (x0, x0x0, XnXn_prev, XnXn_next, XpXn) = self._sums
+        if index <= 1:
+            u = [x0[...,np.newaxis,:], x0x0[...,np.newaxis,:,:], None]
+        else:
+            u = [None,
+                 np.stack([XnXn_prev, XnXn_next], axis=-3),
+                 XpXn[...,np.newaxis,:,:]]
+        return self._distribution.compute_message_to_parent(self.parents[index],
+                                                            index,
+                                                            u,
+                                                            *u_parents)
+
+
+    def _get_message_and_mask_to_parent(self, index):
+        if self._stream_messages is None:
+            return super()._get_message_and_mask_to_parent(index)
+        u_parents = self._message_from_parents(exclude=index)
+        m = self._compute_message_from_sums(index, *u_parents)
+        # The messages are multiplied by the number of transitions when they
+        # are summed to the plates of the parent, thus divide the sums by it
+        # (cf. message_sum_multiply)
+        if index == 2:
+            m = [m[0] / (self._distribution.N-1),
+                 m[1] / (self._distribution.N-1)]
+        elif index == 3:
+            m = [m[0] / (self._distribution.N-1),
+                 m[1]]
+        mask = self._distribution.compute_mask_to_parent(index, self.mask)
+        return (m, mask)
+
+
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True):
+        if self._stream_messages is None:
+            return super().lower_bound_contribution(gradient=gradient,
+                                                    ignore_masked=ignore_masked)
+
+        # Annealing temperature
+        T = 1 / self.annealing
+
+        # E[log p(X|parents)] without the constant term equals the sum of the
+        # products of the messages to Lambda and v with their moments
+        u_parents = self._message_from_parents()
+        N = self._distribution.N
+        m = self._compute_message_from_sums(1, *u_parents)
+        L = (np.einsum('...ij,...ij->...', m[0], u_parents[1][0])
+             + m[1] * u_parents[1][1])
+        m = self._compute_message_from_sums(3, *u_parents)
+        L = L + np.sum(m[0] * u_parents[3][0] + 0.5*(N-1) * u_parents[3][1],
+                       axis=(-2,-1))
+
+        # E[-log q(X)] without the constant term
+        L = L - T * (self.g + self._phi_u)
+
+        if ignore_masked:
+            return (np.sum(np.where(self.mask, L, 0))
+                    * self.broadcasting_multiplier(self.plates,
+                                                   np.shape(L),
+                                                   np.shape(self.mask))
+                    * np.prod(self.plates_multiplier))
+        else:
+            return (np.sum(L)
+                    * self.broadcasting_multiplier(self.plates,
+                                                   np.shape(L))
+                    * np.prod(self.plates_multiplier))
 
 
     @classmethod
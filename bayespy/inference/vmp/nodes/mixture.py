@@ -27,6 +27,7 @@ Module for the mixture distribution node.
 
 import warnings
 import numpy as np
+import scipy.sparse
 
 from bayespy.utils import misc
 
@@ -37,6 +38,90 @@ from .expfamily import ExponentialFamily, \
 from .categorical import Categorical, \
                          CategoricalMoments
 
+
+class SparseResponsibilities():
+    """
+    Non-zero responsibilities in coordinate form.
+
+    The messages from a mixture to the cluster parameters use this as the
+    responsibility factor if the responsibilities are sparse (see
+    :func:`sum_multiply_sparse`).  `index` contains the plate indices of the
+    non-zero responsibilities in an array of shape `plates` and `ndim` unit
+    axes are added for the variable dimensions.
+    """
+
+
+    def __init__(self, plates, index, values, ndim):
+        self.plates = tuple(plates)
+        self.index = index
+        self.values = values
+        self.ndim = ndim
+        self.shape = self.plates + ndim*(1,)
+
+
+    def dense(self):
+        index = np.ravel_multi_index(self.index, self.plates)
+        p = np.bincount(index,
+                        weights=self.values,
+                        minlength=int(np.prod(self.plates)))
+        p = np.reshape(p, self.plates)
+        return misc.add_trailing_axes(p, self.ndim)
+
+
+def sum_multiply_sparse(weights, mask, factors, to_shape, from_shape, ndim):
+    """
+    Sum the product of sparse weights and other factors to the target shape.
+
+    Only the elements for which the weight is non-zero are computed.  The
+    weights must have all the plate axes of the product.  Returns None if the
+    shapes are not supported.
+    """
+    shape = misc.broadcasted_shape(weights.shape,
+                                   np.shape(mask),
+                                   *[np.shape(f) for f in factors])
+    plates = shape[:len(shape)-ndim]
+    to_plates = to_shape[:len(to_shape)-ndim]
+    to_dims = to_shape[len(to_shape)-ndim:]
+    if weights.plates != plates or len(to_plates) > len(plates):
+        return None
+
+    def gather(f, y):
+        f = misc.atleast_nd(f, len(shape))
+        return y * f[tuple(i if d > 1 else 0
+                           for (i, d) in zip(weights.index,
+                                             np.shape(f)[:len(plates)]))]
+
+    # Gather the non-zero elements of the product:
+    # Shape(y)      = [M,Dd,..,D0]
+    M = len(weights.values)
+    y = gather(mask, np.reshape(weights.values, (M,) + ndim*(1,)))
+    for f in factors:
+        y = gather(f, y)
+    dims = np.shape(y)[1:]
+
+    # Scatter-add the elements to the target plates:
+    # Shape(y)      = [Mn,..,M0,Dd,..,D0]
+    rows = np.zeros(M, dtype=int)
+    stride = 1
+    for (i, d) in reversed(list(zip(weights.index[len(plates)-len(to_plates):],
+                                    to_plates))):
+        if d > 1:
+            rows += stride * i
+        stride *= d
+    S = scipy.sparse.csr_matrix((np.ones(M), (rows, np.arange(M))),
+                                shape=(stride, M))
+    y = np.reshape(S.dot(np.reshape(y, (M, -1))), tuple(to_plates) + dims)
+
+    # Sum the variable axes which the target does not have
+    axes = tuple(j - ndim
+                 for (j, (d, d_to)) in enumerate(zip(dims, to_dims))
+                 if d != 1 and d_to == 1)
+    if axes:
+        y = np.sum(y, axis=axes, keepdims=True)
+
+    return misc.broadcasting_multiplier(from_shape, shape, to_shape) * y
+
+
 class MixtureDistribution(ExponentialFamilyDistribution):
     """
     Class for the VMP formulas of mixture variables.
@@ -53,6 +138,27 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         self.ndims = ndims
         self.ndims_parents = ndims_parents
         self.K = n_clusters
+        self._nonzero = (None, None)
+
+
+    def _find_nonzero(self, P):
+        """
+        Find the non-zero responsibilities if the responsibilities are sparse.
+
+        Returns the indices and the values of the non-zero elements of P if P
+        is given in the sparse form (e.g., truncated or observed cluster
+        assignments) or None if P is dense.  The result is cached for the
+        latest P because the messages and the natural parameters use the same
+        responsibilities.
+        """
+        if not isinstance(P, misc.SparseCounts):
+            return None
+        if self._nonzero[0] is not P:
+            nonzero = np.nonzero(P.counts)
+            indices = np.broadcast_to(P.indices, np.shape(P.counts))
+            index = nonzero[:-1] + (indices[nonzero],)
+            self._nonzero = (P, (index, P.counts[nonzero]))
+        return self._nonzero[1]
 
 
     def compute_message_to_parent(self, parent, index, u, *u_parents):
@@ -140,9 +246,36 @@ class MixtureDistribution(ExponentialFamilyDistribution):
                                                             u_self, 
                                                             *(u_parents[1:]))
 
+            # Responsibilities for clusters are the first
+            # parent's first moment:
+            # Shape(p)      = [Nn,..,N0,K]
+            P = u_parents[0][0]
+            nonzero = self._find_nonzero(P)
+            if nonzero is None:
+                # Move the cluster axis to the proper place:
+                # Shape(p)      = [Nn,..,K,..,N0]
+                P = misc.atleast_nd(P, abs(self.cluster_plate))
+                P = misc.moveaxis(P, -1, self.cluster_plate)
+            else:
+                # Move the cluster axis of the shape and of the indices of
+                # the non-zero responsibilities similarly
+                (ind, values) = nonzero
+                plates = list(np.shape(P))
+                n = max(len(plates), abs(self.cluster_plate))
+                plates = (n-len(plates))*[1] + plates
+                ind = (list((n-len(ind)) *
+                            [np.zeros(len(values), dtype=int)])
+                       + list(ind))
+                plates.insert(n+self.cluster_plate, plates.pop())
+                ind.insert(n+self.cluster_plate, ind.pop())
+                nonzero = (tuple(ind), values)
+
             # Weigh the messages with the responsibilities
             for i in range(len(m)):
 
+                if m[i] is None:
+                    continue
+
                 # Shape(m)      = [Nn,..,K,..,N0,Dd,..,D0]
                 # Shape(p)      = [Nn,..,N0,K]
                 # Shape(result) = [Nn,..,K,..,N0,Dd,..,D0]
@@ -151,35 +284,22 @@ class MixtureDistribution(ExponentialFamilyDistribution):
                 # the parent message.
                 D = self.ndims_parents[index][i]
 
-                # Responsibilities for clusters are the first
-                # parent's first moment:
-                # Shape(p)      = [Nn,..,N0,K]
-                p = u_parents[0][0]
-                # Move the cluster axis to the proper place:
-                # Shape(p)      = [Nn,..,K,..,N0]
-                p = misc.atleast_nd(p, abs(self.cluster_plate))
-                p = misc.moveaxis(p, -1, self.cluster_plate)
                 # Add axes for variable dimensions to the contributions
                 # Shape(p)      = [Nn,..,K,..,N0,1,..,1]
-                p = misc.add_trailing_axes(p, D)
-
-                if self.cluster_plate < 0:
-                    # Add the variable dimensions
-                    cluster_axis = self.cluster_plate - D
-
-                # Add axis for clusters:
-                # Shape(m)      = [Nn,..,1,..,N0,Dd,..,D0]
-                #m[i] = np.expand_dims(m[i], axis=cluster_axis)
-
-                #
-                # TODO: You could do summing here already so that
-                # you wouldn't compute huge matrices as
-                # intermediate result. Use einsum.
+                if nonzero is None:
+                    p = misc.add_trailing_axes(P, D)
+                else:
+                    p = SparseResponsibilities(plates, *nonzero, D)
 
-                # Compute the message contributions for each
-                # cluster:
+                # Give the message contributions for each cluster as a
+                # product so that the responsibilities are summed over the
+                # plates together with the message without computing the
+                # huge intermediate product (see Node._message_to_parent):
                 # Shape(result) = [Nn,..,K,..,N0,Dd,..,D0]
-                m[i] = m[i] * p
+                if isinstance(m[i], tuple):
+                    m[i] = m[i] + (p,)
+                else:
+                    m[i] = (m[i], p)
 
             return m
 
@@ -208,6 +328,22 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         Phi = self.distribution.compute_phi_from_parents(*(u_parents[1:]))
         # Contributions/weights/probabilities
         P = u_parents[0][0]
+        # Sparse matrix of the responsibilities if they are sparse:
+        # Shape(P_sparse) = [Nn*..*N0,K]
+        nonzero = self._find_nonzero(P)
+        if nonzero is None:
+            P_sparse = None
+            P_dense = P
+        else:
+            P_dense = None
+            (index, values) = nonzero
+            rows = np.zeros(len(values), dtype=int)
+            if np.ndim(P) > 1:
+                rows += np.ravel_multi_index(index[:-1], np.shape(P)[:-1])
+            P_sparse = scipy.sparse.csr_matrix(
+                (values, (rows, index[-1])),
+                shape=(int(np.prod(np.shape(P)[:-1])), np.shape(P)[-1])
+            )
 
         phi = list()
 
@@ -238,9 +374,35 @@ class MixtureDistribution(ExponentialFamilyDistribution):
             else:
                 phi.append(Phi[ind][...,None])
 
+            # If the responsibilities are sparse and the parameters are
+            # shared over the plates, sum only the non-zero terms:
+            # Shape(result) = [Nn,..,N0,Dd,..,D0]
+            plates_phi = np.shape(phi[ind])[:-1-self.ndims[ind]]
+            K = np.shape(phi[ind])[-1]
+            if (P_sparse is not None and K > 1
+                and all(n == 1 for n in plates_phi)):
+                dims = np.shape(phi[ind])[-1-self.ndims[ind]:-1]
+                phi[ind] = np.reshape(
+                    P_sparse.dot(np.reshape(phi[ind], (-1, K)).T),
+                    misc.broadcasted_shape(np.shape(P)[:-1], plates_phi) + dims
+                )
+                continue
+
+            # If the responsibilities are sparse and the parameters are
+            # shared by the clusters, only the sums of the responsibilities
+            # are needed:
+            # Shape(result) = [Nn,..,N0,Dd,..,D0]
+            if P_sparse is not None and K == 1:
+                sum_p = misc.add_trailing_axes(np.sum(P.counts, axis=-1),
+                                               self.ndims[ind])
+                phi[ind] = sum_p * phi[ind][...,0]
+                continue
+
             # Add axes to p:
             # Shape(p)      = [Nn,..,N0,K,1,..,1]
-            p = misc.add_trailing_axes(P, self.ndims[ind])
+            if P_dense is None:
+                P_dense = P.dense()
+            p = misc.add_trailing_axes(P_dense, self.ndims[ind])
             # Move cluster axis to the last:
             # Shape(p)      = [Nn,..,N0,1,..,1,K]
             p = misc.moveaxis(p, -(self.ndims[ind]+1), -1)
@@ -305,7 +467,10 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         # axis and utilize broadcasting:
         # Shape(result) = [Nn,..,N0]
 
-        g = misc.sum_product(p, g, axes_to_sum=-1)
+        if isinstance(p, misc.SparseCounts):
+            g = p.sum_product(g)
+        else:
+            g = misc.sum_product(p, g, axes_to_sum=-1)
 
         return g
 
@@ -314,7 +479,11 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         """
         Compute the moments and :math:`f(x)` for a fixed value.
         """
-        return self.distribution.compute_fixed_moments_and_f(x, mask=True)
+        (u, f) = self.distribution.compute_fixed_moments_and_f(x, mask=True)
+        # The mixture formulas use dense moments
+        u = [ui.dense() if isinstance(ui, misc.SparseCounts) else ui
+             for ui in u]
+        return (u, f)
 
     
     def plates_to_parent(self, index, plates):
@@ -436,11 +605,137 @@ class Mixture(ExponentialFamily):
         X = Mixture(Z, Gaussian, mu, Lambda)
     """
 
+    # The responsibilities are used in the sparse form if the cluster
+    # assignments are truncated or observed
+    _sparse_parents = (0,)
+
 
     def __init__(self, z, node_class, *params, cluster_plate=-1, **kwargs):
         self.cluster_plate = cluster_plate
         super().__init__(z, node_class, *params, cluster_plate=cluster_plate,
                          **kwargs)
+
+
+    def _dead_axes(self, mass=1e-3, precision=1e6):
+        """
+        Find the clusters whose expected number of members is below `mass`.
+        """
+        z = self.parents[0]
+        if not isinstance(z, Categorical) or np.any(z.observed):
+            return []
+        K = self._distribution.K
+        p = z.u[0]
+        if isinstance(p, misc.SparseCounts):
+            counts = np.bincount(
+                np.ravel(np.broadcast_to(p.indices, np.shape(p.counts))),
+                weights=np.ravel(p.counts),
+                minlength=K
+            )
+        else:
+            counts = np.sum(np.reshape(p, (-1, K)), axis=0)
+        counts = (counts
+                  * self.broadcasting_multiplier(z.plates, np.shape(p)[:-1]))
+        keep = np.flatnonzero(counts >= mass)
+        if len(keep) == 0:
+            keep = np.array([np.argmax(counts)])
+        if len(keep) == K:
+            return []
+        return [('cluster', keep)]
+
+
+    def _prune_axis_to_parent(self, index, axis):
+        """
+        The cluster axis is the variable axis of the cluster assignments and a
+        plate axis of the cluster parameters.
+        """
+        if index == 0:
+            if axis == 'cluster':
+                return 0
+            return super()._prune_axis_to_parent(index, axis)
+        if not isinstance(axis, int):
+            if axis != 'cluster':
+                raise NotImplementedError()
+            axis = self.cluster_plate
+        elif axis >= 0:
+            raise NotImplementedError()
+        elif axis <= self.cluster_plate:
+            axis = axis - 1
+        parent = self.parents[index]
+        distribution = self._distribution.distribution
+        if distribution.plates_from_parent(index-1,
+                                           parent.plates) != parent.plates:
+            raise NotImplementedError()
+        if len(parent.plates) < -axis or parent.plates[axis] == 1:
+            return None
+        return axis
+
+
+    def _prune_axis_from_parent(self, index, axis):
+        if not isinstance(axis, int):
+            return None
+        if index == 0:
+            if axis >= 0:
+                return 'cluster'
+            return super()._prune_axis_from_parent(index, axis)
+        parent = self.parents[index]
+        distribution = self._distribution.distribution
+        if (axis >= 0 or
+            distribution.plates_from_parent(index-1,
+                                            parent.plates) != parent.plates):
+            raise NotImplementedError()
+        if axis == self.cluster_plate:
+            return 'cluster'
+        elif axis < self.cluster_plate:
+            return axis + 1
+        return axis
+
+
+    def _prune_size(self, axis):
+        if axis == 'cluster':
+            return self._distribution.K
+        return super()._prune_size(axis)
+
+
+    def _prune(self, axis, keep):
+        if axis != 'cluster':
+            return super()._prune(axis, keep)
+        K = len(keep)
+        self._distribution.K = K
+        self._distribution._nonzero = (None, None)
+        self._parent_moments = ([CategoricalMoments(K)]
+                                + list(self._parent_moments[1:]))
+        self._message_cache = {}
+
+
+    def _sum_multiply_message_to_plates(self, index, factors, mask, to_shape,
+                                        from_shape, ndim):
+        """
+        Sum the messages to the cluster parameters over the non-zero
+        responsibilities only if the responsibilities are sparse.
+        """
+        # The responsibilities are the last factor of the messages to the
+        # cluster parameters (see MixtureDistribution.compute_message_to_parent)
+        # and the other factors may contain the responsibilities of nested
+        # mixtures
+        weights = factors[-1]
+        factors = [f.dense() if isinstance(f, SparseResponsibilities) else f
+                   for f in factors[:-1]]
+        if isinstance(weights, SparseResponsibilities):
+            m = sum_multiply_sparse(weights,
+                                    mask,
+                                    factors,
+                                    to_shape,
+                                    from_shape,
+                                    ndim)
+            if m is not None:
+                return m
+            weights = weights.dense()
+        return super()._sum_multiply_message_to_plates(index,
+                                                       factors + [weights],
+                                                       mask,
+                                                       to_shape,
+                                                       from_shape,
+                                                       ndim)
         
 
     @classmethod
@@ -541,7 +836,7 @@ class Mixture(ExponentialFamily):
 
             # Cluster assignments/probabilities/weights
             # Shape(p) = [N1,..,Nn,K]
-            p = u_parents[0][0]
+            p = np.asarray(u_parents[0][0])
 
             # Weighted average. TODO/FIXME: Use einsum!
             # Shape(pdf) = [M1,..,Mm,N1,..,Nn]
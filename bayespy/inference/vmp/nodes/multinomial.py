@@ -26,6 +26,7 @@ Module for the multinomial distribution node.
 """
 
 import numpy as np
+import scipy.sparse
 from scipy import special
 
 from .expfamily import ExponentialFamily
@@ -124,6 +125,14 @@ class MultinomialDistribution(ExponentialFamilyDistribution):
         g = -np.squeeze(N * logsum_p, axis=-1)
         return (u, g)
 
+
+    def compute_cgf(self, phi):
+        """
+        Compute :math:`g(\phi)` without the moments.
+        """
+        logsum_p = misc.logsumexp(phi[0], axis=-1)
+        return -self.N * logsum_p
+
     
     def compute_cgf_from_parents(self, u_p):
         """
@@ -137,8 +146,17 @@ class MultinomialDistribution(ExponentialFamilyDistribution):
         Compute the moments and :math:`f(x)` for a fixed value.
         """
 
+        # Sparse counts (e.g., bag-of-words data) are kept sparse
+        if scipy.sparse.issparse(x):
+            x = misc.SparseCounts.from_matrix(x)
+        if isinstance(x, misc.SparseCounts):
+            u0 = x
+            x = x.counts
+        else:
+            x = np.asanyarray(x)
+            u0 = x.copy()
+
         # Check that counts are valid
-        x = np.asanyarray(x)
         if not misc.isinteger(x):
             raise ValueError("Counts must be integers")
         if np.any(x < 0):
@@ -147,7 +165,6 @@ class MultinomialDistribution(ExponentialFamilyDistribution):
             raise ValueError("Counts must sum to the number of trials")
 
         # Moments is just the counts vector
-        u0 = x.copy()
         u = [u0]
 
         f = special.gammaln(self.N+1) - np.sum(special.gammaln(x+1), axis=-1)
@@ -181,6 +198,10 @@ class Multinomial(ExponentialFamily):
         \mathrm{Multinomial}(\mathbf{x}| N, \mathbf{p}) = \frac{N!}{x_0!\cdots
         x_{K-1}!} p_0^{x_0} \cdots p_{K-1}^{x_{K-1}}
 
+    The observed counts can be given as a two-dimensional scipy.sparse matrix
+    (e.g., word counts of documents), in which case only the non-zero counts
+    are stored and used in the computations.
+
     Parameters
     ----------
 
@@ -198,6 +219,10 @@ class Multinomial(ExponentialFamily):
     _moments = MultinomialMoments()
     _parent_moments = (DirichletMoments(),)
 
+    # Whether the moments are computed from the natural parameters when they
+    # are needed next time
+    _pending_moments = False
+
 
     def __init__(self, n, p, **kwargs):
         """
@@ -205,6 +230,48 @@ class Multinomial(ExponentialFamily):
         """
         super().__init__(n, p, **kwargs)
 
+
+    @property
+    def u(self):
+        """ Moments of the node """
+        if self._pending_moments:
+            self._pending_moments = False
+            mask = np.logical_not(self.observed)
+            (u, g) = self._distribution.compute_moments_and_cgf(self.phi,
+                                                                mask=mask)
+            self._set_moments(u, mask=mask)
+        return self._u
+
+
+    @u.setter
+    def u(self, value):
+        self._u = value
+        return
+
+
+    def _initialize_from_parent_moments(self, *u_parents):
+        """
+        Initialize the natural parameters and the CGF from the parent moments.
+
+        The moments have the plates of the number of trials and all the
+        categories (e.g., documents and words), thus they are not computed
+        until they are needed.  For observed nodes, they are never computed.
+        """
+        if not np.all(self.observed):
+            self._update_phi_from_parents(*u_parents)
+            mask = np.logical_not(self.observed)
+            g = self._distribution.compute_cgf(self.phi)
+            self.g = np.where(mask, g, self.g)
+            self._pending_moments = True
+            self._version += 1
+
+
+    def _set_moments(self, u, mask=True):
+        # Moments set for all the plates replace the pending moments
+        if np.all(mask):
+            self._pending_moments = False
+        super()._set_moments(u, mask=mask)
+
     
     @classmethod
     def _constructor(cls, n, p, **kwargs):
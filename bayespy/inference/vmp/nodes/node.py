@@ -30,6 +30,26 @@ from bayespy.utils import misc
 This module contains a sketch of a new implementation of the framework.
 """
 
+def prune_array(x, axis, keep, dims, ndim):
+    """
+    Take the kept elements along a plate or variable axis of an array.
+
+    The array has the given variable dimensions `dims` at the end.  These
+    dimensions consist of copies of the `ndim` variable axes of the node (e.g.,
+    the second moment of a Gaussian variable), and the given variable axis is
+    taken from each copy.  A negative `axis` refers to a plate axis.  Unit and
+    missing axes are broadcasted, thus they are not modified.
+    """
+    if axis < 0:
+        axes = [axis - len(dims)]
+    else:
+        axes = [axis - len(dims) + j*ndim for j in range(len(dims) // ndim)]
+    for a in axes:
+        if np.ndim(x) >= -a and np.shape(x)[a] > 1:
+            x = np.take(x, keep, axis=a)
+    return x
+
+
 def message_sum_multiply(plates_parent, dims_parent, *arrays):
     """
     Compute message to parent and sum over plates.
@@ -227,6 +247,14 @@ class Node():
 
     _id_counter = 0
 
+    # Counter which is incremented whenever the moments of the node change.
+    # Deterministic nodes use the counters of their parents to decide whether
+    # their cached moments are still valid.
+    _version = 0
+
+    # Counter which is incremented whenever the mask of the node changes
+    _mask_version = 0
+
     @ensureparents
     def __init__(self, *parents, dims=None, plates=None, name="", 
                  notify_parents=True, plotter=None, plates_multiplier=None):
@@ -264,6 +292,9 @@ class Node():
         # Children
         self.children = set()
 
+        # Cached messages to parents: parent index -> (version, message)
+        self._message_cache = {}
+
         # Get and validate the plate multiplier
         parent_plates_multiplier = [self._plates_multiplier_from_parent(index) 
                                    for index in range(len(self.parents))]
@@ -403,6 +434,7 @@ class Node():
             mask = np.logical_or(mask, child._mask_to_parent(index))
         # Set the mask of this node
         self._set_mask(mask)
+        self._mask_version += 1
         if not misc.is_shape_subset(np.shape(self.mask), self.plates):
 
             raise ValueError("The mask of the node %s has updated "
@@ -472,9 +504,12 @@ class Node():
         return mask
     #return self._compute_mask_to_parent(index, self.get_mask())
 
-    def _message_to_child(self):
+    def _message_to_child(self, sparse=False):
 
-        u = self.get_moments()
+        if sparse:
+            u = self._get_sparse_moments()
+        else:
+            u = self.get_moments()
         
         # Debug: Check that the message has appropriate shape
         for (ui, dim) in zip(u, self.dims):
@@ -566,6 +601,14 @@ class Node():
             # Empty messages are given as None. We can ignore those.
             if m[i] is not None:
 
+                # The message may be given as a tuple of arrays whose product
+                # is the message.  Then, the product is summed to the plates of
+                # the parent without computing it explicitly.
+                if isinstance(m[i], tuple):
+                    factors = m[i]
+                else:
+                    factors = (m[i],)
+
                 try:
                     r = self.broadcasting_multiplier(self.plates_multiplier,
                                                      multiplier_parent)
@@ -582,8 +625,9 @@ class Node():
                 ndim = len(parent.dims[i])
                 # Source and target shapes
                 if ndim > 0:
-                    dims = misc.broadcasted_shape(np.shape(m[i])[-ndim:],
-                                                  parent.dims[i])
+                    dims = misc.broadcasted_shape(*([np.shape(f)[-ndim:]
+                                                     for f in factors]
+                                                    + [parent.dims[i]]))
                     from_shape = plates_self + dims
                 else:
                     from_shape = plates_self
@@ -592,18 +636,82 @@ class Node():
                 mask_i = misc.add_trailing_axes(mask, ndim)
                 # Apply mask and sum plate axes as necessary (and apply plate
                 # multiplier)
-                m[i] = r * misc.sum_multiply_to_plates(m[i], mask_i,
-                                                       to_plates=to_shape,
-                                                       from_plates=from_shape,
-                                                       ndim=0)
+                m[i] = r * self._sum_multiply_message_to_plates(index,
+                                                                factors,
+                                                                mask_i,
+                                                                to_shape,
+                                                                from_shape,
+                                                                ndim)
+
+        return m
+
+    def _sum_multiply_message_to_plates(self, index, factors, mask, to_shape,
+                                        from_shape, ndim):
+        """
+        Sum the product of the message factors and the mask to the parent.
+
+        Child classes may override this method in order to utilize the
+        structure of the factors.  `ndim` is the number of the variable axes
+        at the end of `to_shape` and `from_shape`.
+        """
+        if len(factors) == 1 and isinstance(factors[0], misc.SparseCounts):
+            return factors[0].sum_to_plates(mask, to_shape, from_shape)
+        return misc.sum_multiply_to_plates(*factors, mask,
+                                           to_plates=to_shape,
+                                           from_plates=from_shape,
+                                           ndim=0)
+
+    def _message_to_parent_version(self, index):
+        """
+        Return a token which changes whenever the message to parent[index]
+        may change.
+
+        The message depends on the moments of this node, the moments of the
+        other parents and the mask.
+        """
+        return (self._get_version(),
+                self._mask_version,
+                tuple(parent._get_version()
+                      for (ind, parent) in enumerate(self.parents)
+                      if ind != index))
+
+    def _lower_bound_version(self):
+        """
+        Return a token which changes whenever the lower bound contribution of
+        the node may change.
+
+        The contribution depends on the moments of this node, the moments of
+        the parents and the mask.
+        """
+        return (self._get_version(),
+                self._mask_version,
+                tuple(parent._get_version() for parent in self.parents))
 
+    def _get_message_to_parent(self, index):
+        """
+        Return the message to parent[index] using the cache if possible.
+
+        The message is recomputed only if the version token of the message has
+        changed since the message was cached.
+        """
+        version = self._message_to_parent_version(index)
+        try:
+            (cached_version, m) = self._message_cache[index]
+        except KeyError:
+            pass
+        else:
+            if cached_version == version:
+                return list(m)
+        m = self._message_to_parent(index)
+        if not callable(m):
+            self._message_cache[index] = (version, list(m))
         return m
 
     def _message_from_children(self):
         msg = [np.zeros(shape) for shape in self.dims]
         #msg = [np.array(0.0) for i in range(len(self.dims))]
         for (child,index) in self.children:
-            m = child._message_to_parent(index)
+            m = child._get_message_to_parent(index)
             for i in range(len(self.dims)):
                 if m[i] is not None:
                     # Check broadcasting shapes
@@ -616,15 +724,32 @@ class Node():
 
         return msg
 
+    # Indices of the parents whose moments this node accepts in the sparse
+    # form (misc.SparseCounts)
+    _sparse_parents = ()
+
     def _message_from_parents(self, exclude=None):
-        return [list(parent._message_to_child())
-                if ind != exclude else
-                None
+        return [None if ind == exclude else
+                list(parent._message_to_child(sparse=True))
+                if ind in self._sparse_parents else
+                list(parent._message_to_child())
                 for (ind,parent) in enumerate(self.parents)]
 
     def get_moments(self):
         raise NotImplementedError()
 
+    def _get_sparse_moments(self):
+        """
+        Return the moments without converting sparse moments to dense arrays.
+        """
+        return self.get_moments()
+
+    def _get_version(self):
+        """
+        Return a token which changes whenever the moments of the node change.
+        """
+        return self._version
+
     def delete(self):
         """
         Delete this node and the children
@@ -634,6 +759,92 @@ class Node():
         for (ind, parent) in enumerate(self.parents):
             parent._remove_child(self, ind)
 
+    # Indices of the parents whose variable axes are the variable axes of this
+    # node (used for pruning)
+    _prune_dims_parents = ()
+
+    def _prune_axis_to_parent(self, index, axis):
+        """
+        Return the axis of a parent which corresponds to an axis of this node.
+
+        Negative integers refer to plate axes and non-negative integers to
+        variable axes.  Other axis tokens are specific to the node (e.g., the
+        cluster axis of a mixture).  Returns None if the parent does not have
+        the axis, that is, the axis is broadcasted.  Raises NotImplementedError
+        if the mapping is not known.
+        """
+        parent = self.parents[index]
+        if not isinstance(axis, int):
+            raise NotImplementedError()
+        if axis < 0:
+            if self._plates_from_parent(index) != parent.plates:
+                raise NotImplementedError()
+            if len(parent.plates) < -axis or parent.plates[axis] == 1:
+                return None
+            return axis
+        if index not in self._prune_dims_parents:
+            raise NotImplementedError()
+        if parent.dims[0][axis] == 1:
+            return None
+        return axis
+
+    def _prune_axis_from_parent(self, index, axis):
+        """
+        Return the axis of this node which corresponds to an axis of a parent.
+
+        Returns None if the axis is summed out (e.g., a contracted axis), thus
+        this node is not affected.  Raises NotImplementedError if the mapping
+        is not known.
+        """
+        if not isinstance(axis, int):
+            return None
+        if axis < 0:
+            if self._plates_from_parent(index) != self.parents[index].plates:
+                raise NotImplementedError()
+            return axis
+        if index not in self._prune_dims_parents:
+            raise NotImplementedError()
+        return axis
+
+    def _prune_size(self, axis):
+        """
+        Return the length of an axis of this node.
+        """
+        if not isinstance(axis, int):
+            raise NotImplementedError()
+        if axis < 0:
+            return self.plates[axis]
+        return self.dims[0][axis]
+
+    def _prune(self, axis, keep):
+        """
+        Keep only the given elements along an axis of this node.
+
+        Sub-classes should take the elements from their arrays and then call
+        this method, which updates the plates or the dimensions.
+        """
+        if not isinstance(axis, int):
+            raise NotImplementedError()
+        if axis < 0:
+            plates = list(self.plates)
+            plates[axis] = len(keep)
+            self.plates = tuple(plates)
+        else:
+            ndim = len(self.dims[0])
+            self.dims = tuple(tuple(len(keep) if j % ndim == axis else d
+                                    for (j, d) in enumerate(dim))
+                              for dim in self.dims)
+        self._message_cache = {}
+
+    def _dead_axes(self, mass=1e-3, precision=1e6):
+        """
+        Return the axes of this node which have components with no effect.
+
+        Returns a list of (axis, keep) pairs, where `keep` are the indices of
+        the components to keep.  See VB.prune.
+        """
+        return []
+
     @staticmethod
     def broadcasting_multiplier(plates, *args):
         return misc.broadcasting_multiplier(plates, *args)
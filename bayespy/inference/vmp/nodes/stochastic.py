@@ -25,7 +25,7 @@ import numpy as np
 
 from bayespy.utils import misc
 
-from .node import Node
+from .node import Node, prune_array
 
 class Distribution():
     """
@@ -122,8 +122,10 @@ class Stochastic(Node):
                          **kwargs)
 
         # Initialize moment array
-        axes = len(self.plates)*(1,)
-        self.u = [misc.nans(axes+dim) for dim in dims]
+        self.u = self._nan_arrays()
+
+        # Dense arrays of the sparse moments for the latest version
+        self._dense_u = {}
 
         # Not observed
         self.observed = False
@@ -134,6 +136,17 @@ class Stochastic(Node):
             self.initialize_from_prior()
 
 
+    def _nan_arrays(self):
+        """
+        Return arrays of NaNs with the shapes of the moments.
+
+        These are used for the moments (and the parameters) of a node which
+        has not been initialized.
+        """
+        axes = len(self.plates)*(1,)
+        return [misc.nans(axes+dim) for dim in self.dims]
+
+
     def _get_id_list(self):
         """
         Returns the stochastic ID list.
@@ -164,8 +177,23 @@ class Stochastic(Node):
 
     def get_moments(self):
         # Just for safety, do not return a reference to the moment list of this
-        # node but instead create a copy of the list. 
-        return [ui for ui in self.u]
+        # node but instead create a copy of the list.  The children expect
+        # dense arrays, thus sparse observations are converted.  The
+        # conversion is cached until the moments change.
+        return [self._get_dense_moment(ind) for ind in range(len(self.u))]
+
+    def _get_sparse_moments(self):
+        return list(self.u)
+
+    def _get_dense_moment(self, ind):
+        ui = self.u[ind]
+        if not isinstance(ui, misc.SparseCounts):
+            return ui
+        cached = self._dense_u.get(ind)
+        if cached is None or cached[0] != self._version or cached[1] is not ui:
+            cached = (self._version, ui, ui.dense())
+            self._dense_u[ind] = cached
+        return cached[2]
 
     def _get_message_and_mask_to_parent(self, index):
         u_parents = self._message_from_parents(exclude=index)
@@ -185,6 +213,13 @@ class Stochastic(Node):
         # Store the computed moments u but do not change moments for
         # observations, i.e., utilize the mask.
         for ind in range(len(u)):
+            # Sparse moments (e.g., observations of categorical variables) are
+            # stored as they are if they are set for all plates.  Otherwise,
+            # they are merged as dense arrays.
+            if isinstance(u[ind], misc.SparseCounts) and np.all(mask):
+                self.u[ind] = u[ind]
+                continue
+
             # Add axes to the mask for the variable dimensions (mask
             # contains only axes for the plates).
             u_mask = misc.add_trailing_axes(mask, self.ndims[ind])
@@ -202,10 +237,10 @@ class Stochastic(Node):
             # latent variables, then use such a mask.
             
             # Use mask to update only unobserved plates and keep the
-            # observed as before
-            np.copyto(self.u[ind],
-                      u[ind],
-                      where=u_mask)
+            # observed as before. The array is replaced instead of modified in
+            # place, so references to the previous moments (e.g., autosave
+            # snapshots) stay valid.
+            self.u[ind] = np.where(u_mask, u[ind], self.u[ind])
 
             # Make sure u has the correct number of dimensions:
             # TODO/FIXME: Maybe it would be good to also check that u has a
@@ -229,6 +264,8 @@ class Stochastic(Node):
                        self.plates,
                        self.dims[ind]))
 
+        self._version += 1
+
                 
     def update(self, annealing=1.0):
         if not np.all(self.observed):
@@ -258,6 +295,15 @@ class Stochastic(Node):
         # Sub-classes should implement this
         raise NotImplementedError()
 
+    def _prune(self, axis, keep):
+        ndim = len(self.dims[0])
+        self.u = [prune_array(ui, axis, keep, dim, ndim)
+                  for (ui, dim) in zip(self.u, self.dims)]
+        self.observed = prune_array(self.observed, axis, keep, (), ndim)
+        self.mask = prune_array(self.mask, axis, keep, (), ndim)
+        super()._prune(axis, keep)
+        self._version += 1
+
 
 
     def save(self, group):
@@ -282,6 +328,7 @@ class Stochastic(Node):
         for i in range(len(self.u)):
             ui = group['u%d' % i][...]
             self.u[i] = ui
+        self._version += 1
 
         old_observed = self.observed
         self.observed = group['observed'][...]
@@ -36,9 +36,11 @@ import scipy
 from bayespy.nodes import (Categorical,
                            Dirichlet,
                            Mixture,
-                           Gamma)
+                           Gamma,
+                           GaussianARD)
 
 from bayespy.utils import random
+from bayespy.utils import misc
 
 from bayespy.utils.misc import TestCase
 
@@ -142,6 +144,62 @@ class TestCategorical(TestCase):
         pass
 
 
+    def test_truncation(self):
+        """
+        Test the truncated posterior approximation of categorical nodes.
+        """
+
+        # Retain the most probable categories
+        p = np.array([[0.1, 0.4, 0.2, 0.3],
+                      [0.5, 0.1, 0.1, 0.3]])
+        X = Categorical(p, truncation=2)
+        self.assertIsInstance(X.u[0], misc.SparseCounts)
+        self.assertEqual(np.shape(X.u[0].indices), (2, 2))
+        u = X._message_to_child()
+        self.assertAllClose(u[0],
+                            [[0, 4/7, 0, 3/7],
+                             [5/8, 0, 0, 3/8]])
+        self.assertAllClose(X.g,
+                            -np.log([0.7, 0.8]))
+
+        # Retain the categories above the threshold
+        X = Categorical(p, truncation=0.25)
+        u = X._message_to_child()
+        self.assertAllClose(u[0],
+                            [[0, 4/7, 0, 3/7],
+                             [5/8, 0, 0, 3/8]])
+        self.assertAllClose(X.g,
+                            -np.log([0.7, 0.8]))
+        X = Categorical(p, truncation=0.45)
+        u = X._message_to_child()
+        self.assertAllClose(u[0],
+                            [[0, 1, 0, 0],
+                             [1, 0, 0, 0]])
+
+        # No truncation if all categories are retained
+        X = Categorical(p, truncation=4)
+        u = X._message_to_child()
+        self.assertAllClose(u[0], p)
+
+        # The lower bound uses the truncated distribution
+        P = Dirichlet([1, 2, 3])
+        X = Categorical(P, truncation=2)
+        Y = Mixture(X, GaussianARD, [-1, 0, 1], 1)
+        Y.observe(-0.5)
+        X.update()
+        u = X.get_moments()[0]
+        self.assertEqual(np.count_nonzero(u), 2)
+        logp = P._message_to_child()[0]
+        self.assertAllClose(X.lower_bound_contribution(),
+                            np.sum(u[u>0]*(logp[u>0] - np.log(u[u>0]))))
+
+        # Invalid truncation
+        self.assertRaises(ValueError, Categorical, p, truncation=0)
+        self.assertRaises(ValueError, Categorical, p, truncation=1.5)
+
+        pass
+
+
     def test_observed(self):
         """
         Test observed categorical nodes
@@ -190,6 +248,43 @@ class TestCategorical(TestCase):
         pass
 
     
+    def test_sparse_observations(self):
+        """
+        Test that observations are used without the dense one-hot vectors
+        """
+
+        x = np.array([[2, 0, 2],
+                      [1, 3, 2]])
+        p = Dirichlet([1, 2, 3, 4], plates=(3,))
+        X = Categorical(p, plates=(2,3))
+        X.observe(x)
+        self.assertIsInstance(X.u[0], misc.SparseCounts)
+        x1 = np.zeros((2,3,4))
+        x1[[[0],[1]], [0,1,2], x] = 1
+        self.assertAllClose(X.get_moments()[0], x1)
+
+        # The dense moments are computed only once for each observation
+        self.assertIs(X.get_moments()[0], X.get_moments()[0])
+        X.observe(x[::-1])
+        self.assertAllClose(X.get_moments()[0], x1[::-1])
+        X.observe(x)
+
+        # Message to the parent (counts)
+        m = X._message_to_parent(0)
+        self.assertAllClose(m[0], np.sum(x1, axis=0))
+
+        # Lower bound and log pdf
+        logp = p.get_moments()[0]
+        self.assertAllClose(X.lower_bound_contribution(),
+                            np.sum(x1*logp))
+        X = Categorical([0.1, 0.2, 0.3, 0.4], plates=(2,3))
+        self.assertAllClose(X.logpdf(x),
+                            np.log([[0.3, 0.1, 0.3],
+                                    [0.2, 0.4, 0.3]]))
+
+        pass
+
+
     def test_constant(self):
         """
         Test constant categorical nodes
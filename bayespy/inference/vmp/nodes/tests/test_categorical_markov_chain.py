@@ -32,6 +32,8 @@ import numpy as np
 from bayespy.utils import misc
 
 from bayespy.inference.vmp.nodes import CategoricalMarkovChain, \
+                                        Mixture, \
+                                        GaussianARD, \
                                         Dirichlet
 
 
@@ -218,5 +220,156 @@ class TestCategoricalMarkovChain(misc.TestCase):
                                        states=4)
             z = Z.random()
             self.assertAllClose(z, [0, 1, 1, 0])
+
+            # Draw sample from the posterior
+            Z = CategoricalMarkovChain([0.5, 0.5], [[0.5, 0.5],
+                                                    [0, 1]],
+                                       states=3,
+                                       plates=(4,))
+            Y = Mixture(Z, GaussianARD, [-1, 1], 100)
+            Y.observe([[-1, -1, 1]] * 4)
+            Z.update()
+            z = Z.random()
+            self.assertAllClose(z, np.ones((4,1))*[0, 0, 1])
         
         pass
+
+
+    def test_time_homogeneous(self):
+        """
+        Test time-homogeneous representation of categorical Markov chain
+        """
+
+        def check(plates_Z, plates_A):
+            np.random.seed(1)
+            N = 10
+            y = np.random.randn(*(plates_Z+(N,)))
+            mu = np.random.randn(3)
+            p0 = Dirichlet(np.random.rand(3))
+            p0.update()
+            A = Dirichlet(np.random.rand(*(plates_A+(1,3,3))),
+                          plates=plates_A+(1,3))
+            A.update()
+            Zs = [CategoricalMarkovChain(p0, A,
+                                         states=N,
+                                         plates=plates_Z,
+                                         time_homogeneous=time_homogeneous)
+                  for time_homogeneous in (False, True)]
+            for Z in Zs:
+                Y = Mixture(Z, GaussianARD, mu, 1)
+                Y.observe(y)
+                Z.update()
+            (u, v) = (Zs[0].get_moments(), Zs[1].get_moments())
+            self.assertEqual(Zs[1].dims, ((3,), (3,3), (N-1,3)))
+            self.assertAllClose(v[0], u[0])
+            self.assertAllClose(v[1], np.sum(u[1], axis=-3))
+            self.assertAllClose(v[2], np.sum(u[1], axis=-2))
+            self.assertAllClose(Zs[1].lower_bound_contribution(),
+                                Zs[0].lower_bound_contribution())
+            (m, n) = (Zs[0]._message_to_parent(1),
+                      Zs[1]._message_to_parent(1))
+            self.assertAllClose(n[0], m[0])
+            pass
+
+        check((), ())
+        check((2,), ())
+        check((2,), (2,))
+
+        # Transition matrix varying in time
+        p0 = np.random.dirichlet([1, 1])
+        P = np.random.dirichlet([1, 1], size=(3,2))
+        self.assertRaises(ValueError,
+                          CategoricalMarkovChain,
+                          p0,
+                          P,
+                          time_homogeneous=True)
+
+        pass
+
+
+    def test_sparse_transitions(self):
+        """
+        Test sparse transitions of categorical Markov chain
+        """
+
+        np.random.seed(1)
+        N = 10
+        transitions = np.array([[True, True, False],
+                                [False, True, True],
+                                [True, False, True]])
+        (rows, cols) = np.nonzero(transitions)
+        y = np.random.randn(2, N)
+        mu = np.random.randn(3)
+        p0 = Dirichlet(np.random.rand(3))
+        p0.update()
+        A = Dirichlet(np.where(transitions, 1, 1e-300)[None,:,:],
+                      plates=(1,3))
+        A.update()
+        Zs = [CategoricalMarkovChain(p0, A,
+                                     states=N,
+                                     plates=(2,),
+                                     time_homogeneous=True,
+                                     transitions=t)
+              for t in (None, transitions)]
+        for Z in Zs:
+            Y = Mixture(Z, GaussianARD, mu, 1)
+            Y.observe(y)
+            Z.update()
+        (u, v) = (Zs[0].get_moments(), Zs[1].get_moments())
+        self.assertEqual(Zs[1].dims, ((3,), (6,), (N-1,3)))
+        self.assertAllClose(v[0], u[0])
+        self.assertAllClose(v[1], u[1][...,rows,cols])
+        self.assertAllClose(v[2], u[2])
+        (m, n) = (Zs[0]._message_to_parent(1),
+                  Zs[1]._message_to_parent(1))
+        self.assertAllClose(n[0][...,rows,cols], m[0][...,rows,cols])
+        self.assertTrue(np.all(n[0][...,~transitions] == 0))
+
+        # Sampling uses only the allowed transitions
+        z = Zs[1].random()
+        self.assertEqual(np.shape(z), (2, N))
+        self.assertTrue(np.all(transitions[z[...,:-1],z[...,1:]]))
+
+        # Invalid allowed transitions
+        self.assertRaises(ValueError,
+                          CategoricalMarkovChain,
+                          p0,
+                          A,
+                          states=N,
+                          transitions=np.ones((2,2), dtype=bool))
+        self.assertRaises(ValueError,
+                          CategoricalMarkovChain,
+                          p0,
+                          A,
+                          states=N,
+                          transitions=np.diag([True, True, False]))
+
+        pass
+
+
+    def test_map_states(self):
+        """
+        Test the most probable state sequence of categorical Markov chain
+        """
+
+        for time_homogeneous in (False, True):
+            Z = CategoricalMarkovChain([0.5, 0.5], [[0.5, 0.5],
+                                                    [0.1, 0.9]],
+                                       states=4,
+                                       plates=(3,),
+                                       time_homogeneous=time_homogeneous)
+            Y = Mixture(Z, GaussianARD, [-1, 1], 1)
+            Y.observe([[-1, -1, 0.2, 1]] * 3)
+            Z.update()
+            z = Z.map_states()
+            self.assertAllClose(z, np.ones((3,1))*[0, 0, 1, 1])
+
+            segments = {}
+            def consume(start, z_segment):
+                segments[start] = z_segment
+            Z.stream_map_states(consume, segment_length=2)
+            self.assertEqual(sorted(segments), [0, 2])
+            self.assertAllClose(segments[0], np.ones((3,1))*[0, 0])
+            self.assertAllClose(segments[2], np.ones((3,1))*[1, 1])
+
+        pass
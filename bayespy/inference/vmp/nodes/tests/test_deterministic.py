@@ -38,6 +38,49 @@ from numpy import testing
 from ..node import Node, Moments
 from ..deterministic import tile
 from ..stochastic import Stochastic
+from ..gaussian import GaussianARD
+from ..dot import SumMultiply
+
+
+class TestDeterministic(unittest.TestCase):
+
+    def test_get_moments(self):
+        """
+        Test the caching of the moments of deterministic nodes.
+        """
+
+        X1 = GaussianARD(2, 1, shape=(3,))
+        X2 = GaussianARD(3, 1, shape=(3,))
+        Y = SumMultiply('i,i', X1, X2)
+
+        # Count the number of times the moments are computed
+        calls = []
+        compute_moments = Y._compute_moments
+        def counting_compute_moments(*u):
+            calls.append(None)
+            return compute_moments(*u)
+        Y._compute_moments = counting_compute_moments
+
+        # Moments are computed only once if the parents do not change
+        u = Y.get_moments()
+        testing.assert_allclose(u[0], 3*2*3)
+        u = Y.get_moments()
+        testing.assert_allclose(u[0], 3*2*3)
+        self.assertEqual(len(calls), 1)
+
+        # Moments are recomputed if a parent changes
+        X1.initialize_from_value([1, 1, 1])
+        u = Y.get_moments()
+        testing.assert_allclose(u[0], 3*1*3)
+        self.assertEqual(len(calls), 2)
+
+        # Modifying the returned list does not affect the cache
+        u[0] = None
+        u = Y.get_moments()
+        testing.assert_allclose(u[0], 3*1*3)
+        self.assertEqual(len(calls), 2)
+
+        pass
 
 
 class TestTile(unittest.TestCase):
@@ -904,6 +904,40 @@ class TestSumMultiply(TestCase):
 
         pass
 
+
+    def test_message_to_parent_with_multiplier(self):
+        """
+        Test the plate multiplier in the message from SumMultiply.
+        """
+
+        c = np.random.randn(3, 1, 2)
+        x = np.random.randn(4, 2)
+        y = np.random.randn(3, 4)
+
+        def messages(multiplier):
+            C = GaussianARD(c, 1, shape=(2,))
+            X = GaussianARD(x, 1,
+                            shape=(2,),
+                            plates=(4,),
+                            plates_multiplier=multiplier)
+            F = SumMultiply('i,i', C, X)
+            Y = GaussianARD(F, 1)
+            Y.observe(y)
+            return (F._message_to_parent(0), F._message_to_parent(1))
+
+        (m_C, m_X) = messages(None)
+        (m_C_5, m_X_5) = messages((5,))
+
+        # Only the messages to the parent without the multiplier are
+        # multiplied
+        self.assertAllClose(m_C_5[0], 5*m_C[0])
+        self.assertAllClose(m_C_5[1], 5*m_C[1])
+        self.assertAllClose(m_X_5[0], m_X[0])
+        self.assertAllClose(m_X_5[1], m_X[1])
+
+        pass
+
+
 def check_performance(scale=1e2):
     """
     Tests that the implementation of SumMultiply is efficient.
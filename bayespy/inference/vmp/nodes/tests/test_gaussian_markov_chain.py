@@ -36,6 +36,7 @@ from ..gaussian import Gaussian
 from ..gaussian import GaussianARD
 from ..wishart import Wishart
 from ..gamma import Gamma
+from ...vmp import VB
 
 from bayespy.utils import random
 from bayespy.utils import linalg
@@ -507,7 +508,99 @@ class TestGaussianMarkovChain(TestCase):
         #
         self.assertTrue(np.allclose(Xh_vb, Xh))
         self.assertTrue(np.allclose(CovXh_vb, CovXh))
-        
+
+
+    def test_streaming(self):
+        """
+        Test the memory-bounded smoothing of GaussianMarkovChain.
+        """
+
+        (N, D) = (20, 3)
+        y = np.random.randn(N, D)
+        def messages(start, stop):
+            # Messages from Gaussian(X, identity) observations
+            return [y[start:stop], -0.5*np.identity(D), 0]
+
+        def check_sizes(X):
+            for v in vars(X).values():
+                for vi in (v if isinstance(v, list) else [v]):
+                    if isinstance(vi, np.ndarray):
+                        self.assertLess(np.size(vi), N*D)
+
+        (Y, X, Mu, Lambda, A, V) = self.create_model(N, D)
+        Y.observe(y)
+        X.update()
+        u = X.get_moments()
+
+        segments = {}
+        def consume(start, u_segment):
+            segments[start] = u_segment
+
+        Z = GaussianMarkovChain(Mu, Lambda, A, V, n=N,
+                                messages=messages,
+                                consume=consume,
+                                segment_length=6)
+        check_sizes(Z)
+        self.assertRaises(RuntimeError, Z.get_moments)
+        segments.clear()
+        Z.update()
+        check_sizes(Z)
+
+        # The segments overlap by one time instance
+        self.assertEqual(sorted(segments), [0, 6, 12, 18])
+        for (start, u_segment) in segments.items():
+            stop = min(start+7, N)
+            self.assertAllClose(u_segment[0], u[0][...,start:stop,:])
+            self.assertAllClose(u_segment[1], u[1][...,start:stop,:,:])
+            self.assertAllClose(u_segment[2], u[2][...,start:stop-1,:,:])
+        self.assertAllClose(Z.g, X.g)
+
+        # Messages to the parents and the lower bound term
+        for index in range(4):
+            m_X = X._message_to_parent(index)
+            m_Z = Z._message_to_parent(index)
+            self.assertAllClose(m_Z[0], m_X[0])
+            self.assertAllClose(m_Z[1], m_X[1])
+        self.assertAllClose(Z.lower_bound_contribution(),
+                            X.lower_bound_contribution())
+
+        # Variational Bayesian inference with and without streaming
+        def infer(streaming):
+            np.random.seed(1)
+            (Y, X, Mu, Lambda, A, V) = self.create_model(N, D)
+            if streaming:
+                X = GaussianMarkovChain(Mu, Lambda, A, V, n=N,
+                                        messages=messages,
+                                        segment_length=6)
+                Q = VB(X, A, V)
+            else:
+                Y.observe(y)
+                Q = VB(Y, X, A, V)
+            L = []
+            for i in range(5):
+                Q.update(X, A, V, verbose=False)
+                L.append(X.lower_bound_contribution()
+                         + A.lower_bound_contribution()
+                         + V.lower_bound_contribution())
+            return (L, A.get_moments(), V.get_moments())
+        (L, u_A, u_V) = infer(False)
+        (L_stream, u_A_stream, u_V_stream) = infer(True)
+        self.assertAllClose(L_stream, L)
+        self.assertAllClose(u_A_stream[0], u_A[0])
+        self.assertAllClose(u_A_stream[1], u_A[1])
+        self.assertAllClose(u_V_stream[0], u_V[0])
+        self.assertAllClose(u_V_stream[1], u_V[1])
+
+        # Time-varying dynamics are not supported
+        A = Gaussian(np.random.randn(N-1,D,D),
+                     np.identity(D))
+        self.assertRaises(ValueError,
+                          GaussianMarkovChain,
+                          Mu, Lambda, A, V,
+                          messages=messages)
+
+        pass
+
 
 class TestVaryingGaussianMarkovChain(TestCase):
 
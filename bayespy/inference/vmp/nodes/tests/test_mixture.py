@@ -39,6 +39,7 @@ from bayespy.nodes import (GaussianARD,
 
 from bayespy.utils import random
 from bayespy.utils import linalg
+from bayespy.utils import misc
 
 from bayespy.utils.misc import TestCase
 
@@ -218,6 +219,30 @@ class TestMixture(TestCase):
                             -0.5 * 1/K * alpha * np.ones((K,M)))
         
 
+        # Weighted messages are summed over the data plates (with mask)
+        np.random.seed(42)
+        (N, D) = (4, 2)
+        Mu = GaussianARD(0, 1,
+                         shape=(D,),
+                         plates=(K,))
+        Alpha = Gamma(3, 1,
+                      plates=(K,D))
+        (alpha, _) = Alpha._message_to_child()
+        p = np.random.dirichlet(np.ones(K), size=N)
+        z = Categorical(p)
+        X = Mixture(z, GaussianARD, Mu, Alpha)
+        x = np.random.randn(N, D)
+        X.observe(x, mask=[True, True, False, True])
+        m = Mu._message_from_children()
+        w = p * np.array([1, 1, 0, 1])[:,None]
+        self.assertAllClose(m[0],
+                            np.einsum('nk,kd,nd->kd', w, alpha*np.ones(D), x))
+        self.assertAllClose(m[1],
+                            -0.5 * np.einsum('nk,kd,de->kde',
+                                             w,
+                                             alpha*np.ones(D),
+                                             np.identity(D)))
+
         # Mixed distribution broadcasts g
         # This tests for a found bug. The bug caused an error.
         Z = Categorical([0.3, 0.5, 0.2])
@@ -227,6 +252,105 @@ class TestMixture(TestCase):
         pass
 
 
+    def test_sparse_responsibilities(self):
+        """
+        Test Mixture node with sparse responsibilities
+        """
+
+        np.random.seed(42)
+
+        # Messages to the cluster parameters and natural parameters
+        (N, K, D) = (8, 6, 2)
+        Z = Categorical(np.random.dirichlet(np.ones(K), size=N),
+                        truncation=1)
+        p = Z._message_to_child()[0]
+        Mu = GaussianARD(np.random.randn(K, D), 1,
+                         shape=(D,),
+                         plates=(K,))
+        Alpha = Gamma(3, np.random.rand(K, D),
+                      plates=(K,D))
+        (mu, _) = Mu._message_to_child()
+        (alpha, _) = Alpha._message_to_child()
+        X = Mixture(Z, GaussianARD, Mu, Alpha)
+        self.assertAllClose(X.phi[0],
+                            np.einsum('nk,kd->nd', p, alpha*mu))
+        self.assertAllClose(X.phi[1],
+                            -0.5 * np.einsum('nk,kd,de->nde',
+                                             p,
+                                             alpha,
+                                             np.identity(D)))
+        x = np.random.randn(N, D)
+        mask = np.arange(N) % 3 != 1
+        X.observe(x, mask=mask)
+        m = Mu._message_from_children()
+        w = p * mask[:,None]
+        self.assertAllClose(m[0],
+                            np.einsum('nk,kd,nd->kd', w, alpha, x))
+        self.assertAllClose(m[1],
+                            -0.5 * np.einsum('nk,kd,de->kde',
+                                             w,
+                                             alpha,
+                                             np.identity(D)))
+        m = Alpha._message_from_children()
+        xx = x[:,None,:]**2 - 2*x[:,None,:]*mu + (mu**2 + 1)
+        self.assertAllClose(m[0],
+                            -0.5 * np.einsum('nk,nkd->kd', w, xx))
+        self.assertAllClose(m[1],
+                            0.5 * np.einsum('nk->k', w)[:,None] * np.ones(D))
+
+        # Cluster plate is not the last plate axis and the parameters have
+        # other plates too
+        (M, N, K) = (3, 4, 5)
+        Z = Categorical(np.random.dirichlet(np.ones(K), size=(M,N)),
+                        truncation=1)
+        p = Z._message_to_child()[0]
+        Mu = GaussianARD(np.random.randn(M, K, 1), 1,
+                         plates=(M,K,1))
+        X = Mixture(Z, GaussianARD, Mu, 1, cluster_plate=-2)
+        self.assertAllClose(X.phi[1],
+                            -0.5 * np.ones((M, N)))
+        x = np.random.randn(M, N)
+        X.observe(x)
+        m = Mu._message_from_children()
+        self.assertAllClose(m[0],
+                            np.einsum('mnk,mn->mk', p, x)[...,None])
+        self.assertAllClose(m[1],
+                            -0.5 * np.einsum('mnk->mk', p)[...,None])
+
+        # The mixture uses the responsibilities in the sparse form without
+        # the dense array
+        (N, K) = (10, 4)
+        Z = Categorical(np.random.dirichlet(np.ones(K), size=N),
+                        truncation=2)
+        p = Z._message_to_child()[0]
+        Mu = GaussianARD(np.random.randn(K), 1, plates=(K,))
+        X = Mixture(Z, GaussianARD, Mu, 1)
+        self.assertIsInstance(X._message_from_parents()[0][0],
+                              misc.SparseCounts)
+        x = np.random.randn(N)
+        X.observe(x)
+        (mu, mumu) = Mu._message_to_child()
+        self.assertAllClose(Mu._message_from_children()[0],
+                            np.einsum('nk,n->k', p, x))
+        self.assertAllClose(X.lower_bound_contribution(),
+                            np.sum(p * (-0.5*np.log(2*np.pi)
+                                        - 0.5*(x[:,None]**2
+                                               - 2*x[:,None]*mu
+                                               + mumu))))
+
+        # Observed cluster assignments are sparse too
+        z = np.random.randint(K, size=N)
+        Z = Categorical(np.ones(K)/K, plates=(N,))
+        Z.observe(z)
+        Mu = GaussianARD(np.random.randn(K), 1, plates=(K,))
+        X = Mixture(Z, GaussianARD, Mu, 1)
+        X.observe(x)
+        self.assertAllClose(Mu._message_from_children()[0],
+                            np.bincount(z, weights=x, minlength=K))
+
+        pass
+
+
     def test_lowerbound(self):
         """
         Test log likelihood lower bound for Mixture node
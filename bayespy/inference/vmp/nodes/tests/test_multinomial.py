@@ -30,12 +30,14 @@ warnings.simplefilter("error")
 
 import numpy as np
 import scipy
+import scipy.sparse
 
 from bayespy.nodes import (Multinomial,
                            Dirichlet,
                            Mixture)
 
 from bayespy.utils import random
+from bayespy.utils import misc
 
 from bayespy.utils.misc import TestCase
 
@@ -190,6 +192,67 @@ class TestMultinomial(TestCase):
         pass
 
     
+    def test_sparse_observations(self):
+        """
+        Test observing sparse counts
+        """
+
+        x = np.array([[0, 2, 0, 0, 1],
+                      [0, 0, 0, 3, 0],
+                      [1, 0, 1, 0, 1]])
+        p = Dirichlet([1, 2, 3, 4, 5])
+        X = Multinomial(3, p, plates=(3,))
+        X.observe(scipy.sparse.csr_matrix(x))
+        self.assertIsInstance(X.u[0], misc.SparseCounts)
+        self.assertAllClose(X.get_moments()[0], x)
+
+        # Same results as for dense counts
+        q = Dirichlet([1, 2, 3, 4, 5])
+        Y = Multinomial(3, q, plates=(3,))
+        Y.observe(x)
+        self.assertAllClose(X._message_to_parent(0)[0],
+                            Y._message_to_parent(0)[0])
+        self.assertAllClose(X.lower_bound_contribution(),
+                            Y.lower_bound_contribution())
+
+        # Counts must sum to the number of trials
+        self.assertRaises(ValueError,
+                          X.observe,
+                          scipy.sparse.csr_matrix(2*x))
+
+        # The node does not hold arrays of the size of the documents times
+        # the words when the counts of each document are observed
+        (N, D) = (20, 1000)
+        x = scipy.sparse.random(N, D, density=0.01, format='csr',
+                                random_state=1)
+        x.data = np.ceil(10 * x.data)
+        x = x.astype(int)
+        n = np.asarray(x.sum(axis=-1)).ravel()
+        def check_sizes(X):
+            for v in vars(X).values():
+                for vi in (v if isinstance(v, list) else [v]):
+                    if isinstance(vi, np.ndarray):
+                        self.assertLess(np.size(vi), N*D)
+        p = Dirichlet(np.ones(D))
+        X = Multinomial(n, p, plates=(N,))
+        check_sizes(X)
+        X.observe(x)
+        check_sizes(X)
+        Y = Multinomial(n, p, plates=(N,))
+        Y.observe(x.toarray())
+        self.assertAllClose(X._message_to_parent(0)[0],
+                            Y._message_to_parent(0)[0])
+        self.assertAllClose(X.lower_bound_contribution(),
+                            Y.lower_bound_contribution())
+
+        # The moments of latent nodes are computed when they are needed
+        X = Multinomial(n, p, plates=(N,))
+        self.assertAllClose(X.get_moments()[0],
+                            n[:,None] * np.ones(D) / D)
+
+        pass
+
+    
     def test_mixture(self):
         """
         Test multinomial mixture
@@ -443,6 +443,58 @@ class TestNode(misc.TestCase):
         pass
 
 
+    def test_get_message_to_parent(self):
+        """
+        Test the caching of messages to parents.
+        """
+
+        from bayespy.nodes import GaussianARD, Gamma, SumMultiply
+
+        X = GaussianARD(0, 1, shape=(2,), plates=(3,))
+        C = GaussianARD(0, 1, shape=(2,))
+        F = SumMultiply('d,d', X, C)
+        tau = Gamma(2, 2)
+        Y = GaussianARD(F, tau)
+        Y.observe([1, 2, 3])
+
+        # Count the number of times the message to X is computed
+        calls = []
+        message_to_parent = F._message_to_parent
+        def counting_message_to_parent(index):
+            if index == 0:
+                calls.append(index)
+            return message_to_parent(index)
+        F._message_to_parent = counting_message_to_parent
+
+        # Cached message is used if nothing has changed
+        m0 = X._message_from_children()
+        m1 = X._message_from_children()
+        self.assertEqual(calls, [0])
+        self.assertAllClose(m0[0], m1[0])
+        self.assertAllClose(m0[1], m1[1])
+
+        # Updating the node itself does not change the message
+        X.update()
+        X._message_from_children()
+        self.assertEqual(calls, [0])
+
+        # Changes in the other parent, the child or the mask invalidate the
+        # cache
+        C.update()
+        m = X._message_from_children()
+        self.assertEqual(calls, [0, 0])
+        self.assertAllClose(m[0], message_to_parent(0)[0])
+        tau.update()
+        X._message_from_children()
+        self.assertEqual(calls, [0, 0, 0])
+        Y.observe([1, 2, 3], mask=[True, False, True])
+        m = X._message_from_children()
+        self.assertEqual(calls, [0, 0, 0, 0])
+        self.assertAllClose(m[0], message_to_parent(0)[0])
+
+        pass
+
+
 class TestSlice(misc.TestCase):
 
     def test_init(self):
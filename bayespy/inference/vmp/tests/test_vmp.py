@@ -0,0 +1,464 @@
+######################################################################
+# Copyright (C) 2015 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+
+"""
+Unit tests for `vmp` module.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import warnings
+warnings.simplefilter("error")
+
+import h5py
+import numpy as np
+
+from numpy import testing
+
+from bayespy.nodes import (GaussianARD,
+                           Gamma,
+                           SumMultiply,
+                           Dirichlet,
+                           Categorical,
+                           Mixture)
+
+from ..vmp import VB
+
+from bayespy.utils.misc import TestCase
+
+
+def _pca_model(M=10, N=20, D=3):
+    """
+    Construct a small PCA model with partially observed data.
+    """
+    np.random.seed(42)
+    alpha = Gamma(1e-3, 1e-3, plates=(D,), name='alpha')
+    C = GaussianARD(0, alpha, shape=(D,), plates=(M,1), name='C')
+    X = GaussianARD(0, 1, shape=(D,), plates=(1,N), name='X')
+    X.initialize_from_random()
+    F = SumMultiply('d,d', C, X, name='F')
+    tau = Gamma(1e-3, 1e-3, name='tau')
+    Y = GaussianARD(F, tau, name='Y')
+    Y.observe(np.random.randn(M,N), mask=(np.random.rand(M,N) > 0.2))
+    return (Y, F, X, C, alpha, tau)
+
+
+class TestVB(TestCase):
+
+    def test_compute_lowerbound(self):
+        """
+        Test the caching of the lower bound terms.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, F, X, C, alpha, tau)
+
+        def brute_force():
+            L = sum(node.lower_bound_contribution()
+                    for node in Q.model)
+            del calls[:]
+            return L
+
+        # Count the number of computed terms
+        calls = []
+        for node in Q.model:
+            def counting_lower_bound_contribution(node=node,
+                                                  f=node.lower_bound_contribution):
+                calls.append(node)
+                return f()
+            node.lower_bound_contribution = counting_lower_bound_contribution
+
+        L = Q.compute_lowerbound()
+        self.assertEqual(len(calls), 6)
+        self.assertAllClose(L, brute_force())
+
+        # Nothing changed
+        L = Q.compute_lowerbound()
+        self.assertEqual(calls, [])
+
+        # Only the terms of the updated node and its children are recomputed
+        tau.update()
+        L = Q.compute_lowerbound()
+        self.assertEqual(set(calls), {Y, tau})
+        self.assertAllClose(L, brute_force())
+
+        # Children through deterministic nodes are recomputed
+        X.update()
+        L = Q.compute_lowerbound()
+        self.assertEqual(set(calls), {Y, F, X})
+        self.assertAllClose(L, brute_force())
+
+        # Annealing changes all the terms
+        Q.set_annealing(0.5)
+        L = Q.compute_lowerbound()
+        self.assertEqual(len(calls), 6)
+        self.assertAllClose(L, brute_force())
+
+        pass
+
+
+    def test_compile(self):
+        """
+        Test the compilation of update schedules.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, alpha, tau, C, X)
+
+        # By default, use the given order
+        self.assertEqual(Q.compile(), [Y, alpha, tau, C, X])
+
+        # Children before parents
+        self.assertEqual(Q.compile(order='topological'),
+                         [Y, tau, C, alpha, X])
+        self.assertEqual(Q.compile('alpha', C, order='topological'),
+                         [C, alpha])
+
+        # Names are resolved
+        self.assertEqual(Q.compile('X', 'C', 'X'), [X, C, X])
+
+        # Edges skip deterministic nodes
+        self.assertEqual(Q._parents[Y], [C, X, tau])
+        self.assertEqual(Q._children[C], [Y])
+        self.assertEqual(Q._children[alpha], [C])
+
+        self.assertRaises(ValueError,
+                          Q.compile,
+                          order='foo')
+
+        pass
+
+
+    def test_parallel_schedule(self):
+        """
+        Test the grouping of independent nodes for parallel updates.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, F, X, C, alpha, tau)
+
+        def groups(*nodes):
+            schedule = Q._get_schedule(nodes)
+            return [[node for (node, update) in group]
+                    for group in Q._parallel_schedule(schedule)]
+
+        # Co-parents are not independent
+        self.assertEqual(groups(X, C), [[X], [C]])
+        # Independent hyperparameters are grouped
+        self.assertEqual(groups(X, C, alpha, tau), [[X], [C], [alpha, tau]])
+        # Nodes are moved only past independent nodes
+        self.assertEqual(groups(alpha, X, tau), [[alpha, X], [tau]])
+        # Repeated nodes are not grouped
+        self.assertEqual(groups(alpha, alpha), [[alpha], [alpha]])
+        # Deterministic nodes are skipped
+        self.assertEqual(groups(Y, F, tau), [[Y], [tau]])
+
+        pass
+
+
+    def test_update(self):
+        """
+        Test the iteration history of VB updates.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau, node_timing=True)
+        Q.ignore_bound_checks = True
+
+        Q.update(repeat=150, tol=-np.inf, verbose=False)
+        self.assertEqual(Q.iter, 149)
+        self.assertTrue(len(Q.L) >= 150)
+        self.assertTrue(np.all(np.isfinite(Q.L[:150])))
+        self.assertTrue(np.all(Q.cputime[:150] >= 0))
+        self.assertTrue(np.all(Q.walltime[:150] >= 0))
+        self.assertTrue(np.all(np.isnan(Q.L[150:])))
+        self.assertEqual(len(Q.walltime), len(Q.L))
+        self.assertEqual(len(Q.l[X]), len(Q.L))
+        self.assertEqual(len(Q.node_time[X]), len(Q.L))
+
+        # Per-node timing
+        Q.update(X, verbose=False)
+        self.assertTrue(Q.node_time[X][150] > 0)
+        self.assertEqual(Q.node_time[C][150], 0)
+
+        pass
+
+
+    def test_update_parallel(self):
+        """
+        Test that parallel updates give the same result as sequential.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau)
+        Q.update(repeat=10, verbose=False)
+        L_sequential = Q.L[Q.iter]
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau)
+        Q.update(repeat=10, verbose=False, parallel=2)
+        L_parallel = Q.L[Q.iter]
+
+        self.assertAllClose(L_sequential, L_parallel)
+
+        pass
+
+
+    def test_profile(self):
+        """
+        Test the profiling of node computations.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau)
+
+        with Q.profile(memory=True):
+            Q.update(repeat=2, verbose=False)
+
+        profile = Q.get_profile()
+        self.assertEqual(profile['X']['update']['calls'], 2)
+        self.assertEqual(profile['tau']['update']['calls'], 2)
+        self.assertTrue(profile['X']['update']['time'] >= 0)
+        self.assertIn('_message_to_parent(0)', profile['Y'])
+        self.assertIn('_message_to_parent(1)', profile['F'])
+        self.assertNotIn('update', profile['F'])
+
+        # The original methods are restored
+        self.assertNotIn('update', X.__dict__)
+        self.assertNotIn('_message_to_parent', F.__dict__)
+        self.assertEqual(Q.get_profile(), profile)
+
+        pass
+
+
+    def test_bound_every(self):
+        """
+        Test the lower bound evaluation on a stride.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau)
+        Q.update(repeat=12, tol=-np.inf, verbose=False)
+        L = Q.L[:12]
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau, bound_every=5)
+        Q.update(repeat=12, tol=-np.inf, verbose=False)
+
+        # The bound is computed on every fifth and on the last step
+        computed = [0, 5, 10, 11]
+        self.assertEqual(list(np.flatnonzero(np.isfinite(Q.L[:12]))),
+                         computed)
+        self.assertAllClose(Q.L[computed], L[computed])
+        self.assertTrue(np.all(np.isnan(Q.l[X][[1, 2, 3, 4]])))
+
+        # The change of the natural parameters is recorded
+        self.assertTrue(np.isnan(Q.phi_change[0]))
+        self.assertTrue(np.all(Q.phi_change[1:12] > 0))
+
+        # The bound is computed when the parameters have converged
+        Q.update(repeat=3, tol=np.inf, bound_every=100, verbose=False)
+        self.assertTrue(Q.converged)
+        self.assertEqual(Q.iter, 12)
+        self.assertTrue(np.isfinite(Q.L[12]))
+
+        pass
+
+
+    def test_autosave_background(self):
+        """
+        Test the background autosave.
+        """
+
+        (fd, filename) = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fd)
+        try:
+            (Y, F, X, C, alpha, tau) = _pca_model()
+            Q = VB(Y, X, C, alpha, tau,
+                   autosave_filename=filename,
+                   autosave_iterations=2,
+                   autosave_background=True)
+            Q.update(repeat=5, verbose=False)
+            Q.wait_for_autosave()
+
+            # The statistics are appended to resizable datasets
+            with h5py.File(filename, 'r') as h5f:
+                self.assertEqual(h5f['L'].shape, (5,))
+                self.assertEqual(h5f['L'].maxshape, (None,))
+                self.assertEqual(h5f['boundterms']['X'].shape, (5,))
+
+            # The saved state can be loaded
+            (Y, F, X2, C, alpha, tau) = _pca_model()
+            Q2 = VB(Y, X2, C, alpha, tau)
+            Q2.load(filename=filename)
+            self.assertEqual(Q2.iter, 4)
+            self.assertAllClose(Q2.L, Q.L[:5])
+            self.assertAllClose(X2.get_moments()[0], X.get_moments()[0])
+
+            # Synchronous saving to the same file
+            Q.update(repeat=1, verbose=False)
+            Q.save()
+            Q.update(repeat=1, verbose=False)
+            Q.wait_for_autosave()
+            Q2.load(filename=filename)
+            self.assertEqual(Q2.iter, 6)
+            self.assertAllClose(Q2.L, Q.L[:7])
+            self.assertAllClose(X2.get_moments()[0], X.get_moments()[0])
+        finally:
+            os.remove(filename)
+
+        pass
+
+
+    def test_update_accelerate(self):
+        """
+        Test the SQUAREM accelerated updates.
+        """
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau, tol=1e-12)
+        Q.update(repeat=1000, verbose=False)
+        L = Q.L[Q.iter]
+        iterations = Q.iter + 1
+
+        (Y, F, X, C, alpha, tau) = _pca_model()
+        Q = VB(Y, X, C, alpha, tau, tol=1e-12)
+        Q.update(repeat=1000, verbose=False, accelerate='squarem')
+        self.assertTrue(Q.converged)
+        self.assertTrue(Q.iter + 1 < iterations)
+        self.assertTrue(np.all(np.diff(Q.L[:Q.iter+1]) > -1e-6))
+        self.assertAllClose(Q.L[Q.iter], L)
+
+        self.assertRaises(ValueError,
+                          Q.update,
+                          accelerate='foo')
+
+        pass
+
+
+    def test_prune(self):
+        """
+        Test the pruning of dead components.
+        """
+
+        def copy_posterior(nodes_from, nodes_to):
+            for (node_from, node_to) in zip(nodes_from, nodes_to):
+                node_to.phi = [np.copy(phi) for phi in node_from.phi]
+                node_to._update_moments_and_cgf()
+
+        def check(Q1, Q2, nodes1, nodes2):
+            self.assertAllClose(Q1.compute_lowerbound(),
+                                Q2.compute_lowerbound())
+            Q1.update(*nodes1, repeat=2, verbose=False)
+            Q2.update(*nodes2, repeat=2, verbose=False)
+            self.assertAllClose(Q1.compute_lowerbound(),
+                                Q2.compute_lowerbound())
+            for (node1, node2) in zip(nodes1, nodes2):
+                for (u1, u2) in zip(node1.u, node2.u):
+                    self.assertAllClose(u1, u2)
+
+        #
+        # ARD: PCA with a switched off latent dimension
+        #
+        def pca(D, y, mask):
+            alpha = Gamma(1e-3, 1e-3, plates=(D,), name='alpha')
+            C = GaussianARD(0, alpha, shape=(D,), plates=(4,1), name='C')
+            X = GaussianARD(0, 1, shape=(D,), plates=(1,5), name='X')
+            F = SumMultiply('d,d', C, X, name='F')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(F, tau, name='Y')
+            Y.observe(y, mask=mask)
+            return (Y, F, X, C, alpha, tau)
+
+        np.random.seed(42)
+        y = np.random.randn(4,5)
+        mask = np.random.rand(4,5) > 0.2
+        (Y, F, X, C, alpha, tau) = pca(3, y, mask)
+        X.initialize_from_parameters(np.random.randn(1,5,3), 10)
+        C.initialize_from_parameters(np.random.randn(4,1,3), 10)
+        alpha.initialize_from_parameters(10, np.array([10, 1e-8, 10]))
+        Q = VB(Y, X, C, alpha, tau)
+        Q.prune(verbose=False)
+        self.assertEqual(alpha.plates, (2,))
+        self.assertEqual(C.dims, ((2,), (2,2)))
+        self.assertEqual(X.dims, ((2,), (2,2)))
+        self.assertEqual(F.dims, ((), ()))
+
+        (Y2, F2, X2, C2, alpha2, tau2) = pca(2, y, mask)
+        copy_posterior([X, C, alpha, tau], [X2, C2, alpha2, tau2])
+        Q2 = VB(Y2, X2, C2, alpha2, tau2)
+        check(Q, Q2, [X, C, alpha, tau], [X2, C2, alpha2, tau2])
+
+        # Nothing to prune
+        Q.prune(verbose=False)
+        self.assertEqual(alpha.plates, (2,))
+
+        # Unnamed nodes whose moments are broadcast along the pruned axis
+        alpha = Gamma(1e10, 1, plates=(3,))
+        C = GaussianARD(0, alpha, shape=(3,), plates=(4,))
+        Y = GaussianARD(C, 1)
+        Y.observe(np.zeros((4,3)))
+        Q = VB(Y, C, alpha)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            Q.prune(alpha)
+        self.assertEqual(alpha.plates, (1,))
+        self.assertEqual(C.dims, ((1,), (1,1)))
+        self.assertEqual(out.getvalue().strip(),
+                         "Pruned 2 of 3 components of Gamma")
+
+        #
+        # Mixture of Gaussians with an empty cluster
+        #
+        def mog(K, y):
+            alpha = Dirichlet(np.ones(K), name='alpha')
+            z = Categorical(alpha, plates=(10,), name='z')
+            mu = GaussianARD(0, 1e-2, shape=(2,), plates=(K,), name='mu')
+            Lambda = Gamma(1, 1, plates=(K,2), name='Lambda')
+            Y = Mixture(z, GaussianARD, mu, Lambda, name='Y')
+            Y.observe(y)
+            return (Y, z, alpha, mu, Lambda)
+
+        y = np.random.randn(10,2)
+        (Y, z, alpha, mu, Lambda) = mog(3, y)
+        p = np.random.dirichlet(np.ones(3), size=10)
+        p[:,1] = 1e-10
+        z.initialize_from_parameters(p / np.sum(p, axis=-1, keepdims=True))
+        mu.initialize_from_parameters(np.random.randn(3,2), 10)
+        Q = VB(Y, mu, Lambda, z, alpha)
+        Q.prune(verbose=False)
+        self.assertEqual(z.dims, ((2,),))
+        self.assertEqual(alpha.dims, ((2,),))
+        self.assertEqual(mu.plates, (2,))
+        self.assertEqual(Lambda.plates, (2,2))
+        self.assertEqual(Y._distribution.K, 2)
+
+        (Y2, z2, alpha2, mu2, Lambda2) = mog(2, y)
+        copy_posterior([z, alpha, mu, Lambda], [z2, alpha2, mu2, Lambda2])
+        Q2 = VB(Y2, mu2, Lambda2, z2, alpha2)
+        check(Q, Q2, [mu, Lambda, z, alpha], [mu2, Lambda2, z2, alpha2])
+
+        pass
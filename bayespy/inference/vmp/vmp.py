@@ -29,11 +29,138 @@ import h5py
 import datetime
 import tempfile
 import scipy
+import contextlib
+import threading
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
 
 from bayespy.utils import misc
 
 from bayespy.inference.vmp.nodes.node import Node
 
+
+def _is_updatable(node):
+    """
+    Check whether the node has an update method (i.e., is stochastic).
+    """
+    return hasattr(node, 'update') and callable(node.update)
+
+
+def _stochastic_parents(node):
+    """
+    Find the nearest stochastic ancestors through deterministic nodes.
+    """
+    parents = []
+    for parent in node.parents:
+        if _is_updatable(parent):
+            parents.append(parent)
+        else:
+            parents.extend(_stochastic_parents(parent))
+    return misc.unique(parents)
+
+
+def _stochastic_children(node):
+    """
+    Find the nearest stochastic descendants through deterministic nodes.
+    """
+    children = []
+    for (child, index) in node.children:
+        if _is_updatable(child):
+            children.append(child)
+        else:
+            children.extend(_stochastic_children(child))
+    return misc.unique(children)
+
+
+class _Snapshot():
+    """
+    Collect references to the arrays that a node would save into a HDF5 group.
+
+    The object mimics the parts of the HDF5 group interface used by the save
+    methods of the nodes.  The arrays are not copied, because the nodes replace
+    their arrays instead of modifying them in place.
+    """
+
+    def __init__(self):
+        self.datasets = {}
+        self.groups = {}
+
+    def create_dataset(self, name, data=None, **kwargs):
+        self.datasets[name] = data
+
+    def create_group(self, name):
+        group = _Snapshot()
+        self.groups[name] = group
+        return group
+
+
+def _write_snapshot(group, snapshot):
+    """
+    Write a snapshot into a HDF5 group, overwriting existing datasets.
+    """
+    for (name, data) in snapshot.datasets.items():
+        if name in group:
+            dataset = group[name]
+            if (dataset.shape == np.shape(data)
+                and dataset.dtype == np.asarray(data).dtype):
+                dataset[...] = data
+                continue
+            del group[name]
+        misc.write_to_hdf5(group, data, name)
+    for (name, subsnapshot) in snapshot.groups.items():
+        _write_snapshot(group.require_group(name), subsnapshot)
+
+
+def _append_to_hdf5(group, data, name, start):
+    """
+    Write a 1-D array to a resizable dataset starting from the given index.
+    """
+    if name in group and group[name].maxshape[0] is not None:
+        # Not resizable (e.g., written by VB.save)
+        del group[name]
+    if name not in group:
+        group.create_dataset(name,
+                             data=misc.nans(start+len(data)),
+                             maxshape=(None,),
+                             chunks=True)
+    dataset = group[name]
+    dataset.resize((start+len(data),))
+    dataset[start:] = data
+
+
+def _prune_group(node, axis):
+    """
+    Find the axes of the linked nodes which correspond to an axis of a node.
+
+    Returns a dictionary from the nodes to their axes.  Raises
+    NotImplementedError if some mapping is not known, the axes of a node are
+    inconsistent or the sizes of the axes differ.
+    """
+    group = {node: axis}
+    size = node._prune_size(axis)
+    stack = [node]
+    while len(stack) > 0:
+        n = stack.pop()
+        a = group[n]
+        neighbours = [(parent, n._prune_axis_to_parent(index, a))
+                      for (index, parent) in enumerate(n.parents)]
+        neighbours += [(child, child._prune_axis_from_parent(index, a))
+                       for (child, index) in n.children]
+        for (m, b) in neighbours:
+            if b is None:
+                continue
+            if m in group:
+                if group[m] != b:
+                    raise NotImplementedError()
+                continue
+            if m._prune_size(b) != size:
+                raise NotImplementedError()
+            group[m] = b
+            stack.append(m)
+    return group
+
+
 class VB():
     r"""
     Variational Bayesian (VB) inference engine
@@ -59,10 +186,28 @@ class VB():
 
         Iteration interval between each automatic saving
 
+    autosave_background : bool, optional
+
+        Write the automatic saves in a background thread so that the iteration
+        does not wait for the disk.  The arrays of the nodes are not copied, a
+        reference to them is written.  The iteration statistics are appended to
+        the file instead of rewriting them.  Use ``wait_for_autosave`` to make
+        sure the file has been written.
+
     callback : callable, optional
 
         Function which is called after each update iteration step
 
+    node_timing : bool, optional
+
+        Record the wall-clock time spent in the update of each node for each
+        iteration step (see ``node_time``)
+
+    bound_every : int, optional
+
+        Compute the lower bound only on every k-th iteration step of
+        ``update`` (see ``update``)
+
     """
 
     def __init__(self,
@@ -70,7 +215,10 @@ class VB():
                  tol=1e-5, 
                  autosave_filename=None,
                  autosave_iterations=0, 
-                 callback=None):
+                 autosave_background=False,
+                 callback=None,
+                 node_timing=False,
+                 bound_every=1):
 
         for (ind, node) in enumerate(nodes):
             if not isinstance(node, Node):
@@ -88,9 +236,29 @@ class VB():
         self.converged = False
         self.L = np.array(())
         self.cputime = np.array(())
+        self.walltime = np.array(())
+        self.phi_change = np.array(())
         self.l = dict(zip(self.model, 
                           len(self.model)*[np.array([])]))
+        self.node_timing = node_timing
+        self.node_time = dict(zip(self.model,
+                                  len(self.model)*[np.array([])]))
+        # Node update times of the current iteration step
+        self._node_times = {}
+        # Profiling statistics: node -> method -> [calls, time, bytes]
+        self.profile_stats = {}
+        # Cached lower bound terms: node -> (version, term)
+        self._bound_terms = {}
+        # Natural parameters after the previous iteration step
+        self._phi = {}
+        self.bound_every = bound_every
         self.autosave_iterations = autosave_iterations
+        self.autosave_background = autosave_background
+        # Background autosave: the writer thread, the pending write and the
+        # number of iteration steps already written to the autosave file
+        self._autosave_executor = None
+        self._autosave_future = None
+        self._autosave_written = 0
         if not autosave_filename:
             date = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
             prefix = 'vb_autosave_%s_' % date
@@ -107,59 +275,506 @@ class VB():
         if len(names) != len(self.model):
             raise Exception("Use unique names for nodes.")
 
+        # Dictionary for mapping node names to nodes
+        self._nodes = set(self.model)
+        self._names = {node.name: node for node in self.model}
+
+        # Compiled update schedules
+        self._schedule = None
+        self._schedules = {}
+        self._parents = None
+        self._children = None
+
         self.callback = callback
         self.callback_output = None
         self.tol = tol
 
-    def set_autosave(self, filename, iterations=None):
+    def set_autosave(self, filename, iterations=None, background=None):
+        self.wait_for_autosave()
         self.autosave_filename = filename
         self.filename = filename
+        self._autosave_written = 0
         if iterations is not None:
             self.autosave_iterations = iterations
+        if background is not None:
+            self.autosave_background = background
 
 
     def set_callback(self, callback):
         self.callback = callback
 
-    def update(self, *nodes, repeat=1, plot=False, tol=None, verbose=True):
+    def _compile_edges(self):
+        """
+        Find the stochastic parents and children of each node in the model.
+
+        Deterministic nodes are skipped, that is, the edges connect the nearest
+        stochastic nodes.
+        """
+        self._parents = {node: _stochastic_parents(node)
+                         for node in self.model}
+        self._children = {node: _stochastic_children(node)
+                          for node in self.model}
+        return
+
+
+    def _topological_order(self, nodes):
+        """
+        Sort the nodes so that children are before their parents.
+
+        Ties are resolved by using the given order of the nodes.
+        """
+        if self._parents is None:
+            self._compile_edges()
+        nodes = misc.unique(nodes)
+        remaining = set(nodes)
+        ordered = []
+        while len(remaining) > 0:
+            for node in nodes:
+                if (node in remaining and
+                    not any(child in remaining
+                            for child in self._children[node])):
+                    break
+            else:
+                raise RuntimeError("The graph contains a cycle")
+            remaining.remove(node)
+            ordered.append(node)
+        return ordered
+
+
+    def compile(self, *nodes, order='given'):
+        """
+        Compile a static update schedule for the nodes.
+
+        The nodes are resolved, the order is fixed and the stochastic parents
+        and children of each node are found only once, so that ``update``
+        only replays the schedule.  If no nodes are given, all nodes are used
+        and the schedule is used by ``update`` when no nodes are given.
+
+        Parameters
+        ----------
+
+        nodes : nodes or names, optional
 
-        # TODO/FIXME:
-        #
-        # If no nodes are given and thus everything is updated, the update order
-        # should be from down to bottom. Or something similar..
+            Nodes to update in the schedule. By default, all nodes.
 
-        # By default, update all nodes
+        order : {'given', 'topological'}, optional
+
+            If 'given', the nodes are updated in the given order (or the order
+            in which the nodes were given to VB).  If 'topological', the nodes
+            are sorted so that children are updated before their parents,
+            which propagates the information from the data to the
+            hyperparameters within one iteration.
+
+        Returns
+        -------
+
+        list of nodes
+
+            The nodes in the order of the schedule
+        """
+
+        if self._parents is None:
+            self._compile_edges()
+
+        # Resolve the nodes
         if len(nodes) == 0:
-            nodes = self.model
+            resolved = self.model
+        else:
+            resolved = [self[node] for node in nodes]
+
+        if order == 'topological':
+            resolved = self._topological_order(resolved)
+        elif order != 'given':
+            raise ValueError("Unknown update order: %s" % (order,))
+
+        # Resolve the update methods
+        schedule = [(node, node.update if _is_updatable(node) else None)
+                    for node in resolved]
+        if len(nodes) == 0:
+            self._schedule = schedule
+        else:
+            self._schedules[nodes] = schedule
+
+        return [node for (node, update) in schedule]
+
+
+    def _markov_blanket(self, node):
+        """
+        Find the stochastic nodes in the Markov blanket of a node.
+
+        The blanket consists of the parents, the children and the other
+        parents of the children.
+        """
+        if self._parents is None:
+            self._compile_edges()
+        parents = self._parents.get(node)
+        if parents is None:
+            parents = _stochastic_parents(node)
+        children = self._children.get(node)
+        if children is None:
+            children = _stochastic_children(node)
+        blanket = set(parents) | set(children)
+        for child in children:
+            coparents = self._parents.get(child)
+            if coparents is None:
+                coparents = _stochastic_parents(child)
+            blanket.update(coparents)
+        blanket.discard(node)
+        return blanket
+
+
+    def _parallel_schedule(self, schedule):
+        """
+        Group the schedule into sets of nodes that can be updated in parallel.
+
+        A node is moved to an earlier set only if it is not in the Markov
+        blanket of any node it is moved past.  Because the update of a node
+        depends only on its Markov blanket, the result is identical to the
+        sequential schedule.
+        """
+        blankets = {}
+        groups = []
+        for (node, update) in schedule:
+            if update is None:
+                continue
+            if node not in blankets:
+                blankets[node] = self._markov_blanket(node)
+            # Find the last group which contains a conflicting node
+            k = len(groups)
+            while k > 0:
+                if any(other is node or other in blankets[node]
+                       for (other, other_update) in groups[k-1]):
+                    break
+                k -= 1
+            if k == len(groups):
+                groups.append([])
+            groups[k].append((node, update))
+        return groups
+
+
+    def _get_schedule(self, nodes):
+        """
+        Return the compiled schedule for the nodes.
+        """
+        if len(nodes) == 0:
+            if self._schedule is None:
+                self.compile()
+            return self._schedule
+        if nodes not in self._schedules:
+            self.compile(*nodes)
+        return self._schedules[nodes]
+
+
+    def update(self, *nodes, repeat=1, plot=False, tol=None, verbose=True,
+               parallel=False, bound_every=None, accelerate=None):
+        """
+        Update the nodes using VB-EM updates.
+
+        Parameters
+        ----------
 
-        converged = False
+        nodes : nodes or names, optional
+
+            Nodes to update in the given order. By default, all nodes are
+            updated using the compiled schedule (see ``compile``).
+
+        repeat : int, optional
+
+            The number of iteration steps
+
+        plot : bool, optional
+
+            Plot the nodes after each update
+
+        tol : double, optional
+
+            Convergence criterion. By default, use the tolerance given to VB.
+
+        verbose : bool, optional
+
+            Print the progress of the iteration
+
+        parallel : bool or int, optional
+
+            If True or the number of threads, the nodes which are not in each
+            other's Markov blankets are updated simultaneously in a thread
+            pool.  The result is identical to the sequential updates.  This is
+            beneficial only if the updates of the nodes are heavy, because
+            NumPy releases the GIL during the numerical computations.  Note
+            that nodes sharing a child (e.g., the two factors of a product)
+            are in each other's Markov blankets, so they are not updated in
+            parallel.
+
+        bound_every : int, optional
+
+            Compute the lower bound only on every k-th iteration step.  On the
+            other steps, the relative change of the natural parameters of the
+            nodes is recorded to ``phi_change`` and the lower bound is stored
+            as NaN.  If the relative change is below the tolerance, the lower
+            bound is computed in order to check the convergence.  The lower
+            bound is always computed on the last step.  By default, use the
+            value given to VB.
+
+        accelerate : str, optional
+
+            Accelerate the convergence by extrapolating the natural parameters.
+            With 'squarem', each iteration step consists of two VB-EM updates
+            and an extrapolated step (SQUAREM, Varadhan & Roland, 2008)
+            followed by a VB-EM update for stabilization.  If the extrapolated
+            step does not increase the lower bound, the result of the two
+            VB-EM updates is used instead.  Thus, each iteration step costs
+            two or three normal iteration steps and the lower bound is
+            computed on every step.
+        """
+
+        if bound_every is None:
+            bound_every = self.bound_every
+
+        # By default, update all nodes using the compiled schedule. See
+        # VB.compile for using an order which follows the graph.
+        schedule = self._get_schedule(nodes)
+
+        if accelerate is None:
+            accelerated = None
+        elif accelerate.lower() == 'squarem':
+            accelerated = self._accelerated_nodes(schedule)
+        else:
+            raise ValueError("Unknown acceleration method: %s" % accelerate)
+
+        if self.node_timing:
+            schedule = [(X, self._timed_update(X, update)
+                            if update is not None else None)
+                        for (X, update) in schedule]
+
+        if parallel:
+            if parallel is True:
+                max_workers = None
+            else:
+                max_workers = parallel
+            groups = self._parallel_schedule(schedule)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                sweep = lambda: self._sweep_parallel(groups,
+                                                     executor,
+                                                     plot=plot)
+                self._iterate(sweep,
+                              repeat=repeat,
+                              tol=tol,
+                              verbose=verbose,
+                              bound_every=bound_every,
+                              accelerated=accelerated)
+        else:
+            sweep = lambda: self._sweep(schedule, plot=plot)
+            self._iterate(sweep,
+                          repeat=repeat,
+                          tol=tol,
+                          verbose=verbose,
+                          bound_every=bound_every,
+                          accelerated=accelerated)
+
+
+    def _iterate(self, sweep, repeat=1, tol=None, verbose=True, bound_every=1,
+                 accelerated=None):
+        """
+        Run iteration steps until convergence.
+
+        `sweep` updates each node once.  If `accelerated` is a list of nodes,
+        the steps are accelerated by extrapolating the parameters of the nodes.
+        """
 
         for i in range(repeat):
 
-            t = time.clock()
+            t = time.process_time()
+            w = time.perf_counter()
 
-            # Update nodes
-            for node in nodes:
-                X = self[node]
-                if hasattr(X, 'update') and callable(X.update):
-                    X.update()
-                if plot:
-                    self.plot(X)
-
-            cputime = time.clock() - t
-            if self._end_iteration_step(None, cputime, tol=tol, verbose=verbose):
+            if accelerated is not None:
+                self._squarem_step(sweep, accelerated)
+                method = 'SQUAREM'
+            else:
+                sweep()
+                method = None
+
+            cputime = time.process_time() - t
+            walltime = time.perf_counter() - w
+            if self._end_iteration_step(method, cputime, tol=tol,
+                                        verbose=verbose, walltime=walltime,
+                                        bound_every=(1 if accelerated is not None
+                                                     else bound_every),
+                                        force_bound=(i == repeat-1)):
                 return
 
 
+    def _sweep(self, schedule, plot=False):
+        """
+        Update each node of the schedule once.
+        """
+        for (X, update) in schedule:
+            if update is not None:
+                update()
+            if plot:
+                self.plot(X)
+
+
+    def _sweep_parallel(self, groups, executor, plot=False):
+        """
+        Update groups of independent nodes in parallel.
+        """
+        for group in groups:
+            if len(group) == 1:
+                group[0][1]()
+            else:
+                futures = [executor.submit(update)
+                           for (X, update) in group]
+                for future in futures:
+                    future.result()
+            if plot:
+                self.plot(*[X for (X, update) in group])
+
+
+    def _timed_update(self, node, update):
+        """
+        Wrap the update method of a node so that the time is recorded.
+        """
+        def timed_update():
+            t = time.perf_counter()
+            update()
+            self._node_times[node] = (self._node_times.get(node, 0)
+                                      + time.perf_counter() - t)
+        return timed_update
+
+
+    def _accelerated_nodes(self, schedule):
+        """
+        Find the nodes whose parameters are extrapolated in accelerated steps.
+
+        All the updated nodes must support getting and setting the parameters,
+        because an extrapolated step is rejected by restoring the parameters.
+        """
+        nodes = []
+        for (X, update) in schedule:
+            if update is None or np.all(X.observed) or X in nodes:
+                continue
+            if not (callable(getattr(X, 'get_parameters', None))
+                    and callable(getattr(X, 'set_parameters', None))):
+                raise ValueError("Node %s does not support accelerated "
+                                 "updates" % X.name)
+            nodes.append(X)
+        return nodes
+
+
+    def _squarem_step(self, sweep, nodes):
+        """
+        Take an iteration step using SQUAREM extrapolation.
+
+        Two VB-EM sweeps give the parameters x1 and x2 starting from x0.  The
+        extrapolated parameters are x0 - 2*a*r + a**2*v, where r = x1 - x0,
+        v = x2 - 2*x1 + x0 and a = -|r|/|v| (at most -1).  The extrapolated
+        parameters are stabilized with one sweep and accepted if the lower
+        bound is not smaller than after the two sweeps.  Otherwise, x2 is
+        restored.
+
+        Returns True if the extrapolated step was accepted.
+        """
+
+        x0 = self.get_parameters(*nodes)
+        sweep()
+        x1 = self.get_parameters(*nodes)
+        sweep()
+        x2 = self.get_parameters(*nodes)
+
+        r = self.add(x1, x0, scale=-1)
+        v = self.add(self.add(x2, x1, scale=-1), r, scale=-1)
+        rr = self.dot(r, r)
+        vv = self.dot(v, v)
+        if not vv > 0:
+            return False
+        alpha = -np.sqrt(rr / vv)
+        if not alpha < -1:
+            # The extrapolation would give x2
+            return False
+
+        L2 = self.compute_lowerbound()
+
+        x = self.add(self.add(x0, r, scale=-2*alpha), v, scale=alpha**2)
+        try:
+            # The extrapolated parameters may be invalid, which results in
+            # NaNs or failing decompositions
+            with np.errstate(all='ignore'):
+                self.set_parameters(x, *nodes)
+                sweep()
+                L = self.compute_lowerbound()
+        except (np.linalg.LinAlgError, ValueError):
+            L = np.nan
+
+        if L >= L2:
+            return True
+
+        self.set_parameters(x2, *nodes)
+        return False
+
+
     def has_converged(self, tol=None):
         return self.converged
 
 
+    def _compute_phi_change(self):
+        """
+        Compute the relative change of the natural parameters.
+
+        The change is measured since the previous call and it is the maximum
+        over the nodes of the norm of the change relative to the norm of the
+        previous parameters.  Returns NaN if there are no previous parameters.
+        """
+        change = 0
+        phis = {}
+        for node in self.model:
+            phi = getattr(node, 'phi', None)
+            if phi is None:
+                continue
+            phis[node] = [np.array(p, copy=True) for p in phi]
+            phi0 = self._phi.get(node)
+            if phi0 is None:
+                change = np.nan
+                continue
+            if ([np.shape(p) for p in phi0]
+                != [np.shape(p) for p in phis[node]]):
+                change = np.inf
+                continue
+            d = np.sqrt(sum(np.sum((p1 - p0)**2)
+                            for (p0, p1) in zip(phi0, phis[node])))
+            n = np.sqrt(sum(np.sum(p0**2) for p0 in phi0))
+            if d > 0:
+                change = max(change, d / n if n > 0 else np.inf)
+        self._phi = phis
+        return change
+
+
+
+    def _lower_bound_contribution(self, node):
+        """
+        Compute the lower bound term of a node using the cache if possible.
+
+        The term is recomputed only if the node, its parents or its mask have
+        changed since the term was cached.
+        """
+        version = node._lower_bound_version()
+        try:
+            (cached_version, lp) = self._bound_terms[node]
+        except KeyError:
+            pass
+        else:
+            if cached_version == version:
+                return lp
+        lp = node.lower_bound_contribution()
+        self._bound_terms[node] = (version, lp)
+        return lp
 
     def compute_lowerbound(self, ignore_masked=True):
         L = 0
         for node in self.model:
-            L += node.lower_bound_contribution(ignore_masked=ignore_masked)
+            if ignore_masked:
+                L += self._lower_bound_contribution(node)
+            else:
+                L += node.lower_bound_contribution(ignore_masked=False)
         return L
 
     def compute_lowerbound_terms(self, *nodes):
@@ -171,7 +786,7 @@ class VB():
     def loglikelihood_lowerbound(self):
         L = 0
         for node in self.model:
-            lp = node.lower_bound_contribution()
+            lp = self._lower_bound_contribution(node)
             L += lp
             self.l[node][self.iter] = lp
             
@@ -212,8 +827,151 @@ class VB():
         return self.l
 
 
+    def _connected_nodes(self):
+        """
+        Find all nodes connected to the model, including deterministic nodes.
+        """
+        nodes = []
+        visited = set()
+        stack = list(self.model)
+        while len(stack) > 0:
+            node = stack.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            nodes.append(node)
+            stack.extend(node.parents)
+            stack.extend(child for (child, index) in node.children)
+        return nodes
+
+
+    @contextlib.contextmanager
+    def profile(self, memory=False):
+        """
+        Profile the computations of the nodes.
+
+        Within the context, the calls of ``update``, ``_message_to_parent``,
+        ``get_moments`` and ``lower_bound_contribution`` of all the nodes
+        connected to the model are counted and timed (wall-clock time).  The
+        times are inclusive, that is, the time of an update contains the time
+        of the messages computed during the update.  The statistics are
+        accumulated to ``profile_stats`` and can be obtained with
+        ``get_profile`` or printed with ``print_profile``.
+
+        Parameters
+        ----------
+
+        memory : bool, optional
+
+            Record also the net change of the memory allocated during each
+            call using ``tracemalloc``.  This slows down the computations.
+
+        Examples
+        --------
+
+        >>> with Q.profile():
+        ...     Q.update(repeat=10)
+        >>> Q.print_profile()
+        """
+
+        lock = threading.Lock()
+
+        start_tracing = memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+
+        def wrap(node, key, function):
+            stats = self.profile_stats.setdefault(node, {})
+            def profiled(*args, **kwargs):
+                k = key(*args) if callable(key) else key
+                if memory:
+                    m = tracemalloc.get_traced_memory()[0]
+                t = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    t = time.perf_counter() - t
+                    if memory:
+                        m = tracemalloc.get_traced_memory()[0] - m
+                    else:
+                        m = 0
+                    with lock:
+                        s = stats.setdefault(k, [0, 0.0, 0])
+                        s[0] += 1
+                        s[1] += t
+                        s[2] += m
+            return profiled
+
+        def message_key(index):
+            return '_message_to_parent(%d)' % index
+
+        # Replace the methods by profiled versions
+        wrapped = []
+        for node in self._connected_nodes():
+            names = ['get_moments', 'lower_bound_contribution']
+            if _is_updatable(node):
+                names.append('update')
+            if len(node.parents) > 0:
+                names.append('_message_to_parent')
+            for name in names:
+                key = message_key if name == '_message_to_parent' else name
+                wrapped.append((node, name, node.__dict__.get(name)))
+                setattr(node, name, wrap(node, key, getattr(node, name)))
+
+        # Compiled schedules contain the original update methods
+        schedule = self._schedule
+        schedules = self._schedules
+        self._schedule = None
+        self._schedules = {}
+
+        try:
+            yield self.profile_stats
+        finally:
+            for (node, name, previous) in wrapped:
+                if previous is None:
+                    delattr(node, name)
+                else:
+                    setattr(node, name, previous)
+            self._schedule = schedule
+            self._schedules = schedules
+            if start_tracing:
+                tracemalloc.stop()
+
+
+    def get_profile(self):
+        """
+        Return the profiling statistics as a dictionary.
+
+        The dictionary maps node names to dictionaries which map method names
+        to dictionaries with keys 'calls', 'time' and 'bytes'.
+        """
+        return {node.name: {method: {'calls': calls,
+                                     'time': t,
+                                     'bytes': m}
+                            for (method, (calls, t, m)) in stats.items()}
+                for (node, stats) in self.profile_stats.items()}
+
+
+    def print_profile(self, limit=None):
+        """
+        Print the profiling statistics sorted by the time.
+        """
+        rows = [(node.name, method, calls, t, m)
+                for (node, stats) in self.profile_stats.items()
+                for (method, (calls, t, m)) in stats.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        print("%-30s %-26s %8s %12s %14s"
+              % ("Node", "Method", "Calls", "Time (s)", "Memory (B)"))
+        for row in rows:
+            print("%-30s %-26s %8d %12.6f %14d" % row)
+
+
     def save(self, *nodes, filename=None):
 
+        self.wait_for_autosave()
+
         if len(nodes) == 0:
             nodes = self.model
         else:
@@ -238,6 +996,9 @@ class VB():
 
         # Open HDF5 file
         h5f = h5py.File(filename, 'w')
+        if filename == self.autosave_filename:
+            # The statistics must be rewritten by the next background autosave
+            self._autosave_written = 0
 
         try:
             # Write each node
@@ -251,6 +1012,8 @@ class VB():
             # Write iteration statistics
             misc.write_to_hdf5(h5f, self.L, 'L')
             misc.write_to_hdf5(h5f, self.cputime, 'cputime')
+            misc.write_to_hdf5(h5f, self.walltime, 'walltime')
+            misc.write_to_hdf5(h5f, self.phi_change, 'phi_change')
             misc.write_to_hdf5(h5f, self.iter, 'iter')
             misc.write_to_hdf5(h5f, self.converged, 'converged')
             if self.callback_output is not None:
@@ -266,6 +1029,8 @@ class VB():
 
     def load(self, *nodes, filename=None, nodes_only=False):
 
+        self.wait_for_autosave()
+
         # By default, use the same file as for auto-saving
         if not filename:
             if self.autosave_filename:
@@ -300,6 +1065,19 @@ class VB():
             if not nodes_only:
                 self.L = h5f['L'][...]
                 self.cputime = h5f['cputime'][...]
+                try:
+                    self.walltime = h5f['walltime'][...]
+                except KeyError:
+                    # Files saved by older versions
+                    self.walltime = misc.nans(np.shape(self.cputime))
+                try:
+                    self.phi_change = h5f['phi_change'][...]
+                except KeyError:
+                    # Files saved by older versions
+                    self.phi_change = misc.nans(np.shape(self.cputime))
+                self._phi = {}
+                for node in self.model:
+                    self.node_time[node] = misc.nans(np.shape(self.L))
                 self.iter = h5f['iter'][...]
                 self.converged = h5f['converged'][...]
                 for node in nodes:
@@ -312,14 +1090,83 @@ class VB():
         finally:
             # Close file
             h5f.close()
+
+
+    def _autosave_in_background(self):
+        """
+        Take a snapshot of the state and write it in a background thread.
+        """
+
+        # Wait for the previous write in order to not queue snapshots
+        self.wait_for_autosave()
+
+        nodes = _Snapshot()
+        for node in self.model:
+            if node.name == '':
+                raise Exception("In order to save nodes, they must have "
+                                "(unique) names.")
+            if hasattr(node, 'save') and callable(node.save):
+                node.save(nodes.create_group(node.name))
+
+        # The iteration statistics are modified in place, thus copy the new
+        # values
+        start = self._autosave_written
+        stop = self.iter + 1
+        statistics = {'L': self.L,
+                      'cputime': self.cputime,
+                      'walltime': self.walltime,
+                      'phi_change': self.phi_change}
+        statistics = {name: np.array(x[start:stop])
+                      for (name, x) in statistics.items()}
+        boundterms = {node.name: np.array(self.l[node][start:stop])
+                      for node in self.model}
+        scalars = _Snapshot()
+        scalars.create_dataset('iter', data=self.iter)
+        scalars.create_dataset('converged', data=self.converged)
+        if self.callback_output is not None:
+            scalars.create_dataset('callback_output',
+                                   data=np.array(self.callback_output))
+        self._autosave_written = stop
+
+        def write(filename):
+            with h5py.File(filename, 'w' if start == 0 else 'a') as h5f:
+                _write_snapshot(h5f.require_group('nodes'), nodes)
+                _write_snapshot(h5f, scalars)
+                for (name, x) in statistics.items():
+                    _append_to_hdf5(h5f, x, name, start)
+                boundgroup = h5f.require_group('boundterms')
+                for (name, x) in boundterms.items():
+                    _append_to_hdf5(boundgroup, x, name, start)
+
+        if self._autosave_executor is None:
+            self._autosave_executor = ThreadPoolExecutor(max_workers=1)
+        self._autosave_future = self._autosave_executor.submit(
+            write,
+            self.autosave_filename
+        )
+
+
+    def wait_for_autosave(self):
+        """
+        Wait until the background autosave has been written.
+
+        Errors raised in the background thread are raised here.
+        """
+        future = self._autosave_future
+        if future is not None:
+            self._autosave_future = None
+            try:
+                future.result()
+            except:
+                # The file is in an unknown state, thus rewrite everything
+                self._autosave_written = 0
+                raise
+
         
     def __getitem__(self, name):
-        if name in self.model:
+        if name in self._nodes:
             return name
-        else:
-            # Dictionary for mapping node names to nodes
-            dictionary = {node.name: node for node in self.model}
-            return dictionary[name]        
+        return self._names[name]
 
     def plot(self, *nodes):
         """
@@ -435,7 +1282,8 @@ class VB():
         if collapsed is None:
             collapsed = []
 
-        t = time.clock()
+        t = time.process_time()
+        w = time.perf_counter()
 
         # Current parameters
         p = self.get_parameters(*nodes)
@@ -472,13 +1320,15 @@ class VB():
         L = self.compute_lowerbound()
 
         s = g2
-        cputime = time.clock() - t
+        cputime = time.process_time() - t
+        walltime = time.perf_counter() - w
         
-        self._end_iteration_step('OPT', cputime, tol=tol)
+        self._end_iteration_step('OPT', cputime, tol=tol, walltime=walltime)
 
         for i in range(maxiter-1):
 
-            t = time.clock()
+            t = time.process_time()
+            w = time.perf_counter()
 
             # Get gradients
             if riemannian and method == 'gradient':
@@ -537,8 +1387,10 @@ class VB():
 
             p = p_new
             
-            cputime = time.clock() - t
-            if self._end_iteration_step('OPT', cputime, tol=tol):
+            cputime = time.process_time() - t
+            walltime = time.perf_counter() - w
+            if self._end_iteration_step('OPT', cputime, tol=tol,
+                                        walltime=walltime):
                 break
 
 
@@ -551,7 +1403,8 @@ class VB():
         if collapsed is None:
             collapsed = []
 
-        t = time.clock()
+        t = time.process_time()
+        w = time.perf_counter()
 
         # Update all nodes
         for x in nodes:
@@ -595,8 +1448,9 @@ class VB():
         for x in collapsed:
             self[x].update()
 
-        cputime = time.clock() - t
-        self._end_iteration_step('PS', cputime)
+        cputime = time.process_time() - t
+        walltime = time.perf_counter() - w
+        self._end_iteration_step('PS', cputime, walltime=walltime)
 
 
     def set_annealing(self, annealing):
@@ -611,25 +1465,100 @@ class VB():
         """
         for node in self.model:
             node.annealing = annealing
+        # The annealing affects the lower bound terms of all nodes
+        self._bound_terms.clear()
         self.annealing_changed = True
         self.converged = False
         return
 
 
+    def prune(self, *nodes, mass=1e-3, precision=1e6, verbose=True):
+        """
+        Remove dead mixture components and latent dimensions from the model.
+
+        A mixture cluster is dead if the expected number of its members is
+        below `mass`.  A component of the last plate axis of a gamma node
+        (e.g., an ARD precision) is dead if its expected precision exceeds
+        `precision`, which switches off a latent dimension.  The dead
+        components are removed from all the nodes which share the axis (e.g.,
+        the cluster assignments, the mixture weights and the cluster
+        parameters), so the following updates are cheaper.  The posterior
+        approximation of the remaining components is conditioned on the
+        removed components, thus the lower bound may change slightly.
+
+        Axes which can not be mapped between some of the linked nodes are not
+        pruned.  At least one component is always kept.  If no nodes are
+        given, all the nodes of the model are checked.
+        """
+        if len(nodes) == 0:
+            nodes = self.model
+        pruned = False
+        for node in nodes:
+            for (axis, keep) in node._dead_axes(mass=mass,
+                                                precision=precision):
+                try:
+                    group = _prune_group(node, axis)
+                except NotImplementedError:
+                    if verbose:
+                        print("Could not prune dead components of %s"
+                              % (node.name or node.__class__.__name__))
+                    continue
+                # A group of plate axes only is not a latent dimension
+                if all(not isinstance(a, int) or a < 0
+                       for a in group.values()):
+                    continue
+                size = node._prune_size(axis)
+                for (n, a) in group.items():
+                    n._prune(a, keep)
+                for n in group:
+                    for (child, index) in n.children:
+                        child._message_cache = {}
+                pruned = True
+                if verbose:
+                    print("Pruned %d of %d components of %s"
+                          % (size - len(keep),
+                             size,
+                             node.name or node.__class__.__name__))
+        if pruned:
+            self._phi = {}
+            self._bound_terms.clear()
+            self.annealing_changed = True
+            self.converged = False
+        return
+
+
     def _append_iterations(self, iters):
         """
         Append some arrays for more iterations
+
+        The arrays are grown at least geometrically so that the cost of
+        appending is amortized constant per iteration.
         """
+        iters = max(iters, len(self.L))
         self.L = np.append(self.L, misc.nans(iters))
         self.cputime = np.append(self.cputime, misc.nans(iters))
+        self.walltime = np.append(self.walltime,
+                                  misc.nans(len(self.L) - len(self.walltime)))
+        self.phi_change = np.append(self.phi_change,
+                                    misc.nans(len(self.L)
+                                              - len(self.phi_change)))
         for (node, l) in self.l.items():
             self.l[node] = np.append(l, misc.nans(iters))
+        for (node, t) in self.node_time.items():
+            self.node_time[node] = np.append(t,
+                                             misc.nans(len(self.L) - len(t)))
         return
 
 
-    def _end_iteration_step(self, method, cputime, tol=None, verbose=True):
+    def _end_iteration_step(self, method, cputime, tol=None, verbose=True,
+                            walltime=np.nan, bound_every=1,
+                            force_bound=False):
         """
         Do some routines after each iteration step
+
+        If `bound_every` is larger than one, the lower bound is computed only
+        on every `bound_every`-th step, on forced steps and on steps at which
+        the relative change of the natural parameters is below the tolerance.
         """
 
         self.iter += 1
@@ -648,33 +1577,66 @@ class VB():
                     self.callback_output = np.concatenate((self.callback_output,z),
                                                           axis=-1)
 
-        L = self.loglikelihood_lowerbound()
+        if tol is None:
+            tol = self.tol
+
+        # Use the change of the natural parameters as a cheap proxy for the
+        # convergence between the lower bound evaluations
+        if bound_every > 1:
+            dphi = self._compute_phi_change()
+            self.phi_change[self.iter] = dphi
+            compute_bound = (force_bound
+                             or self.iter % bound_every == 0
+                             or not dphi >= tol)
+        else:
+            compute_bound = True
 
         self.cputime[self.iter] = cputime
-        self.L[self.iter] = L
+        self.walltime[self.iter] = walltime
+
+        # Store the update times of the nodes
+        if self.node_timing:
+            for node in self.model:
+                self.node_time[node][self.iter] = self._node_times.get(node, 0)
+        self._node_times.clear()
+
+        if compute_bound:
+            L = self.loglikelihood_lowerbound()
+            self.L[self.iter] = L
+            message = "loglike=%e" % L
+        else:
+            message = "phi change=%e" % dphi
 
         if verbose:
             if method:
-                print("Iteration %d (%s): loglike=%e (%.3f seconds)"
-                      % (self.iter+1, method, L, cputime))
+                print("Iteration %d (%s): %s (%.3f seconds)"
+                      % (self.iter+1, method, message, cputime))
             else:
-                print("Iteration %d: loglike=%e (%.3f seconds)"
-                      % (self.iter+1, L, cputime))
+                print("Iteration %d: %s (%.3f seconds)"
+                      % (self.iter+1, message, cputime))
+
+        # Find the previous step at which the lower bound was computed
+        previous = self.iter - 1
+        if previous >= 0 and not np.isfinite(self.L[previous]):
+            computed = np.flatnonzero(np.isfinite(self.L[:previous]))
+            previous = computed[-1] if len(computed) > 0 else -1
 
         # Check the progress of the iteration
         self.converged = False
-        if not self.ignore_bound_checks and not self.annealing_changed and self.iter > 0:
+        if (compute_bound
+            and not self.ignore_bound_checks
+            and not self.annealing_changed
+            and previous >= 0):
+            L0 = self.L[previous]
+            L1 = self.L[self.iter]
+
             # Check for errors
-            if self.L[self.iter-1] - L > 1e-6:
-                L_diff = (self.L[self.iter-1] - L)
+            if L0 - L1 > 1e-6:
+                L_diff = (L0 - L1)
                 warnings.warn("Lower bound decreased %e! Bug somewhere or "
                               "numerical inaccuracy?" % L_diff)
 
             # Check for convergence
-            L0 = self.L[self.iter-1]
-            L1 = self.L[self.iter]
-            if tol is None:
-                tol = self.tol
             div = 0.5 * (abs(L0) + abs(L1))
             if (L1 - L0) / div < tol:
             #if (L1 - L0) / div < tol or L1 - L0 <= 0:
@@ -686,10 +1648,18 @@ class VB():
         if (self.autosave_iterations > 0 
             and np.mod(self.iter, self.autosave_iterations) == 0):
 
-            self.save(filename=self.autosave_filename)
-            if verbose:
-                print('Auto-saved to %s' % self.autosave_filename)
+            if self.autosave_background:
+                self._autosave_in_background()
+                if verbose:
+                    print('Auto-saving to %s' % self.autosave_filename)
+            else:
+                self.save(filename=self.autosave_filename)
+                if verbose:
+                    print('Auto-saved to %s' % self.autosave_filename)
 
-        self.annealing_changed = False
+        # The annealing change is taken into account in the next computed
+        # lower bound
+        if compute_bound:
+            self.annealing_changed = False
 
         return self.converged
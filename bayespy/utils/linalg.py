@@ -44,22 +44,45 @@ import scipy.sparse as sparse
 from . import misc
 
 def chol(C):
+    """
+    Compute the Cholesky decomposition of positive-definite matrices.
+
+    The last two axes of C are considered as the matrix and the decomposition
+    is computed for all the matrices at once.  Returns upper triangular U such
+    that C = U^T * U, using the upper triangle of C.
+    """
     if sparse.issparse(C):
         # Sparse Cholesky decomposition (returns a Factor object)
         return cholmod.cholesky(C)
     else:
-        # Computes Cholesky decomposition for a collection of matrices.
-        # The last two axes of C are considered as the matrix.
+        # NumPy computes the lower triangular factor using the lower triangle,
+        # thus transpose the matrices
         C = np.atleast_2d(C)
-        U = np.empty(np.shape(C))
-        for i in misc.nested_iterator(np.shape(U)[:-2]):
-            try:
-                U[i] = linalg.cho_factor(C[i])[0]
-            except np.linalg.linalg.LinAlgError:
-                raise Exception("Matrix not positive definite")
-        return U
+        try:
+            L = np.linalg.cholesky(np.swapaxes(C, -1, -2))
+        except np.linalg.LinAlgError:
+            raise np.linalg.LinAlgError("Matrix not positive definite")
+        return np.swapaxes(L, -1, -2)
+
+
+def _chol_inv_factor(U):
+    """
+    Compute the inverses of upper triangular Cholesky factors.
+
+    For triangular matrices, the LU decomposition used by NumPy does not pivot,
+    thus this is a stacked triangular inversion.
+    """
+    return np.linalg.inv(U)
+
 
 def chol_solve(U, b, out=None, matrix=False):
+    """
+    Solve C*x=b given the Cholesky factor U of C.
+
+    The last two axes of U and the last axis of b (or the last two axes if
+    `matrix` is True) are the linear algebra axes, the other axes are
+    broadcasted.  All the systems are solved at once.
+    """
     if isinstance(U, np.ndarray):
         if sparse.issparse(b):
             b = b.toarray()
@@ -67,62 +90,31 @@ def chol_solve(U, b, out=None, matrix=False):
         if matrix:
             if np.ndim(b) < 2:
                 raise ValueError("b is not a matrix")
-            b = np.swapaxes(b, -1, -2)
-            U = U[...,None,:,:]
-            
-            
-        # Allocate memory
+
         U = np.atleast_2d(U)
         B = np.atleast_1d(b)
-        sh_u = U.shape[:-2]
-        sh_b = B.shape[:-1]
-        l_u = len(sh_u)
-        l_b = len(sh_b)
-
-        # Check which axis are iterated over with B along with U
-        ind_b = [slice(None)] * l_b
-        l_min = min(l_u, l_b)
-        jnd_b = tuple(i for i in range(-l_min,0) if sh_b[i]==sh_u[i])
-
-        if out == None:
-            # Shape of the result (broadcasting rules)
-            sh = misc.broadcasted_shape(sh_u, sh_b)
-            #out = np.zeros(np.shape(B))
-            out = np.zeros(sh + B.shape[-1:])
-        for i in misc.nested_iterator(np.shape(U)[:-2]):
-
-            # The goal is to run Cholesky solver once for all vectors of B
-            # for which the matrices of U are the same (according to the
-            # broadcasting rules). Thus, we collect all the axes of B for
-            # which U is singleton and form them as a 2-D matrix and then
-            # run the solver once.
-
-            # Select those axes of B for which U and B are not singleton
-            for j in jnd_b:
-                ind_b[j] = i[j]
-
-            # Collect all the axes for which U is singleton
-            b = B[tuple(ind_b) + (slice(None),)]
-
-            # Reshape it to a 2-D (or 1-D) array
-            orig_shape = b.shape
-            if b.ndim > 1:
-                b = b.reshape((-1, b.shape[-1]))
-
-            # slice(None) to all preceeding axes and ellipsis for the last
-            # axis:
-            if len(ind_b) < len(sh):
-                ind_out = (slice(None),) + tuple(ind_b) + (slice(None),)
-            else:
-                ind_out = tuple(ind_b) + (slice(None),)
-
-            out[ind_out] = linalg.cho_solve((U[i], False),
-                                            b.T).T.reshape(orig_shape)
+        if not matrix:
+            B = B[...,None]
+
+        if np.ndim(U) == 2:
+            # A single matrix: solve all the right-hand sides at once using
+            # triangular solvers
+            sh = B.shape[:-2]
+            (D, K) = B.shape[-2:]
+            B = np.moveaxis(B, -2, 0).reshape((D, -1))
+            x = linalg.cho_solve((U, False), B)
+            x = np.moveaxis(x.reshape((D,) + sh + (K,)), 0, -2)
+        else:
+            # C^-1 = U^-1 * U^-T
+            V = _chol_inv_factor(U)
+            x = np.matmul(V, np.matmul(np.swapaxes(V, -1, -2), B))
 
+        if not matrix:
+            x = x[...,0]
 
-        if matrix:
-            out = np.swapaxes(out, -1, -2)
-            
+        if out is None:
+            return x
+        out[...] = x
         return out
 
     elif isinstance(U, cholmod.Factor):
@@ -135,15 +127,20 @@ def chol_solve(U, b, out=None, matrix=False):
         raise ValueError("Unknown type of Cholesky factor")
 
 def chol_inv(U):
+    """
+    Compute the inverse of C given the Cholesky factor U of C.
+
+    The last two axes of U are the matrix, the inverse is computed for all the
+    matrices at once.
+    """
     if isinstance(U, np.ndarray):
-        # Allocate memory
-        V = np.tile(np.identity(np.shape(U)[-1]), np.shape(U)[:-2]+(1,1))
-        for i in misc.nested_iterator(np.shape(U)[:-2]):
-            V[i] = linalg.cho_solve((U[i], False),
-                                    V[i],
-                                    overwrite_b=True) # This would need Fortran order
-
-        return V
+        U = np.atleast_2d(U)
+        if np.ndim(U) == 2:
+            return linalg.cho_solve((U, False),
+                                    np.identity(np.shape(U)[-1]))
+        # C^-1 = U^-1 * U^-T
+        V = _chol_inv_factor(U)
+        return np.matmul(V, np.swapaxes(V, -1, -2))
     elif isinstance(U, cholmod.Factor):
         raise NotImplementedError
         ## if sparse.issparse(b):
@@ -398,7 +395,8 @@ def m_dot(A,b):
     # TODO: Use einsum!!
     #return np.sum(A*b[...,np.newaxis,:], axis=(-1,))
 
-def block_banded_solve(A, B, y):
+def block_banded_solve(A, B, y, method='sequential', steady_state_tol=None,
+                       max_transient=100):
     """
     Invert symmetric, banded, positive-definite matrix.
 
@@ -412,7 +410,23 @@ def block_banded_solve(A, B, y):
     B: (..., N-1, D, D)
     y: (...,   N,    D)
 
-    The algorithm is basically LU decomposition.
+    The algorithm is basically LU decomposition.  With method='sequential',
+    the blocks are eliminated one by one, which requires a loop over N.  With
+    method='cyclic', block cyclic reduction is used: every other block is
+    eliminated simultaneously, which requires only log2(N) vectorized steps.
+    The cyclic reduction is much faster for long chains with small blocks.
+    Both methods are vectorized over the plates.
+
+    If the blocks are constant in time (except possibly the first and the
+    last ones), the sequential recursions converge to a steady state.  If
+    steady_state_tol is given, the sequential method detects the convergence
+    (the maximum absolute change of the blocks relative to the maximum
+    absolute value is below the tolerance) and uses the converged blocks for
+    the rest of the chain.  Then, the remaining steps require only a few
+    matrix-vector products instead of Cholesky decompositions.  With
+    method='auto', the sequential method with the steady state is used if the
+    blocks are constant and the recursion converges within max_transient
+    steps, otherwise the cyclic reduction is used.
 
     Computes only the diagonal and super-diagonal blocks of the
     inverse. The true inverse is dense, in general.
@@ -441,6 +455,42 @@ def block_banded_solve(A, B, y):
     if np.shape(B)[-2:] != (D,D):
         raise ValueError("The diagonal blocks have wrong shape")
 
+    if method == 'cyclic':
+        return _block_banded_solve_cyclic(A, B, y)
+    elif method == 'sequential':
+        return _block_banded_solve_sequential(A, B, y,
+                                              steady_state_tol=steady_state_tol)
+    elif method == 'auto':
+        if steady_state_tol is not None and N > 3:
+            n_steady = max(_first_constant_block(A[...,1:-1,:,:]),
+                           _first_constant_block(B[...,:-1,:,:]))
+            if n_steady + max_transient < N // 2:
+                result = _block_banded_solve_sequential(
+                    A, B, y,
+                    steady_state_tol=steady_state_tol,
+                    max_transient=max_transient
+                )
+                if result is not None:
+                    return result
+        return _block_banded_solve_cyclic(A, B, y)
+    else:
+        raise ValueError("Unknown method: %s" % method)
+
+
+def _block_banded_solve_sequential(A, B, y, steady_state_tol=None,
+                                   max_transient=None):
+    """
+    Solve block-banded system by eliminating the blocks one by one.
+
+    If max_transient is given and the recursion does not converge to the
+    steady state within that many steps, None is returned.
+
+    See `block_banded_solve` for the arguments and return values.
+    """
+
+    N = np.shape(y)[-2]
+    D = np.shape(y)[-1]
+
     plates_VC = misc.broadcasted_shape(np.shape(A)[:-3],
                                        np.shape(B)[:-3])
     plates_y = misc.broadcasted_shape(plates_VC,
@@ -450,6 +500,18 @@ def block_banded_solve(A, B, y):
     C = np.empty(plates_VC+(N-1,D,D))
     x = np.empty(plates_y+(N,D))
 
+    # The steady state can be used for the steps n >= n_steady which use
+    # constant blocks A[n+1] and B[n].  The last step is excluded because the
+    # last diagonal block is often different.
+    if steady_state_tol is not None and N > 3:
+        n_steady = max(_first_constant_block(A[...,1:-1,:,:]),
+                       _first_constant_block(B[...,:-1,:,:]))
+    else:
+        n_steady = N
+
+    # Index of the first steady-state block of the forward recursion
+    s_forward = N
+
     #
     # Forward recursion
     #
@@ -460,15 +522,10 @@ def block_banded_solve(A, B, y):
     # TODO: This whole algorithm could be implemented as in-place operation.
     # Might be a nice feature (optional?)
 
-    x[...,0,:] = y[...,0,:]
     V[...,0,:,:] = chol(A[...,0,:,:])
     ldet = chol_logdet(V[...,0,:,:])
-    for n in range(N-1):
-        # Compute the solution of the system
-        x[...,n+1,:] = (y[...,n+1,:] 
-                        - mvdot(misc.T(B[...,n,:,:]), 
-                                chol_solve(V[...,n,:,:], 
-                                           x[...,n,:])))
+    n = 0
+    while n < N-1:
         # Compute the superdiagonal block of the inverse
         C[...,n,:,:] = chol_solve(V[...,n,:,:], 
                                   B[...,n,:,:],
@@ -482,25 +539,398 @@ def block_banded_solve(A, B, y):
         V[...,n+1,:,:] = chol(V[...,n+1,:,:])
         # Compute the log-det term here, too
         ldet += chol_logdet(V[...,n+1,:,:])
+        n += 1
+        if (max_transient is not None
+            and s_forward == N
+            and n > n_steady + max_transient):
+            return None
+        # If the recursion has converged, the remaining blocks up to the last
+        # step are equal
+        if (n_steady < n < N-2
+            and _has_converged(V[...,n,:,:],
+                               V[...,n-1,:,:],
+                               steady_state_tol)):
+            s_forward = n
+            C[...,n:-1,:,:] = chol_solve(V[...,n,:,:],
+                                         B[...,n,:,:],
+                                         matrix=True)[...,None,:,:]
+            V[...,n+1:-1,:,:] = V[...,n,None,:,:]
+            ldet += (N-2-n) * chol_logdet(V[...,n,:,:])
+            n = N-2
+
+    # Inverses of the diagonal blocks of the Cholesky factorization
+    invV = np.empty(plates_VC+(N,D,D))
+    s = min(s_forward, N-1)
+    invV[...,:s,:,:] = chol_inv(V[...,:s,:,:])
+    if s < N-1:
+        invV[...,s:-1,:,:] = chol_inv(V[...,s,:,:])[...,None,:,:]
+    invV[...,-1,:,:] = chol_inv(V[...,-1,:,:])
+
+    #
+    # Solution of the system
+    #
+
+    # Forward substitution: x[n+1] = y[n+1] - B[n]^T * V[n]^-1 * x[n]
+    x[...] = _linear_recursion(-misc.T(C),
+                               y[...,1:,:],
+                               y[...,0,:])
+    # Backward substitution: x[n] = V[n]^-1 * (x[n] - B[n] * x[n+1])
+    z = mvdot(invV, x)
+    x[...] = _linear_recursion(-np.matmul(invV[...,-2::-1,:,:],
+                                          B[...,::-1,:,:]),
+                               z[...,-2::-1,:],
+                               z[...,-1,:])[...,::-1,:]
 
     #
     # Backward recursion
     #
-    x[...,-1,:] = chol_solve(V[...,-1,:,:], x[...,-1,:])
-    V[...,-1,:,:] = chol_inv(V[...,-1,:,:])
-    for n in reversed(range(N-1)):
-        # Compute the solution of the system
-        x[...,n,:] = chol_solve(V[...,n,:,:], 
-                                x[...,n,:] - mvdot(B[...,n,:,:], 
-                                                   x[...,n+1,:]))
+    if s_forward < N:
+        C_steady = np.array(C[...,s_forward,:,:])
+
+    V[...,-1,:,:] = invV[...,-1,:,:]
+    n = N-2
+    while n >= 0:
         # Compute the diagonal block of the inverse
-        V[...,n,:,:] = (chol_inv(V[...,n,:,:]) 
+        V[...,n,:,:] = (invV[...,n,:,:]
                         + mmdot(C[...,n,:,:], 
                                 mmdot(V[...,n+1,:,:], 
                                 misc.T(C[...,n,:,:]))))
         C[...,n,:,:] = - mmdot(C[...,n,:,:], V[...,n+1,:,:])
         # Ensure symmetry by 0.5*(V+V.T)
         V[...,n,:,:] = 0.5 * (V[...,n,:,:] + misc.T(V[...,n,:,:]))
+        # If the recursion has converged, the blocks are equal down to the
+        # first steady-state block of the forward recursion
+        if (s_forward < n < N-2
+            and _has_converged(V[...,n,:,:],
+                               V[...,n+1,:,:],
+                               steady_state_tol)):
+            V[...,s_forward:n,:,:] = V[...,n,None,:,:]
+            C[...,s_forward:n,:,:] = -mmdot(C_steady,
+                                            V[...,n,:,:])[...,None,:,:]
+            n = s_forward
+        n -= 1
 
     return (V, C, x, ldet)
+
+
+def _linear_recursion(M, c, x0):
+    """
+    Compute x[0]=x0 and x[n+1]=M[n]*x[n]+c[n] for all n.
+
+    The time axis is the third last axis of M and the second last axis of c.
+    The recursion is split into about sqrt(N) chunks of length about sqrt(N).
+    The recursions within the chunks are vectorized over the chunks, thus only
+    about 3*sqrt(N) vectorized steps are needed.
+    """
+    N = np.shape(c)[-2]
+    D = np.shape(c)[-1]
+    plates = misc.broadcasted_shape(np.shape(M)[:-3],
+                                    np.shape(c)[:-2],
+                                    np.shape(x0)[:-1])
+
+    # Split the recursion into K chunks of length L
+    L = max(1, int(np.ceil(np.sqrt(N))))
+    K = max(1, int(np.ceil(N / L)))
+    M_chunks = np.zeros(plates + (K*L,D,D))
+    M_chunks[...,:N,:,:] = M
+    M_chunks = np.reshape(M_chunks, plates + (K,L,D,D))
+    c_chunks = np.zeros(plates + (K*L,D))
+    c_chunks[...,:N,:] = c
+    c_chunks = np.reshape(c_chunks, plates + (K,L,D))
+
+    # Recursions within the chunks starting from zero and the matrices that
+    # map the first value of a chunk to the first value of the next chunk
+    z = np.zeros(plates + (K,D))
+    T = np.zeros(plates + (K,D,D)) + np.identity(D)
+    for j in range(L):
+        z = mvdot(M_chunks[...,j,:,:], z) + c_chunks[...,j,:]
+        T = np.matmul(M_chunks[...,j,:,:], T)
+
+    # The first values of the chunks
+    x_first = np.empty(plates + (K,D))
+    x_first[...,0,:] = x0
+    for k in range(K-1):
+        x_first[...,k+1,:] = (mvdot(T[...,k,:,:], x_first[...,k,:])
+                              + z[...,k,:])
+
+    # Recursions within the chunks starting from the correct values
+    x = np.empty(plates + (K,L,D))
+    x_j = x_first
+    for j in range(L):
+        x_j = mvdot(M_chunks[...,j,:,:], x_j) + c_chunks[...,j,:]
+        x[...,j,:] = x_j
+
+    return np.concatenate([x_first[...,:1,:],
+                           np.reshape(x, plates + (K*L,D))[...,:N,:]],
+                          axis=-2)
+
+
+def _first_constant_block(X):
+    """
+    Find the first index n such that the blocks X[n:] are equal.
+
+    The blocks are on the third last axis.
+    """
+    X = np.asarray(X)
+    if np.shape(X)[-3] == 0:
+        return 0
+    changed = np.any(X != X[...,-1:,:,:], axis=(-1,-2))
+    changed = np.any(np.reshape(changed, (-1, np.shape(changed)[-1])),
+                     axis=0)
+    changed = np.flatnonzero(changed)
+    if len(changed) == 0:
+        return 0
+    return changed[-1] + 1
+
+
+def _has_converged(X, X0, tol):
+    """
+    Check whether the maximum absolute change is small relative to X.
+    """
+    return np.max(np.abs(X - X0)) <= tol * np.max(np.abs(X))
+
+
+def _block_banded_solve_cyclic(A, B, y):
+    """
+    Block cyclic reduction for symmetric positive-definite block-tridiagonal
+    matrices.
+
+    The odd blocks are eliminated which gives a block-tridiagonal Schur
+    complement for the even blocks.  The reduced system is solved recursively
+    and the solution and the inverse blocks of the odd blocks are obtained
+    from the even blocks.  All steps are vectorized over the eliminated
+    blocks, so the recursion has log2(N) levels.
+
+    See `block_banded_solve` for the arguments and return values.
+    """
+
+    A = np.asarray(A)
+    B = np.asarray(B)
+    y = np.asarray(y)
+
+    N = np.shape(A)[-3]
+    D = np.shape(A)[-1]
+
+    if N == 1:
+        U = chol(A[...,0,:,:])
+        V = chol_inv(U)[...,None,:,:]
+        C = np.empty(np.shape(V)[:-3] + (0,D,D))
+        x = chol_solve(U, y[...,0,:])[...,None,:]
+        return (V, C, x, chol_logdet(U))
+
+    plates_VC = misc.broadcasted_shape(np.shape(A)[:-3],
+                                       np.shape(B)[:-3])
+    plates_y = misc.broadcasted_shape(plates_VC,
+                                      np.shape(y)[:-2])
+
+    # Odd blocks n=2j+1 are eliminated.  Their coupling to the previous and
+    # the next even block is given by Bl[j] (=B[n-1]) and Br[j] (=B[n]).
+    # The last odd block has no next block if N is even.
+    Ne = (N+1) // 2
+    No = N // 2
+    Nr = (N-1) // 2
+    U = chol(A[...,1::2,:,:])
+    invA = chol_inv(U)
+    ldet = np.sum(chol_logdet(U), axis=-1)
+    Bl = B[...,0::2,:,:]
+    Br = B[...,1::2,:,:]
+    F = np.matmul(invA, misc.T(Bl))
+    G = np.matmul(invA[...,:Nr,:,:], Br)
+    z = mvdot(invA, y[...,1::2,:])
+
+    # Schur complement for the even blocks
+    A_even = np.array(np.broadcast_to(A[...,0::2,:,:],
+                                      plates_VC + (Ne,D,D)))
+    A_even[...,:No,:,:] -= np.matmul(Bl, F)
+    A_even[...,1:,:,:] -= np.matmul(misc.T(Br), G)
+    B_even = -np.matmul(Bl[...,:Nr,:,:], G)
+    y_even = np.array(np.broadcast_to(y[...,0::2,:],
+                                      plates_y + (Ne,D)))
+    y_even[...,:No,:] -= mvdot(Bl, z)
+    y_even[...,1:,:] -= mvdot(misc.T(Br), z[...,:Nr,:])
+
+    (V_even, C_even, x_even, ldet_even) = _block_banded_solve_cyclic(A_even,
+                                                                     B_even,
+                                                                     y_even)
+
+    # The odd block is conditionally independent of the others given the
+    # neighbouring even blocks:
+    #   x[n] = z[j] - F[j]*x[n-1] - G[j]*x[n+1]
+    x_odd = z - mvdot(F, x_even[...,:No,:])
+    x_odd[...,:Nr,:] -= mvdot(G, x_even[...,1:,:])
+
+    # Cov(x[n-1],x[n]), Cov(x[n],x[n+1]) and Cov(x[n])
+    C_prev = -np.matmul(V_even[...,:No,:,:], misc.T(F))
+    C_prev[...,:Nr,:,:] -= np.matmul(C_even, misc.T(G))
+    C_next = -(np.matmul(F[...,:Nr,:,:], C_even)
+               + np.matmul(G, V_even[...,1:,:,:]))
+    V_odd = invA - np.matmul(F, C_prev)
+    V_odd[...,:Nr,:,:] -= np.matmul(G, misc.T(C_next))
+    # Ensure symmetry by 0.5*(V+V.T)
+    V_odd = 0.5 * (V_odd + misc.T(V_odd))
+
+    # Combine the even and odd blocks
+    V = np.empty(plates_VC + (N,D,D))
+    C = np.empty(plates_VC + (N-1,D,D))
+    x = np.empty(plates_y + (N,D))
+    V[...,0::2,:,:] = V_even
+    V[...,1::2,:,:] = V_odd
+    C[...,0::2,:,:] = C_prev
+    C[...,1::2,:,:] = C_next
+    x[...,0::2,:] = x_even
+    x[...,1::2,:] = x_odd
+
+    return (V, C, x, ldet + ldet_even)
     
+
+
+def block_banded_solve_checkpointed(blocks, N, consume, segment_length=None):
+    """
+    Solve block-banded system in segments using bounded memory.
+
+    This is the sequential elimination of `block_banded_solve` (without the
+    steady state) but the blocks are requested and the results are given in
+    segments.  The forward recursion stores only the state at the boundaries
+    of the segments.  In the backward recursion, the forward recursion is
+    recomputed for one segment at a time.  Thus, with segments of length
+    sqrt(N), the memory usage is O(sqrt(N)) blocks instead of O(N) at the
+    cost of computing the forward recursion twice.
+
+    blocks(start, stop) must return the diagonal blocks A[...,start:stop,:,:],
+    the superdiagonal blocks B[...,start:min(stop,N-1),:,:] and the vectors
+    y[...,start:stop,:] as defined in `block_banded_solve`.
+
+    consume(start, V, C, x) is called for each segment from the last to the
+    first one.  V and x contain the diagonal blocks of the inverse and the
+    solution for the indices start,...,stop and C contains the
+    superdiagonal blocks of the inverse for the indices start,...,stop-1.
+    For the last segment, stop is N-1.  Thus, the segments overlap by one
+    block so that each superdiagonal block is given exactly once together
+    with the both diagonal blocks it connects.
+
+    Return the log-determinant.
+    """
+
+    if segment_length is None:
+        segment_length = int(np.ceil(np.sqrt(N)))
+    L = max(1, int(segment_length))
+    starts = list(range(0, N, L))
+
+    def get_blocks(start):
+        stop = min(start + L, N)
+        (A, B, y) = blocks(start, stop)
+        if np.shape(A)[-3:] != (stop-start,) + np.shape(y)[-1:]*2:
+            raise ValueError("The diagonal blocks have wrong shape")
+        if np.shape(B)[-3] != min(stop, N-1) - start:
+            raise ValueError("The number of super-diagonal blocks is "
+                             "incorrect")
+        return (A, B, y)
+
+    #
+    # Forward recursion
+    #
+
+    # Store only the effect of the previous segment on the first block of each
+    # segment: A[n] - B[n-1]^T*V[n-1]^-1*B[n-1] and
+    # y[n] - B[n-1]^T*V[n-1]^-1*x[n-1]
+    checkpoints = []
+    P = 0
+    q = 0
+    ldet = 0
+    for start in starts:
+        checkpoints.append((P, q))
+        (A, B, y) = get_blocks(start)
+        (U, C, x, P, q, ldet_segment) = _forward_segment(A, B, y, P, q)
+        ldet = ldet + ldet_segment
+
+    #
+    # Backward recursion
+    #
+    V_next = None
+    x_next = None
+    for (start, (P, q)) in reversed(list(zip(starts, checkpoints))):
+        (A, B, y) = get_blocks(start)
+        (U, C, x, _, _, _) = _forward_segment(A, B, y, P, q)
+        (V, C, x) = _backward_segment(U, C, x, V_next, x_next)
+        consume(start, V, C, x)
+        V_next = V[...,0,:,:]
+        x_next = x[...,0,:]
+
+    return ldet
+
+
+def _forward_segment(A, B, y, P, q):
+    """
+    Eliminate the blocks of one segment.
+
+    Return the Cholesky factors of the diagonal blocks, the superdiagonal
+    blocks C[n]=V[n]^-1*B[n], the forward substituted vectors, the effect on
+    the next segment and the log-determinant term.
+    """
+    M = np.shape(A)[-3]
+    D = np.shape(A)[-1]
+    K = np.shape(B)[-3]
+    plates_VC = misc.broadcasted_shape(np.shape(A)[:-3],
+                                       np.shape(B)[:-3],
+                                       np.shape(P)[:-2])
+    plates_y = misc.broadcasted_shape(plates_VC,
+                                      np.shape(y)[:-2],
+                                      np.shape(q)[:-1])
+    U = np.empty(plates_VC+(M,D,D))
+    C = np.empty(plates_VC+(K,D,D))
+    x = np.empty(plates_y+(M,D))
+    ldet = 0
+    for n in range(M):
+        V = A[...,n,:,:] - P
+        # Ensure symmetry by 0.5*(V+V.T)
+        U[...,n,:,:] = chol(0.5 * (V + misc.T(V)))
+        ldet = ldet + chol_logdet(U[...,n,:,:])
+        x[...,n,:] = y[...,n,:] - q
+        if n < K:
+            C[...,n,:,:] = chol_solve(U[...,n,:,:],
+                                      B[...,n,:,:],
+                                      matrix=True)
+            P = mmdot(misc.T(B[...,n,:,:]), C[...,n,:,:])
+            q = mvdot(misc.T(C[...,n,:,:]), x[...,n,:])
+    return (U, C, x, P, q, ldet)
+
+
+def _backward_segment(U, C, x, V_next, x_next):
+    """
+    Compute the inverse blocks and the solution of one segment.
+
+    V_next and x_next are the results for the first block of the next segment
+    or None for the last segment.  They are included as the last blocks of
+    the results.
+    """
+    M = np.shape(U)[-3]
+    K = np.shape(C)[-3]
+    invU = chol_inv(U)
+    z = chol_solve(U, x)
+    if V_next is None:
+        V = np.empty(np.shape(U))
+        x = np.empty(np.shape(z))
+        V[...,-1,:,:] = invU[...,-1,:,:]
+        x[...,-1,:] = z[...,-1,:]
+    else:
+        plates_V = misc.broadcasted_shape(np.shape(U)[:-3],
+                                          np.shape(V_next)[:-2])
+        plates_x = misc.broadcasted_shape(np.shape(z)[:-2],
+                                          np.shape(x_next)[:-1])
+        V = np.empty(plates_V+(M+1,)+np.shape(U)[-2:])
+        x = np.empty(plates_x+(M+1,)+np.shape(z)[-1:])
+        V[...,-1,:,:] = V_next
+        x[...,-1,:] = x_next
+    Cov = np.empty(np.shape(V)[:-3]+(K,)+np.shape(V)[-2:])
+    for n in reversed(range(K)):
+        # Compute the diagonal and superdiagonal blocks of the inverse
+        V[...,n,:,:] = (invU[...,n,:,:]
+                        + mmdot(C[...,n,:,:],
+                                mmdot(V[...,n+1,:,:],
+                                      misc.T(C[...,n,:,:]))))
+        # Ensure symmetry by 0.5*(V+V.T)
+        V[...,n,:,:] = 0.5 * (V[...,n,:,:] + misc.T(V[...,n,:,:]))
+        Cov[...,n,:,:] = -mmdot(C[...,n,:,:], V[...,n+1,:,:])
+        # Backward substitution: x[n] = V[n]^-1 * (x[n] - B[n] * x[n+1])
+        x[...,n,:] = z[...,n,:] - mvdot(C[...,n,:,:], x[...,n+1,:])
+    return (V, Cov, x)
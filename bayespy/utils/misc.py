@@ -536,6 +536,121 @@ def sum_multiply_to_plates(*arrays, to_plates=(), from_plates=None, ndim=0):
     return r * y
 
 
+class SparseCounts():
+    """
+    Sparse representation of counts of categories.
+
+    The counts form an array whose last axis has length D and only a few
+    non-zero elements (e.g., one-hot vectors of categorical observations or
+    word counts of documents).  Only the indices and the values of the
+    non-zero counts are stored:
+
+    Shape(indices) = [Nn,..,N0,M]
+    Shape(counts)  = [Nn,..,N0,M]
+    Shape(self)    = [Nn,..,N0,D]
+
+    Unused elements have zero counts.  NumPy functions convert the counts
+    into a dense array.
+    """
+
+    def __init__(self, indices, counts, D):
+        self.indices = np.asarray(indices)
+        self.counts = np.asarray(counts)
+        self.D = D
+        self.shape = np.shape(self.counts)[:-1] + (D,)
+        self.ndim = len(self.shape)
+
+    @classmethod
+    def from_indices(cls, x, D):
+        """
+        Represent category indices as one-hot vectors.
+        """
+        x = np.asarray(x)
+        return cls(x[...,np.newaxis], np.ones(np.shape(x) + (1,)), D)
+
+    @classmethod
+    def from_matrix(cls, X):
+        """
+        Convert a scipy.sparse matrix of counts.
+
+        The rows are the plates and the columns are the categories.
+        """
+        X = sparse.csr_matrix(X)
+        (N, D) = X.shape
+        lengths = np.diff(X.indptr)
+        M = max(np.amax(lengths, initial=0), 1)
+        # The position of each non-zero element within its row
+        rows = np.repeat(np.arange(N), lengths)
+        cols = np.arange(X.nnz) - np.repeat(X.indptr[:-1], lengths)
+        indices = np.zeros((N, M), dtype=int)
+        counts = np.zeros((N, M), dtype=X.data.dtype)
+        indices[rows,cols] = X.indices
+        counts[rows,cols] = X.data
+        return cls(indices, counts, D)
+
+    def dense(self):
+        """
+        Return the counts as a dense array.
+        """
+        N = int(np.prod(self.shape[:-1]))
+        indices = np.reshape(self.indices, (N, -1))
+        rows = np.arange(N)[:,np.newaxis] * self.D
+        x = np.bincount(np.ravel(rows + indices),
+                        weights=np.ravel(self.counts),
+                        minlength=N*self.D)
+        return np.reshape(x, self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        x = self.dense()
+        if dtype is not None:
+            x = x.astype(dtype)
+        return x
+
+    def copy(self):
+        return SparseCounts(self.indices.copy(), self.counts.copy(), self.D)
+
+    def sum_product(self, x):
+        """
+        Compute np.sum(x*self, axis=-1) by gathering the elements of x.
+        """
+        x = atleast_nd(x, self.ndim)
+        y = np.take_along_axis(x, self.indices, axis=-1)
+        return np.sum(y * self.counts, axis=-1)
+
+    def sum_to_plates(self, mask, to_shape, from_shape):
+        """
+        Sum the masked counts to the target shape by scatter-adding.
+
+        The mask has a unit last axis.  The result equals
+        sum_multiply_to_plates(self, mask, to_plates=to_shape,
+        from_plates=from_shape).
+        """
+        counts = self.counts * mask
+        plates = np.shape(counts)[:-1]
+        indices = np.broadcast_to(self.indices, np.shape(counts))
+        to_plates = tuple(to_shape[:-1])
+        if len(to_plates) > len(plates):
+            raise ValueError("Target shape has more plate axes")
+        # Flat index of the target element of each count
+        index = indices.copy()
+        stride = self.D
+        padded = (len(plates)-len(to_plates))*(1,) + to_plates
+        for (axis, n) in reversed(list(enumerate(padded))):
+            if n > 1:
+                shape = [1] * np.ndim(index)
+                shape[axis] = n
+                index = index + stride * np.reshape(np.arange(n), shape)
+                stride *= n
+        counts = np.broadcast_to(counts, np.shape(index))
+        y = np.bincount(np.ravel(index),
+                        weights=np.ravel(counts),
+                        minlength=stride)
+        y = np.reshape(y, to_shape)
+        return broadcasting_multiplier(from_shape,
+                                       plates + (self.D,),
+                                       to_shape) * y
+
+
 def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
 
     # Computes sum(arg[0]*arg[1]*arg[2]*..., axis=axes_to_sum) without
@@ -27,11 +27,46 @@ General functions random sampling and distributions.
 
 import numpy as np
 from scipy import special
+from scipy import sparse
 
 from . import linalg
 from . import misc
 
 
+# The random number generator shared by the sampling functions and the random
+# methods of the nodes.  If None, the global NumPy random state is used.
+_generator = None
+
+
+def set_generator(generator=None):
+    r"""
+    Set the random number generator used for random sampling.
+
+    Parameters
+    ----------
+    generator : numpy.random.Generator, int or None
+        The generator, a seed for a new generator or None to use the global
+        NumPy random state.
+    """
+    global _generator
+    if generator is not None and not isinstance(generator,
+                                                np.random.Generator):
+        generator = np.random.default_rng(generator)
+    _generator = generator
+
+
+def get_generator():
+    r"""
+    Return the random number generator used for random sampling.
+
+    If no generator has been set, returns the global NumPy random state, thus
+    `numpy.random.seed` can be used to make the samples reproducible.
+    """
+    if _generator is None:
+        return np.random
+    return _generator
+
+
 def intervals(N, length, amount=1, gap=0):
     r"""
     Return random non-overlapping parts of a sequence.
@@ -51,7 +86,7 @@ def intervals(N, length, amount=1, gap=0):
 
     # In practice, we draw the sizes of the gaps between the sequences
     total_gap = N - length*amount - gap*(amount-1)
-    gaps = np.random.multinomial(total_gap, np.ones(amount+1)/(amount+1))
+    gaps = get_generator().multinomial(total_gap, np.ones(amount+1)/(amount+1))
 
     # And then we get the beginning index of each sequence
     intervals = np.cumsum(gaps[:-1]) + np.arange(amount)*(length+gap)
@@ -69,7 +104,7 @@ def mask(*shape, p=0.5):
     p : value in range [0,1]
         A probability that the elements are `True`.
     """
-    return np.random.rand(*shape) < p
+    return get_generator().random(shape) < p
 
 def wishart(nu, V):
     r"""
@@ -84,7 +119,7 @@ def wishart(nu, V):
     if nu < D:
         raise ValueError("Degrees of freedom must be equal or greater than the "
                          "dimensionality of the matrix.")
-    X = np.random.multivariate_normal(np.zeros(D), V, size=nu)
+    X = get_generator().multivariate_normal(np.zeros(D), V, size=nu)
     return np.dot(X, X.T)
 
 wishart_rand = wishart
@@ -124,7 +159,7 @@ def covariance(D, size=(), nu=None):
     except TypeError:
         size = (size,)
     shape = size + (D,nu)
-    C = np.random.randn(*shape)
+    C = get_generator().standard_normal(shape)
     C = linalg.dot(C, np.swapaxes(C, -1, -2)) / nu
     return linalg.inv(C)
 #return np.linalg.inv(np.dot(C, C.T))
@@ -133,7 +168,7 @@ def correlation(D):
     r"""
     Draw a random correlation matrix.
     """
-    X = np.random.randn(D,D);
+    X = get_generator().standard_normal((D,D))
     s = np.sqrt(np.sum(X**2, axis=-1, keepdims=True))
     X = X / s
     return np.dot(X, X.T)
@@ -225,7 +260,7 @@ def orth(D):
     r"""
     Draw random orthogonal matrix.
     """
-    Q = np.random.randn(D,D)
+    Q = get_generator().standard_normal((D,D))
     (Q, _) = np.linalg.qr(Q)
     return Q
 
@@ -244,8 +279,9 @@ def sphere(N=1):
 
     Returns (latitude,longitude) in degrees.
     """
-    lon = np.random.uniform(-180, 180, N)
-    lat = (np.arccos(np.random.uniform(-1, 1, N)) * 180 / np.pi) - 90
+    rng = get_generator()
+    lon = rng.uniform(-180, 180, N)
+    lat = (np.arccos(rng.uniform(-1, 1, N)) * 180 / np.pi) - 90
     return (lat, lon)
 
 
@@ -257,12 +293,15 @@ def bernoulli(p, size=None):
         size = (size,)
     if size is None:
         size = np.shape(p)
-    return (np.random.rand(*size) < p)
+    return (get_generator().random(size) < p)
 
 
 def categorical(p, size=None):
     r"""
     Draw random samples from a categorical distribution.
+
+    The samples are drawn for all distributions at once by inverse CDF, thus
+    the probabilities are not broadcasted to the size of the output.
     """
     if size is None:
         size = np.shape(p)[:-1]
@@ -276,46 +315,32 @@ def categorical(p, size=None):
         raise ValueError("Probability array shape and requested size are "
                          "inconsistent")
 
-    size = tuple(size)
-
-    # Normalize probabilities
-    p = p / np.sum(p, axis=-1, keepdims=True)
-
-    # Compute cumulative probabilities (p_1, p_1+p_2, ..., p_1+...+p_N):
-    P = np.cumsum(p, axis=-1)
-
-    # Draw samples from interval [0,1]
-    x = np.random.rand(*size)
-
-    # For simplicity, repeat p to the size of the output (plus probability axis)
-    K = np.shape(p)[-1]
-    P = P * np.ones(tuple(size)+(K,))
+    # Draw samples from interval [0,1)
+    x = get_generator().random(tuple(size))
 
-    if size == ():
-        z = np.searchsorted(P, x)
-    else:
-        # Seach the indices
-        z = np.zeros(size)
-        inds = misc.nested_iterator(size)
-        for ind in inds:
-            z[ind] = np.searchsorted(P[ind], x[ind])
-
-    return z.astype(np.int)
+    return _categorical(np.asanyarray(p), x)
 
 
 def dirichlet(alpha, size=None):
     r"""
     Draw random samples from the Dirichlet distribution.
+
+    The gamma variates are drawn in the log domain using
+    :math:`\log G_{\alpha} = \log G_{\alpha+1} + \log(U)/\alpha`, thus the
+    samples do not underflow to zero for small concentration parameters.
     """
     if isinstance(size, int):
         size = (size,)
     if size is None:
         size = np.shape(alpha)
     else:
-        size = size + np.shape(alpha)[-1:]
-    p = np.random.gamma(alpha, size=size)
-    p /= np.sum(p, axis=-1, keepdims=True)
-    return p
+        size = tuple(size) + np.shape(alpha)[-1:]
+    alpha = np.asanyarray(alpha, dtype=float)
+    rng = get_generator()
+    with np.errstate(divide='ignore'):
+        logp = (np.log(rng.standard_gamma(alpha + 1, size=size))
+                + np.log(1 - rng.random(size)) / alpha)
+    return _normalize_exp(logp)
 
 
 def logodds_to_probability(x):
@@ -335,6 +360,15 @@ def alpha_beta_recursion(logp0, logP):
 
     logp0 = log P(z_0) + log P(y_0|z_0)
     logP[...,n,:,:] = log P(z_{n+1}|z_n) + log P(y_{n+1}|z_{n+1})
+
+    The recursions are computed with normalized probabilities in the linear
+    domain, thus each step requires only a matrix-vector product.  The rows
+    (forward recursion) or the columns (backward recursion) of the transition
+    matrices are scaled to have maximum one and the scales are applied to the
+    probability vectors.  Probabilities which underflow are negligible unless
+    the normalization of some step or pairwise posterior is tiny.  In that
+    case, the recursion is recomputed so that the steps in which a possible
+    state underflows are computed in the log domain.
     """
 
     logp0 = misc.atleast_nd(logp0, 1)
@@ -349,48 +383,1072 @@ def alpha_beta_recursion(logp0, logP):
                          % (np.shape(logP)[-2:],
                             (D,D)))
 
-    #
-    # Run the recursion algorithm
-    #
-
-    # Allocate memory
-    logalpha = np.zeros(plates+(N,D))
-    logbeta = np.zeros(plates+(N,D))
-    g = np.zeros(plates)
-
-    # Forward recursion
-    logalpha[...,0,:] = logp0
-    for n in range(1,N):
-        # Compute: P(z_{n-1},z_n|x_1,...,x_n)
-        v = logalpha[...,n-1,:,None] + logP[...,n-1,:,:]
-        c = misc.logsumexp(v, axis=(-1,-2))
-        # Sum over z_{n-1} to get: log P(z_n|x_1,...,x_n)
-        logalpha[...,n,:] = misc.logsumexp(v - c[...,None,None], axis=-2)
-        g -= c
-
-    # Compute the normalization of the last term
-    v = logalpha[...,N-1,:,None] + logP[...,N-1,:,:]
-    g -= misc.logsumexp(v, axis=(-1,-2))
-
-    # Backward recursion 
-    logbeta[...,N-1,:] = 0
+    T = _TimeVaryingTransitions(_flatten_plates(logP, plates, 3))
+    (z0, zz, _, g) = _alpha_beta(_flatten_plates(logp0, plates, 1,
+                                                 broadcast=True),
+                                 T)
+
+    return (np.reshape(z0, plates+(D,)),
+            np.reshape(zz, plates+(N,D,D)),
+            np.reshape(g, plates))
+
+
+def alpha_beta_recursion_homogeneous(logp0, logP, logp, transitions=None):
+    r"""
+    Compute alpha-beta recursion for Markov chain with time-homogeneous
+    transitions
+
+    The transition log-probabilities are given as a time-independent matrix
+    and time-dependent state log-probabilities, thus the transition matrices of
+    each time instance are never formed explicitly:
+
+    logp0 = log P(z_0) + log P(y_0|z_0)
+    logP[...,:,:] = log P(z_{n+1}|z_n)
+    logp[...,n,:] = log P(y_{n+1}|z_{n+1})
+
+    If `transitions` is given, it is a boolean (K,K) array of the allowed
+    transitions and logP[...,k] contains the log-probabilities of the allowed
+    transitions in the order of ``np.nonzero(transitions)``.  Then, the
+    recursion uses sparse matrices, thus the cost of each step is linear in
+    the number of allowed transitions.
+
+    Returns the posterior probabilities of the initial state, the pairwise
+    posterior probabilities summed over time (only for the allowed transitions
+    if `transitions` is given), the posterior probabilities of the other states
+    and the cumulant generating function.  See :func:`alpha_beta_recursion`
+    for the details of the algorithm.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logp = misc.atleast_nd(logp, 2)
+    logP = misc.atleast_nd(logP, 1 if transitions is not None else 2)
+
+    D = np.shape(logp0)[-1]
+    N = np.shape(logp)[-2]
+    ndim_P = _check_homogeneous(D, logP, logp, transitions)
+
+    plates = misc.broadcasted_shape(np.shape(logp0)[:-1],
+                                    np.shape(logP)[:-ndim_P],
+                                    np.shape(logp)[:-2])
+
+    (logp0, T) = _homogeneous_transitions(logp0, logP, logp, transitions,
+                                          plates)
+    (z0, zz, z, g) = _alpha_beta(logp0, T)
+
+    return (np.reshape(z0, plates+(D,)),
+            np.reshape(zz, plates+np.shape(zz)[1:]),
+            np.reshape(z, plates+(N,D)),
+            np.reshape(g, plates))
+
+
+def _check_homogeneous(D, logP, logp, transitions):
+    """
+    Check the dimensions of time-homogeneous transitions.
+
+    Returns the number of the dimensions of the transition log-probabilities.
+    """
+    if transitions is None:
+        if np.shape(logP)[-2:] != (D,D):
+            raise ValueError("Dimension mismatch %s != %s"
+                             % (np.shape(logP)[-2:],
+                                (D,D)))
+        ndim_P = 2
+    else:
+        if np.shape(transitions) != (D,D):
+            raise ValueError("Dimension mismatch %s != %s"
+                             % (np.shape(transitions),
+                                (D,D)))
+        if np.shape(logP)[-1] != np.count_nonzero(transitions):
+            raise ValueError("The number of transition probabilities does "
+                             "not match the number of allowed transitions")
+        ndim_P = 1
+    if np.shape(logp)[-1] != D:
+        raise ValueError("Dimension mismatch %s != %s"
+                         % (np.shape(logp)[-1:],
+                            (D,)))
+    return ndim_P
+
+
+def _homogeneous_transitions(logp0, logP, logp, transitions, plates):
+    """
+    Flatten the plates and construct time-homogeneous transitions.
+    """
+    logp0 = _flatten_plates(logp0, plates, 1, broadcast=True)
+    logp = _flatten_plates(logp, plates, 2, broadcast=True)
+    if transitions is None:
+        T = _HomogeneousTransitions(_flatten_plates(logP, plates, 2), logp)
+    else:
+        T = _SparseHomogeneousTransitions(_flatten_plates(logP, plates, 1),
+                                          logp,
+                                          transitions)
+    return (logp0, T)
+
+
+def _alpha_beta(logp0, T):
+    """
+    Compute alpha-beta recursion for the transitions T.
+
+    The plates have been flattened to the first axis.  First, the recursion
+    is computed in the linear domain.  If the normalizations of the steps and
+    pairwise posteriors are so small that the underflowed probabilities might
+    not be negligible, the recursion is recomputed such that the steps in
+    which a possible state underflows are computed in the log domain.
+    """
+    D = np.shape(logp0)[-1]
+    N = T.N
+    strict = False
+    while True:
+        try:
+            (alpha, logalpha, g, c_alpha) = _forward(logp0, T, strict)
+            (beta, logbeta, c_beta) = _backward(np.shape(logp0), T, strict)
+        except _Underflow:
+            strict = True
+            continue
+        alpha = alpha[:,:N,:]
+        (z0, zz, z, s) = T.pairwise(alpha, beta)
+        if strict or _underflow_error(c_alpha[:,:N], c_beta, s, D) <= _EPS:
+            break
+        strict = True
+
+    # Use the log domain if the scaled probabilities are very small
+    underflow = ~(s >= _SMALL)
+    if np.any(underflow):
+        with np.errstate(divide='ignore'):
+            la = np.log(alpha)
+            lb = np.log(beta)
+        for (n, loga) in logalpha.items():
+            if n < N:
+                la[:,n,:] = loga
+        for (n, logb) in logbeta.items():
+            lb[:,n,:] = logb
+        # Process in chunks in order to bound the memory usage
+        inds = np.nonzero(underflow)
+        step = max(1, 2**20 // D**2)
+        for start in range(0, len(inds[0]), step):
+            ind = tuple(i[start:(start+step)] for i in inds)
+            (zz_u, z_u, z0_u) = T.log_pairwise(la[ind], lb[ind], ind)
+            first = (ind[1] == 0)
+            z0[ind[0][first]] = z0_u[first]
+            T.set_pairs(zz, z, ind, zz_u, z_u)
+
+    return (z0, zz, z, g)
+
+
+def forward_filtering_backward_sampling(logp0, logP, size=None):
+    r"""
+    Draw random samples from a Markov chain by forward filtering and backward
+    sampling
+
+    The log-probabilities are interpreted as in :func:`alpha_beta_recursion`,
+    thus the function can be used to draw samples from the posterior
+    distribution.  The plates of the samples are given by `size` and the
+    plates of the log-probabilities broadcasted together.
+
+    The forward recursion is the same as in :func:`alpha_beta_recursion`.
+    Then, the last state is drawn from the filtering distribution and the
+    previous states are drawn backwards in time given the next state.  All
+    plates are sampled at once.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logP = misc.atleast_nd(logP, 3)
+    
+    D = np.shape(logp0)[-1]
+    N = np.shape(logP)[-3]
+    plates = misc.broadcasted_shape(_size(size),
+                                    np.shape(logp0)[:-1],
+                                    np.shape(logP)[:-3])
+
+    if np.shape(logP)[-2:] != (D,D):
+        raise ValueError("Dimension mismatch %s != %s"
+                         % (np.shape(logP)[-2:],
+                            (D,D)))
+
+    T = _TimeVaryingTransitions(_flatten_plates(logP, plates, 3))
+    z = _ffbs(_flatten_plates(logp0, plates, 1, broadcast=True), T)
+
+    return np.reshape(z, plates+(N+1,))
+
+
+def forward_filtering_backward_sampling_homogeneous(logp0, logP, logp,
+                                                    transitions=None,
+                                                    size=None):
+    r"""
+    Draw random samples from a Markov chain with time-homogeneous transitions
+    by forward filtering and backward sampling
+
+    The log-probabilities and the allowed `transitions` are given as in
+    :func:`alpha_beta_recursion_homogeneous`.  See
+    :func:`forward_filtering_backward_sampling` for the details.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logp = misc.atleast_nd(logp, 2)
+    logP = misc.atleast_nd(logP, 1 if transitions is not None else 2)
+
+    D = np.shape(logp0)[-1]
+    N = np.shape(logp)[-2]
+    ndim_P = _check_homogeneous(D, logP, logp, transitions)
+
+    plates = misc.broadcasted_shape(_size(size),
+                                    np.shape(logp0)[:-1],
+                                    np.shape(logP)[:-ndim_P],
+                                    np.shape(logp)[:-2])
+
+    (logp0, T) = _homogeneous_transitions(logp0, logP, logp, transitions,
+                                          plates)
+    z = _ffbs(logp0, T)
+
+    return np.reshape(z, plates+(N+1,))
+
+
+def _ffbs(logp0, T):
+    """
+    Draw samples by forward filtering and backward sampling.
+
+    The forward recursion is recomputed in the strict mode if the
+    probabilities lost because of underflow might not be negligible.
+    """
+    (B, D) = np.shape(logp0)
+    N = T.N
+    strict = False
+    while True:
+        try:
+            (alpha, logalpha, _, c) = _forward(logp0, T, strict)
+        except _Underflow:
+            strict = True
+            continue
+        # The probabilities lost in a step are small relative to the
+        # normalization of the step (see _underflow_error)
+        with np.errstate(divide='ignore', over='ignore'):
+            err = np.amax(np.sum(D**2 * _TINY / c, axis=-1))
+        if strict or err <= _EPS:
+            break
+        strict = True
+
+    # Draw the states backwards in time: P(z_n|z_{n+1},x_0,...,x_{n+1}) is
+    # proportional to alpha_n(z_n) * P(z_{n+1}|z_n).  Use the log domain if
+    # the weights are too small in the linear domain.
+    x = get_generator().random((B, N+1))
+    z = np.empty((B,N+1), dtype=int)
+    z[:,N] = _categorical(alpha[:,N,:], x[:,N])
+    for n in reversed(range(N)):
+        w = alpha[:,n,:] * T.column(n, z[:,n+1])
+        if n in logalpha or not np.all(np.sum(w, axis=-1) >= _SMALL):
+            w = _normalize_exp(_get_log(alpha, logalpha, n)
+                               + T.log_column(n, z[:,n+1]))
+        z[:,n] = _categorical(w, x[:,n])
+
+    return z
+
+
+def viterbi(logp0, logP, consume=None, segment_length=None):
+    r"""
+    Find the most probable state sequence of a Markov chain
+
+    The log-probabilities are interpreted as in :func:`alpha_beta_recursion`.
+    The Viterbi algorithm is computed in the log domain for all plates at
+    once.
+
+    Returns the most probable states (with shape (...,N+1)) and their
+    unnormalized log-probability (i.e., the sum of the corresponding
+    log-probabilities).
+
+    If `consume` is given, the states are not returned (None is returned
+    instead).  Then, the forward recursion stores only the maximum
+    log-probabilities at the beginning of each segment of `segment_length`
+    (default: sqrt(N)) time instances, and the back-pointers are recomputed
+    for one segment at a time.  consume(start, z) is called for each segment
+    from the last to the first one with the states z[...,start:stop].  Thus,
+    the back-pointers use O(sqrt(N)) memory instead of O(N) at the cost of
+    computing the forward recursion twice.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logP = misc.atleast_nd(logP, 3)
+    
+    D = np.shape(logp0)[-1]
+    plates = misc.broadcasted_shape(np.shape(logp0)[:-1],
+                                    np.shape(logP)[:-3])
+
+    if np.shape(logP)[-2:] != (D,D):
+        raise ValueError("Dimension mismatch %s != %s"
+                         % (np.shape(logP)[-2:],
+                            (D,D)))
+
+    T = _TimeVaryingTransitions(_flatten_plates(logP, plates, 3))
+    return _viterbi(_flatten_plates(logp0, plates, 1, broadcast=True),
+                    T,
+                    plates,
+                    consume,
+                    segment_length)
+
+
+def viterbi_homogeneous(logp0, logP, logp, transitions=None, consume=None,
+                        segment_length=None):
+    r"""
+    Find the most probable state sequence of a Markov chain with
+    time-homogeneous transitions
+
+    The log-probabilities and the allowed `transitions` are given as in
+    :func:`alpha_beta_recursion_homogeneous`.  With sparse transitions, the
+    cost of each step is linear in the number of allowed transitions.  See
+    :func:`viterbi` for the details.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logp = misc.atleast_nd(logp, 2)
+    logP = misc.atleast_nd(logP, 1 if transitions is not None else 2)
+
+    D = np.shape(logp0)[-1]
+    ndim_P = _check_homogeneous(D, logP, logp, transitions)
+
+    plates = misc.broadcasted_shape(np.shape(logp0)[:-1],
+                                    np.shape(logP)[:-ndim_P],
+                                    np.shape(logp)[:-2])
+
+    (logp0, T) = _homogeneous_transitions(logp0, logP, logp, transitions,
+                                          plates)
+    return _viterbi(logp0, T, plates, consume, segment_length)
+
+
+def _viterbi(logp0, T, plates, consume, segment_length):
+    """
+    Compute the Viterbi algorithm in segments for the transitions T.
+    """
+    N = T.N
+    if consume is None:
+        segment_length = N
+        z = np.empty(plates+(N+1,), dtype=int)
+        def consume(start, z_segment):
+            z[...,start:(start+np.shape(z_segment)[-1])] = z_segment
+    else:
+        z = None
+    if segment_length is None:
+        segment_length = int(np.ceil(np.sqrt(N)))
+    L = max(1, int(segment_length))
+    starts = list(range(0, N, L))
+
+    def forward_segment(start, delta):
+        stop = min(start + L, N)
+        bp = np.empty((np.shape(delta)[0], stop-start, np.shape(delta)[-1]),
+                      dtype=int)
+        for n in range(start, stop):
+            (delta, bp[:,n-start,:]) = T.max_forward(delta, n)
+        return (delta, bp)
+
+    # Forward recursion, store the maximum log-probabilities only at the
+    # beginning of each segment
+    checkpoints = []
+    delta = logp0
+    for start in starts:
+        checkpoints.append(delta)
+        (delta, _) = forward_segment(start, delta)
+
+    # Backtrack the states segment by segment
+    ind = np.arange(np.shape(delta)[0])
+    state = np.argmax(delta, axis=-1)
+    logp_max = delta[ind,state]
+    for (i, start) in reversed(list(enumerate(starts))):
+        (_, bp) = forward_segment(start, checkpoints[i])
+        M = np.shape(bp)[1]
+        last = (i == len(starts) - 1)
+        z_segment = np.empty((len(ind), M+last), dtype=int)
+        if last:
+            z_segment[:,M] = state
+        for m in reversed(range(M)):
+            state = bp[ind,m,state]
+            z_segment[:,m] = state
+        consume(start, np.reshape(z_segment, plates+(-1,)))
+    if N == 0:
+        consume(0, np.reshape(state, plates+(1,)))
+
+    return (z, np.reshape(logp_max, plates))
+
+
+def _forward(logp0, T, strict):
+    """
+    Compute the forward recursion for the transitions T.
+
+    Returns the normalized probabilities of each time instance in the linear
+    domain, the log-probabilities of the steps computed in the log domain,
+    the cumulant generating function and the normalizations of the steps
+    computed in the linear domain.
+    """
+    (B, D) = np.shape(logp0)
+    N = T.N
+
+    # Allocate memory.  The log-probabilities are stored only for the time
+    # instances which have possible states with underflowing probabilities.
+    alpha = np.empty((B,N+1,D))
+    logalpha = {}
+    logc = np.empty((B,N))
+    c_alpha = np.ones((B,N+1))
+
+    alpha[:,0,:] = _store_log(logalpha,
+                              0,
+                              logp0 - misc.logsumexp(logp0,
+                                                     axis=-1,
+                                                     keepdims=True))
+    g = -misc.logsumexp(logp0, axis=-1)
+    for n in range(N):
+        # Compute: P(z_{n-1},z_n|x_1,...,x_n) summed over z_{n-1}
+        (a, logm) = T.forward(alpha[:,n,:], n)
+        c = a.sum(axis=-1)
+        a = _normalize_linear(a, c, logalpha, n,
+                              lambda: T.reachable_forward(alpha[:,n,:], n),
+                              strict)
+        if a is None:
+            (logc[:,n], loga) = T.log_forward(_get_log(alpha, logalpha, n),
+                                              n)
+            a = _store_log(logalpha, n+1, loga)
+        else:
+            logc[:,n] = np.log(c) + logm
+            c_alpha[:,n+1] = c
+        alpha[:,n+1,:] = a
+    g -= np.sum(logc, axis=-1)
+
+    return (alpha, logalpha, g, c_alpha)
+
+
+def _backward(shape, T, strict):
+    """
+    Compute the backward recursion for the transitions T.
+
+    Returns the normalized probabilities in the linear domain, the
+    log-probabilities of the steps computed in the log domain and the
+    normalizations of the steps computed in the linear domain.
+    """
+    (B, D) = shape
+    N = T.N
+
+    beta = np.empty((B,N,D))
+    logbeta = {}
+    c_beta = np.ones((B,N))
+
+    beta[:,N-1,:] = 1/D
     for n in reversed(range(N-1)):
-        v = logbeta[...,n+1,None,:] + logP[...,n+1,:,:]
-        c = misc.logsumexp(v, axis=(-1,-2))
-        logbeta[...,n,:] = misc.logsumexp(v - c[...,None,None], axis=-1)
+        b = T.backward(beta[:,n+1,:], n+1)
+        c_beta[:,n] = b.sum(axis=-1)
+        b = _normalize_linear(b, c_beta[:,n], logbeta, n+1,
+                              lambda: T.reachable_backward(beta[:,n+1,:], n+1),
+                              strict)
+        if b is None:
+            b = _store_log(logbeta,
+                           n,
+                           T.log_backward(_get_log(beta, logbeta, n+1), n+1))
+        beta[:,n,:] = b
+
+    return (beta, logbeta, c_beta)
+
+
+def _underflow_error(c_alpha, c_beta, s, D):
+    """
+    Upper bound for the relative error caused by underflow in the linear
+    domain.
+
+    Each term which underflows is less than the smallest normal number,
+    because the scaled transition matrices and state probabilities are at
+    most one.  Thus, the probabilities lost in a step are small relative to
+    the normalization c of the step, and their contribution to the pairwise
+    posterior is small relative to its normalization s.
+    """
+    with np.errstate(divide='ignore', over='ignore'):
+        err = D**2 * _TINY * (1/c_alpha + 1/c_beta) / s
+    return np.amax(np.sum(err, axis=-1))
+
+
+class _Underflow(Exception):
+    """
+    Raised if the probabilities underflow in the linear domain.
+    """
+    pass
+
+
+class _Transitions():
+    """
+    Base class for the transitions of alpha-beta recursion.
+
+    The plates are flattened to the first axis.  The sub-classes implement
+    the steps in the linear domain and give the transition log-probabilities
+    for the steps in the log domain.
+    """
 
-    v = logalpha[...,:,:,None] + logbeta[...,:,None,:] + logP[...,:,:,:]
-    c = misc.logsumexp(v, axis=(-1,-2))
-    zz = np.exp(v - c[...,None,None])
 
-    # The logsumexp normalization is not numerically accurate, so do
-    # normalization again:
-    zz /= np.sum(zz, axis=(-1,-2), keepdims=True)
+    def log_step(self, n):
+        """
+        Return the transition log-probabilities from time instance n.
+        """
+        raise NotImplementedError()
 
-    z0 = np.sum(zz[...,0,:,:], axis=-1)
-    z0 /= np.sum(z0, axis=-1, keepdims=True)
 
-    return (z0, zz, g)
+    def log_pairs(self, ind):
+        """
+        Return the transition log-probabilities of the given time instances.
+        """
+        raise NotImplementedError()
+
+
+    def column(self, n, j):
+        """
+        Return the scaled probabilities of the transitions from time instance
+        n to the states j (up to a constant).
+        """
+        raise NotImplementedError()
+
+
+    def log_column(self, n, j):
+        """
+        Return the log-probabilities of the transitions from time instance n
+        to the states j (up to a constant).
+        """
+        logP = self.log_step(n)
+        return logP[_plate_index(logP, np.arange(len(j))),:,j]
+
+
+    def max_forward(self, delta, n):
+        """
+        Compute a step of the Viterbi algorithm.
+
+        Returns the maximum log-probabilities of the next states and the
+        corresponding previous states.
+        """
+        v = delta[...,:,None] + self.log_step(n)
+        bp = np.argmax(v, axis=-2)
+        return (np.take_along_axis(v, bp[...,None,:], axis=-2)[...,0,:], bp)
+
+
+    def log_forward(self, logalpha, n):
+        """
+        Compute a forward step in the log domain.
+
+        Returns the log-normalization and the normalized log-probabilities.
+        """
+        v = logalpha[...,:,None] + self.log_step(n)
+        logc = misc.logsumexp(v, axis=(-1,-2))
+        return (logc,
+                misc.logsumexp(v - logc[...,None,None], axis=-2))
+
+
+    def log_backward(self, logbeta, n):
+        """
+        Compute a backward step in the log domain.
+
+        Returns the normalized log-probabilities.
+        """
+        v = misc.logsumexp(logbeta[...,None,:] + self.log_step(n), axis=-1)
+        return v - misc.logsumexp(v, axis=-1, keepdims=True)
+
+
+    def reachable_forward(self, alpha, n):
+        """
+        Find the states which are possible after a forward step.
+        """
+        return np.matmul((alpha > 0).astype(np.float64)[...,None,:],
+                         np.isfinite(self.log_step(n)))[...,0,:] > 0
+
+
+    def reachable_backward(self, beta, n):
+        """
+        Find the states which are possible after a backward step.
+        """
+        return np.matmul(np.isfinite(self.log_step(n)),
+                         (beta > 0).astype(np.float64)[...,:,None])[...,0] > 0
+
+
+    def log_pairwise(self, logalpha, logbeta, ind):
+        """
+        Compute the pairwise posterior probabilities in the log domain.
+
+        Returns the pairwise probabilities and the marginal probabilities of
+        the second and the first state.
+        """
+        v = (logalpha[...,:,None]
+             + self.log_pairs(ind)
+             + logbeta[...,None,:])
+        zz = _normalize_exp(v, axis=(-1,-2))
+        return (zz, np.sum(zz, axis=-2), np.sum(zz, axis=-1))
+
+
+class _TimeVaryingTransitions(_Transitions):
+    """
+    Scaled transition matrices of each time instance for alpha-beta
+    recursion.
+    """
+
+
+    def __init__(self, logP):
+        self.N = np.shape(logP)[-3]
+        self.logP = logP
+        # Scaled transition matrices and the scales of the rows and the
+        # columns relative to the maximum
+        (self.P_row, logr_row, self.logm) = _scale_transitions(logP, axis=-1)
+        (self.P_col, logr_col, _) = _scale_transitions(logP, axis=-2)
+        self.r_row = np.exp(logr_row)
+        self.r_col = np.exp(logr_col)
+
+
+    def forward(self, alpha, n):
+        """
+        Compute the unnormalized probabilities of the next state and the log
+        of their scale.
+        """
+        a = np.matmul((alpha * self.r_row[:,n,:])[:,None,:],
+                      self.P_row[:,n,:,:])[:,0,:]
+        return (a, self.logm[:,n])
+
+
+    def backward(self, beta, n):
+        """
+        Compute the unnormalized probabilities of the previous step of the
+        backward recursion.
+        """
+        return np.matmul(self.P_col[:,n,:,:],
+                         (beta * self.r_col[:,n,:])[...,None])[...,0]
+
+
+    def log_step(self, n):
+        return self.logP[:,n,:,:]
+
+
+    def column(self, n, j):
+        return self.P_col[_plate_index(self.P_col, np.arange(len(j))),n,:,j]
+
+
+    def log_pairs(self, ind):
+        return self.logP[_plate_index(self.logP, ind[0]), ind[1]]
+
+
+    def pairwise(self, alpha, beta):
+        """
+        Compute the posterior probabilities from alpha and beta.
+
+        Returns the initial state probabilities, the pairwise probabilities,
+        the state probabilities (None) and the normalizations of the pairwise
+        probabilities.
+        """
+        zz = ((alpha * self.r_row)[...,:,None]
+              * self.P_row
+              * beta[...,None,:])
+        s = np.sum(zz, axis=(-1,-2))
+        zz /= np.where(s >= _SMALL, s, 1)[...,None,None]
+        z0 = np.sum(zz[:,0,:,:], axis=-1)
+        return (z0, zz, None, s)
+
+
+    def set_pairs(self, zz, z, ind, zz_ind, z_ind):
+        """
+        Set the pairwise probabilities of the given time instances.
+        """
+        zz[ind] = zz_ind
+
+
+class _HomogeneousTransitions(_Transitions):
+    """
+    Scaled time-independent transition matrix and state probabilities for
+    alpha-beta recursion.
+    """
+
+
+    def __init__(self, logP, logp):
+        self.N = np.shape(logp)[-2]
+        self.D = np.shape(logp)[-1]
+        self.logP = logP
+        self.logp = logp
+        self._init_transitions(logP)
+        # Scale the state probabilities to maximum one
+        logs = np.amax(logp, axis=-1, keepdims=True)
+        logs[~np.isfinite(logs)] = 0
+        self.p = np.exp(logp - logs)
+        self.logs = logs[...,0]
+
+
+    def _init_transitions(self, logP):
+        # Scaled transition matrix and the scales of the rows and the columns
+        # relative to the maximum
+        (self.P_row, logr_row, self.logm) = _scale_transitions(logP, axis=-1)
+        (self.P_col, logr_col, _) = _scale_transitions(logP, axis=-2)
+        self.r_row = np.exp(logr_row)
+        self.r_col = np.exp(logr_col)
+
+
+    def _times_row(self, x):
+        """
+        Multiply the rows x[:,n,:] by the row-scaled matrices from the right.
+        """
+        return np.matmul(x, self.P_row)
+
+
+    def _row_times(self, y):
+        """
+        Multiply the vectors y by the row-scaled matrices from the left.
+        """
+        return np.matmul(self.P_row, y[...,None])[...,0]
+
+
+    def _col_times(self, y):
+        """
+        Multiply the vectors y by the column-scaled matrices from the left.
+        """
+        return np.matmul(self.P_col, y[...,None])[...,0]
+
+
+    def _sum_pairs(self, x, y):
+        """
+        Sum x[:,n,i]*P_row[:,i,j]*y[:,n,j] over n.
+        """
+        return self.P_row * np.matmul(misc.T(x), y)
+
+
+    def forward(self, alpha, n):
+        a = (self._times_row((alpha * self.r_row)[:,None,:])[:,0,:]
+             * self.p[:,n,:])
+        return (a, self.logm + self.logs[:,n])
+
+
+    def backward(self, beta, n):
+        return self._col_times(beta * self.p[:,n,:] * self.r_col)
+
+
+    def log_step(self, n):
+        return self.logP + self.logp[:,n,None,:]
+
+
+    def column(self, n, j):
+        return self.P_col[_plate_index(self.P_col, np.arange(len(j))),:,j]
+
+
+    def log_pairs(self, ind):
+        return (self.logP[_plate_index(self.logP, ind[0])]
+                + self.logp[ind][...,None,:])
+
+
+    def pairwise(self, alpha, beta):
+        # The pairwise posterior probabilities are
+        #
+        #   zz[n,i,j] = x[n,i] * P_row[i,j] * y[n,j] / s[n]
+        #
+        # thus their sum over time is a matrix product.
+        x = alpha * self.r_row[:,None,:]
+        y = beta * self.p
+        xP = self._times_row(x)
+        s = np.sum(xP * y, axis=-1)
+        ok = (s >= _SMALL)
+        x = np.where(ok[...,None], x, 0) / np.where(ok, s, 1)[...,None]
+        zz = self._sum_pairs(x, y)
+        z = np.where(ok[...,None], xP * y, 0) / np.where(ok, s, 1)[...,None]
+        z0 = x[:,0,:] * self._row_times(y[:,0,:])
+        return (z0, zz, z, s)
+
+
+    def set_pairs(self, zz, z, ind, zz_ind, z_ind):
+        z[ind] = z_ind
+        np.add.at(zz, ind[0], zz_ind)
+
+
+class _SparseHomogeneousTransitions(_HomogeneousTransitions):
+    """
+    Scaled sparse time-independent transition matrix and state probabilities
+    for alpha-beta recursion.
+
+    The matrices of all plates form one block-diagonal sparse matrix and the
+    steps in the log domain use only the allowed transitions.
+    """
+
+
+    def __init__(self, logP, logp, transitions):
+        (self.rows, self.cols) = np.nonzero(transitions)
+        # The allowed transitions grouped by the next state
+        self._order = np.argsort(self.cols, kind='mergesort')
+        (self._groups,
+         self._group_starts,
+         self._group_sizes) = np.unique(self.cols[self._order],
+                                        return_index=True,
+                                        return_counts=True)
+        super().__init__(logP * np.ones((np.shape(logp)[0], 1)), logp)
+
+
+    def _init_transitions(self, logP):
+        (B, D) = (np.shape(logP)[0], self.D)
+        # Scales of the rows and the columns relative to the maximum
+        logs_row = _segment_max(logP, self.rows, D)
+        logs_row[~np.isfinite(logs_row)] = 0
+        logs_col = _segment_max(logP, self.cols, D)
+        logs_col[~np.isfinite(logs_col)] = 0
+        self.logm = np.amax(logs_row, axis=-1)
+        self.r_row = np.exp(logs_row - self.logm[:,None])
+        self.r_col = np.exp(logs_col - self.logm[:,None])
+        # Block-diagonal scaled matrices
+        offset = D * np.arange(B)[:,None]
+        ind = (np.ravel(offset + self.rows), np.ravel(offset + self.cols))
+        shape = (B*D, B*D)
+        self.p_row = np.exp(logP - logs_row[:,self.rows])
+        self.P_row = sparse.csr_matrix((np.ravel(self.p_row), ind),
+                                       shape=shape)
+        self.P_row_T = self.P_row.T.tocsr()
+        self.p_col = np.exp(logP - logs_col[:,self.cols])
+        self.P_col = sparse.csr_matrix((np.ravel(self.p_col), ind),
+                                       shape=shape)
+
+
+    def _times_row(self, x):
+        (B, N, D) = np.shape(x)
+        x = np.reshape(misc.T(x), (B*D, N))
+        return misc.T(np.reshape(self.P_row_T.dot(x), (B, D, N)))
+
+
+    def _row_times(self, y):
+        return np.reshape(self.P_row.dot(np.ravel(y)), np.shape(y))
+
+
+    def _col_times(self, y):
+        return np.reshape(self.P_col.dot(np.ravel(y)), np.shape(y))
+
+
+    def _sum_pairs(self, x, y):
+        # Sum over time in chunks in order to bound the memory usage
+        N = np.shape(x)[-2]
+        zz = np.zeros(np.shape(self.p_row))
+        step = max(1, 2**20 // np.size(zz))
+        for start in range(0, N, step):
+            zz += np.einsum('bnk,bnk->bk',
+                            x[:,start:(start+step),self.rows],
+                            y[:,start:(start+step),self.cols])
+        return self.p_row * zz
+
+
+    def column(self, n, j):
+        return self._column(self.p_col, j, 0)
+
+
+    def log_column(self, n, j):
+        return self._column(self.logP, j, -np.inf)
+
+
+    def _column(self, x, j, fill):
+        """
+        Return the values x of the transitions to the states j as a dense
+        matrix.
+        """
+        y = np.full((len(j), self.D), fill, dtype=np.float64)
+        (b, k) = np.nonzero(self.cols == j[:,None])
+        y[b,self.rows[k]] = x[b,k]
+        return y
+
+
+    def max_forward(self, delta, n):
+        # Group the allowed transitions by the next state and find the
+        # maximum of each group
+        v = (delta[:,self.rows] + self.logP)[:,self._order]
+        m = np.maximum.reduceat(v, self._group_starts, axis=-1)
+        first = np.where(v == np.repeat(m, self._group_sizes, axis=-1),
+                         np.arange(len(self._order)),
+                         len(self._order))
+        first = np.minimum.reduceat(first, self._group_starts, axis=-1)
+        delta = np.full(np.shape(delta), -np.inf)
+        delta[:,self._groups] = m + self.logp[:,n,self._groups]
+        bp = np.zeros(np.shape(delta), dtype=int)
+        bp[:,self._groups] = self.rows[self._order[first]]
+        return (delta, bp)
+
+
+    def log_forward(self, logalpha, n):
+        v = (logalpha[:,self.rows]
+             + self.logP
+             + self.logp[:,n,self.cols])
+        logc = misc.logsumexp(v, axis=-1)
+        return (logc,
+                _segment_logsumexp(v - logc[:,None], self.cols, self.D))
+
+
+    def log_backward(self, logbeta, n):
+        v = _segment_logsumexp(self.logP
+                               + (logbeta + self.logp[:,n,:])[:,self.cols],
+                               self.rows,
+                               self.D)
+        return v - misc.logsumexp(v, axis=-1, keepdims=True)
+
+
+    def reachable_forward(self, alpha, n):
+        possible = ((alpha > 0)[:,self.rows]
+                    & np.isfinite(self.logP)
+                    & np.isfinite(self.logp[:,n,self.cols]))
+        return _segment_sum(possible, self.cols, self.D) > 0
+
+
+    def reachable_backward(self, beta, n):
+        possible = (np.isfinite(self.logP)
+                    & ((beta > 0) & np.isfinite(self.logp[:,n,:]))[:,self.cols])
+        return _segment_sum(possible, self.rows, self.D) > 0
+
+
+    def log_pairwise(self, logalpha, logbeta, ind):
+        v = (logalpha[:,self.rows]
+             + self.logP[ind[0]]
+             + (logbeta + self.logp[ind])[:,self.cols])
+        zz = _normalize_exp(v, axis=-1)
+        return (zz,
+                _segment_sum(zz, self.cols, self.D),
+                _segment_sum(zz, self.rows, self.D))
+
+
+def _size(size):
+    """
+    Convert the size argument of random sampling functions to a tuple.
+    """
+    if size is None:
+        return ()
+    if isinstance(size, int):
+        return (size,)
+    return tuple(size)
+
+
+def _categorical(p, x=None):
+    """
+    Draw samples from categorical distributions by inverse CDF.
+
+    The probabilities p do not need to be normalized.  The samples are drawn
+    for all distributions at once.  x contains optional uniform random
+    numbers from [0,1).
+    """
+    P = np.cumsum(p, axis=-1)
+    if x is None:
+        x = get_generator().random(np.shape(P)[:-1])
+    x = x * P[...,-1]
+    # The first state with cumulative probability larger than x.  States with
+    # zero probability are never drawn.
+    z = np.sum(P <= x[...,None], axis=-1)
+    return np.minimum(z, np.shape(p)[-1]-1)
+
+
+def _segment_sum(x, ind, D):
+    """
+    Sum x[...,k] to the indices ind[k] of the last axis of length D.
+    """
+    y = np.zeros(np.shape(x)[:-1] + (D,))
+    np.add.at(misc.T(y), ind, misc.T(x))
+    return y
+
+
+def _segment_max(x, ind, D):
+    """
+    Maximum of x[...,k] for the indices ind[k] of the last axis of length D.
+    """
+    y = np.full(np.shape(x)[:-1] + (D,), -np.inf)
+    np.maximum.at(misc.T(y), ind, misc.T(x))
+    return y
+
+
+def _segment_logsumexp(x, ind, D):
+    """
+    Log-sum-exp of x[...,k] for the indices ind[k] of the last axis of length
+    D.
+    """
+    m = _segment_max(x, ind, D)
+    m[~np.isfinite(m)] = 0
+    y = _segment_sum(np.exp(x - m[...,ind]), ind, D)
+    with np.errstate(divide='ignore'):
+        return np.log(y) + m
+
+
+# The smallest positive normal floating point number
+_TINY = np.finfo(np.float64).tiny
+_EPS = np.finfo(np.float64).eps
+
+# Normalization below which the precision of the normalized probabilities may
+# be lost because of denormal numbers
+_SMALL = _TINY / _EPS
+
+
+def _scale_transitions(logP, axis):
+    """
+    Scale the rows or the columns of the transition matrices to maximum one.
+
+    Returns the scaled matrices in the linear domain, the log-scales of the
+    rows/columns relative to the maximum scale and the log of the maximum
+    scale.
+    """
+    logs = np.amax(logP, axis=axis, keepdims=True)
+    logs[~np.isfinite(logs)] = 0
+    logm = np.amax(logs, axis=(-1,-2))
+    return (np.exp(logP - logs),
+            np.squeeze(logs, axis=axis) - logm[...,None],
+            logm)
+
+
+def _normalize_exp(logp, axis=-1):
+    """
+    Compute normalized probabilities from unnormalized log-probabilities.
+    """
+    return np.exp(logp - misc.logsumexp(logp, axis=axis, keepdims=True))
+
+
+def _get_log(p, logp, n):
+    """
+    Get the log-probabilities of the n-th time instance.
+    """
+    if n in logp:
+        return logp[n]
+    with np.errstate(divide='ignore'):
+        return np.log(p[:,n,:])
+
+
+def _store_log(logp, n, logp_n):
+    """
+    Store log-probabilities if possible states underflow in the linear domain.
+
+    Returns the probabilities in the linear domain.
+    """
+    p_n = np.exp(logp_n)
+    if np.any(np.isfinite(logp_n) & (p_n < _TINY)):
+        logp[n] = logp_n
+    return p_n
+
+
+def _normalize_linear(p, c, logp, n, get_reachable, strict):
+    """
+    Normalize the probabilities computed in the linear domain.
+
+    c is the sum of p.  Returns None if the step must be computed in the log
+    domain because the normalization is too small or, in the strict mode, the
+    previous probabilities underflowed or a possible state (given by
+    get_reachable()) underflows.  If the normalization is too small in the
+    non-strict mode, raises _Underflow.
+    """
+    if not c.min() >= _SMALL:
+        if not strict:
+            raise _Underflow()
+        return None
+    if strict and n in logp:
+        return None
+    p = p / c[...,None]
+    if strict and p.min() < _TINY:
+        if np.any(get_reachable() & (p < _TINY)):
+            return None
+    return p
+
+
+def _flatten_plates(x, plates, ndim, broadcast=False):
+    """
+    Reshape the plates of an array to one axis.
+
+    If the array has no plates and broadcast is False, the plate axis has
+    length one.
+    """
+    dims = np.shape(x)[np.ndim(x)-ndim:]
+    if not broadcast and np.size(x) == np.prod(dims):
+        return np.reshape(x, (1,)+dims)
+    return np.reshape(np.broadcast_to(x, plates+dims), (-1,)+dims)
+
+
+def _plate_index(x, ind):
+    """
+    Return indices to the flattened plate axis taking broadcasting into
+    account.
+    """
+    if np.shape(x)[0] == 1:
+        return np.zeros_like(ind)
+    return ind
 
 
 def gaussian_gamma_to_t(mu, Cov, a, b, ndim=1):
@@ -128,6 +128,86 @@ class TestDot(misc.TestCase):
                           [[1,2,3],
                            [4,5,6]])
 
+class TestCholesky(misc.TestCase):
+
+    def _random_covariances(self, *shape):
+        W = np.random.randn(*(shape + (2*shape[-1],)))
+        return np.einsum('...ik,...jk->...ij', W, W)
+
+
+    def test_chol(self):
+        """
+        Test the Cholesky decomposition of stacked matrices.
+        """
+
+        C = self._random_covariances(4, 3, 5)
+        U = linalg.chol(C)
+        self.assertEqual(U.shape, (4, 3, 5, 5))
+        self.assertAllClose(np.triu(U), U)
+        self.assertAllClose(np.einsum('...ki,...kj->...ij', U, U), C)
+        self.assertAllClose(linalg.chol_logdet(U),
+                            np.linalg.slogdet(C)[1])
+
+        # Single matrix
+        self.assertAllClose(linalg.chol(C[0,0]), U[0,0])
+
+        # Not positive definite
+        C[1,2] = -np.identity(5)
+        self.assertRaises(np.linalg.LinAlgError,
+                          linalg.chol,
+                          C)
+
+        pass
+
+
+    def test_chol_solve(self):
+        """
+        Test solving with stacked Cholesky factors.
+        """
+
+        # Broadcasting of the matrices and the vectors
+        C = self._random_covariances(4, 1, 3)
+        b = np.random.randn(2, 3)
+        x = linalg.chol_solve(linalg.chol(C), b)
+        self.assertEqual(x.shape, (4, 2, 3))
+        self.assertAllClose(np.einsum('...ij,...j->...i', C, x),
+                            b * np.ones((4, 2, 1)))
+
+        # Single matrix and multiple vectors
+        U = linalg.chol(C[0,0])
+        x = linalg.chol_solve(U, b)
+        self.assertAllClose(x, np.linalg.solve(C[0,0], b.T).T)
+
+        # Matrix right-hand side
+        B = np.random.randn(4, 2, 3, 6)
+        X = linalg.chol_solve(linalg.chol(C), B, matrix=True)
+        self.assertAllClose(X, np.linalg.solve(C, B))
+        X = linalg.chol_solve(U, B, matrix=True)
+        self.assertAllClose(X, np.linalg.solve(C[0,0], B))
+
+        # Output array
+        out = np.zeros((4, 2, 3))
+        x = linalg.chol_solve(linalg.chol(C), b, out=out)
+        self.assertIs(x, out)
+        self.assertAllClose(out, np.linalg.solve(C, b[None,...,None])[...,0])
+
+        pass
+
+
+    def test_chol_inv(self):
+        """
+        Test the inverse from stacked Cholesky factors.
+        """
+
+        C = self._random_covariances(4, 3, 5)
+        self.assertAllClose(linalg.chol_inv(linalg.chol(C)),
+                            np.linalg.inv(C))
+        self.assertAllClose(linalg.chol_inv(linalg.chol(C[2,1])),
+                            np.linalg.inv(C[2,1]))
+
+        pass
+
+
 class TestBandedSolve(misc.TestCase):
 
     def test_block_banded_solve(self):
@@ -199,3 +279,133 @@ class TestBandedSolve(misc.TestCase):
         # Check the log determinant
         self.assertAlmostEqual(ldet/np.linalg.slogdet(C)[1], 1)
 
+
+
+    def test_block_banded_solve_cyclic(self):
+        """
+        Test the cyclic reduction for block-banded matrices.
+        """
+
+        def check(A, B, y):
+            (V, C, x, ldet) = linalg.block_banded_solve(A, B, y,
+                                                        method='cyclic')
+            (N, D) = np.shape(y)[-2:]
+            plates = np.shape(x)[:-2]
+            A = np.broadcast_to(A, plates + (N,D,D))
+            B = np.broadcast_to(B, plates + (N-1,D,D))
+            y = np.broadcast_to(y, plates + (N,D))
+            V = np.broadcast_to(V, plates + (N,D,D))
+            C = np.broadcast_to(C, plates + (N-1,D,D))
+            ldet = np.broadcast_to(ldet, plates)
+            for i in np.ndindex(*plates):
+                J = misc.block_banded(list(A[i]), list(B[i]))
+                invJ = np.linalg.inv(J)
+                for n in range(N):
+                    self.assertAllClose(V[i][n],
+                                        invJ[n*D:(n+1)*D,n*D:(n+1)*D])
+                for n in range(N-1):
+                    self.assertAllClose(C[i][n],
+                                        invJ[n*D:(n+1)*D,(n+1)*D:(n+2)*D])
+                self.assertAllClose(x[i],
+                                    np.reshape(np.dot(invJ, np.ravel(y[i])),
+                                               (N, D)))
+                self.assertAllClose(ldet[i], np.linalg.slogdet(J)[1])
+
+        def random(plates, N, D):
+            W = np.random.randn(*(plates + (N, D, 2*D)))
+            A = np.einsum('...ik,...jk->...ij', W, W) + D*np.identity(D)
+            B = 0.3 * np.random.randn(*(plates + (N-1, D, D)))
+            return (A, B)
+
+        # Different numbers of blocks (odd and even)
+        for N in [1, 2, 3, 4, 7, 16, 21]:
+            (A, B) = random((), N, 3)
+            check(A, B, np.random.randn(N, 3))
+
+        # Broadcasting plates
+        (A, B) = random((2, 1), 5, 2)
+        check(A, B, np.random.randn(3, 5, 2))
+
+        self.assertRaises(ValueError,
+                          linalg.block_banded_solve,
+                          A, B, np.random.randn(5, 2),
+                          method='foo')
+
+        pass
+
+
+    def test_block_banded_solve_steady_state(self):
+        """
+        Test the steady state of the sequential block-banded solver.
+        """
+
+        # Time-invariant chain except for the first and the last blocks
+        (N, D) = (300, 3)
+        W = np.random.randn(D, 2*D)
+        A = np.tile(np.dot(W, W.T) + D*np.identity(D), (N,1,1))
+        A[0] += np.identity(D)
+        A[-1] -= 0.5*np.identity(D)
+        B = np.tile(0.3*np.random.randn(D, D), (N-1,1,1))
+        B[-1] *= 0.5
+        y = np.random.randn(2, N, D)
+
+        (V0, C0, x0, ldet0) = linalg.block_banded_solve(A, B, y)
+        for method in ['sequential', 'auto']:
+            (V, C, x, ldet) = linalg.block_banded_solve(A, B, y,
+                                                        method=method,
+                                                        steady_state_tol=1e-12)
+            self.assertAllClose(V, V0)
+            self.assertAllClose(C, C0)
+            self.assertAllClose(x, x0)
+            self.assertAllClose(ldet, ldet0)
+
+        # Time-varying chain
+        A[N//2] += np.identity(D)
+        (V0, C0, x0, ldet0) = linalg.block_banded_solve(A, B, y)
+        (V, C, x, ldet) = linalg.block_banded_solve(A, B, y,
+                                                    method='auto',
+                                                    steady_state_tol=1e-12)
+        self.assertAllClose(V, V0)
+        self.assertAllClose(C, C0)
+        self.assertAllClose(x, x0)
+        self.assertAllClose(ldet, ldet0)
+
+        pass
+
+
+    def test_block_banded_solve_checkpointed(self):
+        """
+        Test the memory-bounded block-banded solver.
+        """
+
+        (N, D) = (23, 3)
+        W = np.random.randn(N, D, 2*D)
+        A = np.einsum('...ik,...jk->...ij', W, W) + D*np.identity(D)
+        B = 0.3*np.random.randn(N-1, D, D)
+        y = np.random.randn(2, N, D)
+        (V0, C0, x0, ldet0) = linalg.block_banded_solve(A, B, y)
+
+        def blocks(start, stop):
+            return (A[start:stop], B[start:min(stop,N-1)], y[:,start:stop])
+
+        for segment_length in [None, 1, 5, N]:
+            segments = []
+            def consume(start, V, C, x):
+                segments.append(start)
+                # The segments overlap by one block
+                stop = start + np.shape(V)[-3]
+                self.assertAllClose(V, V0[start:stop])
+                self.assertAllClose(C, C0[start:stop-1])
+                self.assertAllClose(x, x0[:,start:stop])
+            ldet = linalg.block_banded_solve_checkpointed(
+                blocks,
+                N,
+                consume,
+                segment_length=segment_length
+            )
+            self.assertAllClose(ldet, ldet0)
+            self.assertEqual(segments,
+                             sorted(segments, reverse=True))
+            self.assertEqual(segments[-1], 0)
+
+        pass
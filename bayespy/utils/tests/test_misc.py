@@ -31,6 +31,7 @@ import warnings
 warnings.simplefilter("error")
 
 import numpy as np
+import scipy.sparse
 
 from numpy import testing
 
@@ -449,3 +450,48 @@ class TestMean(misc.TestCase):
                             [[2.5]])
         
         pass
+
+
+class TestSparseCounts(misc.TestCase):
+
+    def test_sparse_counts(self):
+        """
+        Test the sparse representation of counts
+        """
+
+        # One-hot vectors
+        X = misc.SparseCounts.from_indices([[2,0],
+                                            [1,1]],
+                                           3)
+        self.assertEqual(X.shape, (2,2,3))
+        x = [[[0,0,1], [1,0,0]],
+             [[0,1,0], [0,1,0]]]
+        self.assertAllClose(X.dense(), x)
+        self.assertAllClose(np.asarray(X), x)
+
+        # Sparse matrix of counts
+        A = np.array([[0,2,0,1],
+                      [0,0,0,0],
+                      [3,0,0,0]])
+        X = misc.SparseCounts.from_matrix(scipy.sparse.csr_matrix(A))
+        self.assertEqual(X.shape, (3,4))
+        self.assertAllClose(X.dense(), A)
+
+        # Gather
+        phi = np.random.randn(4)
+        self.assertAllClose(X.sum_product(phi),
+                            np.sum(phi*A, axis=-1))
+        phi = np.random.randn(3,4)
+        self.assertAllClose(X.sum_product(phi),
+                            np.sum(phi*A, axis=-1))
+
+        # Scatter-add
+        mask = np.array([[True], [True], [False]])
+        for to_shape in [(4,), (1,4), (3,4)]:
+            self.assertAllClose(X.sum_to_plates(mask, to_shape, (2,3,4)),
+                                misc.sum_multiply_to_plates(A,
+                                                            mask,
+                                                            to_plates=to_shape,
+                                                            from_plates=(2,3,4)))
+
+        pass
@@ -28,6 +28,8 @@ Unit tests for bayespy.utils.random module.
 import warnings
 warnings.simplefilter("error")
 
+import itertools
+
 import numpy as np
 
 from .. import misc
@@ -77,7 +79,30 @@ class TestCeilDiv(misc.TestCase):
                           size=(3,))
 
         pass
-        
+
+
+    def test_categorical_many(self):
+        """
+        Test drawing a large number of categorical samples at once
+        """
+
+        # Shared probabilities are not broadcasted to the output size
+        p = [0.2, 0.0, 0.3, 0.5]
+        y = random.categorical(p, size=(1000, 1000))
+        self.assertEqual(np.shape(y), (1000, 1000))
+        self.assertTrue(np.all(y != 1))
+        self.assertAllClose(np.bincount(np.ravel(y), minlength=4) / 1e6,
+                            p,
+                            atol=1e-2)
+
+        # Different distributions for each sample
+        p = np.zeros((1000, 3))
+        p[np.arange(1000), np.arange(1000) % 3] = 1
+        y = random.categorical(p)
+        self.assertArrayEqual(y, np.arange(1000) % 3)
+
+        pass
+
 
 
 class TestDirichlet(misc.TestCase):
@@ -112,10 +137,53 @@ class TestDirichlet(misc.TestCase):
         self.assertAllClose(p,
                             [ [[0.75, 0.25], [0.75, 0.25], [0.75, 0.25]],
                               [[0.75, 0.25], [0.75, 0.25], [0.75, 0.25]] ])
+
+        # Test small concentration parameters
+        p = random.dirichlet(1e-3*np.ones(5), size=100)
+        self.assertTrue(np.all(np.isfinite(p)))
+        self.assertAllClose(np.sum(p, axis=-1), np.ones(100))
         
         pass
 
 
+class TestGenerator(misc.TestCase):
+    """
+    Unit tests for the shared random number generator
+    """
+
+    def tearDown(self):
+        random.set_generator(None)
+
+
+    def test(self):
+        """
+        Test that the samples are reproducible with a seeded generator
+        """
+
+        def sample():
+            return (random.categorical([0.2, 0.3, 0.5], size=10),
+                    random.dirichlet([1, 2, 3], size=10),
+                    random.bernoulli(0.5, size=10))
+
+        random.set_generator(42)
+        x = sample()
+        random.set_generator(np.random.default_rng(42))
+        y = sample()
+        for (xi, yi) in zip(x, y):
+            self.assertArrayEqual(xi, yi)
+
+        # The global random state is used by default
+        random.set_generator(None)
+        np.random.seed(42)
+        x = sample()
+        np.random.seed(42)
+        y = sample()
+        for (xi, yi) in zip(x, y):
+            self.assertArrayEqual(xi, yi)
+
+        pass
+
+
 class TestAlphaBetaRecursion(misc.TestCase):
     
     def test(self):
@@ -277,4 +345,243 @@ class TestAlphaBetaRecursion(misc.TestCase):
         self.assertTrue(np.all(~np.isnan(g)),
                         msg="Nans in results, algorithm not stable")
 
+        # Test plates and large differences in the scales of the
+        # probabilities against brute-force enumeration of the paths
+        np.random.seed(42)
+        logp0 = 500 * np.random.randn(2, 3)
+        logP = 500 * np.random.randn(2, 3, 3, 3)
+        logP[...,1,0,1] = -np.inf
+        (z0, zz, g) = random.alpha_beta_recursion(logp0,
+                                                  logP)
+        paths = np.reshape(np.indices((3, 3, 3, 3)), (4, -1))
+        logp = (logp0[...,paths[0]]
+                + logP[...,0,paths[0],paths[1]]
+                + logP[...,1,paths[1],paths[2]]
+                + logP[...,2,paths[2],paths[3]])
+        p = np.exp(logp - np.amax(logp, axis=-1, keepdims=True))
+        p /= np.sum(p, axis=-1, keepdims=True)
+        for n in range(3):
+            zz_n = np.zeros((2, 3, 3))
+            for (k, (i, j)) in enumerate(zip(paths[n], paths[n+1])):
+                zz_n[:,i,j] += p[:,k]
+            self.assertAllClose(zz[:,n], zz_n, atol=1e-10)
+        self.assertAllClose(z0, np.sum(zz[:,0], axis=-1), atol=1e-10)
+        self.assertAllClose(g, -misc.logsumexp(logp, axis=-1))
+
+        pass
+
+
+    def test_homogeneous(self):
+        """
+        Test alpha-beta recursion for time-homogeneous Markov chains
+        """
+
+        np.random.seed(42)
+        for scale in [1, 500]:
+            logp0 = scale * np.random.randn(2, 3)
+            logP = scale * np.random.randn(3, 3)
+            logP[0,1] = -np.inf
+            logp = scale * np.random.randn(2, 6, 3)
+            (z0, zz, g) = random.alpha_beta_recursion(
+                logp0,
+                logP + logp[...,:,None,:]
+            )
+            (h0, hh, h, f) = random.alpha_beta_recursion_homogeneous(logp0,
+                                                                     logP,
+                                                                     logp)
+            self.assertAllClose(h0, z0, atol=1e-10)
+            self.assertAllClose(hh, np.sum(zz, axis=-3), atol=1e-10)
+            self.assertAllClose(h, np.sum(zz, axis=-2), atol=1e-10)
+            self.assertAllClose(f, g)
+
+        pass
+
+
+    def test_sparse(self):
+        """
+        Test alpha-beta recursion for sparse transitions
+        """
+
+        np.random.seed(42)
+        # Left-to-right transitions
+        transitions = np.triu(np.tril(np.ones((4,4), dtype=bool), 1))
+        (rows, cols) = np.nonzero(transitions)
+        for scale in [1, 500]:
+            logp0 = scale * np.random.randn(2, 4)
+            logP = scale * np.random.randn(4, 4)
+            logP[~transitions] = -np.inf
+            logp = scale * np.random.randn(2, 7, 4)
+            (z0, zz, z, g) = random.alpha_beta_recursion_homogeneous(logp0,
+                                                                     logP,
+                                                                     logp)
+            (h0, hh, h, f) = random.alpha_beta_recursion_homogeneous(
+                logp0,
+                logP[rows,cols],
+                logp,
+                transitions=transitions
+            )
+            self.assertAllClose(h0, z0, atol=1e-10)
+            self.assertAllClose(hh, zz[...,rows,cols], atol=1e-10)
+            self.assertAllClose(h, z, atol=1e-10)
+            self.assertAllClose(f, g)
+
+        pass
+
+
+class TestForwardFilteringBackwardSampling(misc.TestCase):
+    """
+    Unit tests for forward filtering and backward sampling of Markov chains
+    """
+
+    def test(self):
+        """
+        Test sampling Markov chains by forward filtering backward sampling
+        """
+
+        # Deterministic chain with evidence at the end
+        logp0 = np.log([0.5, 0.5])
+        logP = np.array([ [[-np.inf, 0], [0, -np.inf]],
+                          [[0, -np.inf], [-np.inf, 0]],
+                          [[0, -np.inf], [-np.inf, 0]] ])
+        logP[-1,:,1] = -np.inf
+        z = random.forward_filtering_backward_sampling(logp0, logP, size=(3,))
+        self.assertAllClose(z, [[1, 0, 0, 0]] * 3)
+
+        # Compare the empirical pairwise probabilities to the posterior
+        np.random.seed(42)
+        S = 20000
+        for scale in [1, 500]:
+            logp0 = scale * np.random.randn(3)
+            logP = scale * np.random.randn(4, 3, 3)
+            logP[:,0,1] = -np.inf
+            (_, zz, _) = random.alpha_beta_recursion(logp0, logP)
+            z = random.forward_filtering_backward_sampling(logp0,
+                                                           logP,
+                                                           size=S)
+            self.assertEqual(np.shape(z), (S, 5))
+            pairs = np.zeros((4, 3, 3))
+            for n in range(4):
+                np.add.at(pairs[n], (z[:,n], z[:,n+1]), 1)
+            self.assertAllClose(pairs/S, zz, rtol=0, atol=0.02)
+
+        pass
+
+
+    def test_homogeneous(self):
+        """
+        Test sampling time-homogeneous Markov chains
+        """
+
+        np.random.seed(42)
+        S = 20000
+        transitions = np.array([[True, True, False],
+                                [False, True, True],
+                                [True, False, True]])
+        (rows, cols) = np.nonzero(transitions)
+        for scale in [1, 500]:
+            logp0 = scale * np.random.randn(3)
+            logP = scale * np.random.randn(3, 3)
+            logP[~transitions] = -np.inf
+            logp = scale * np.random.randn(5, 3)
+            (z0, zz, _, _) = random.alpha_beta_recursion_homogeneous(logp0,
+                                                                     logP,
+                                                                     logp)
+            for z in [
+                    random.forward_filtering_backward_sampling_homogeneous(
+                        logp0,
+                        logP,
+                        logp,
+                        size=S
+                    ),
+                    random.forward_filtering_backward_sampling_homogeneous(
+                        logp0,
+                        logP[rows,cols],
+                        logp,
+                        transitions=transitions,
+                        size=S
+                    )]:
+                self.assertEqual(np.shape(z), (S, 6))
+                self.assertTrue(np.all(transitions[z[:,:-1],z[:,1:]]))
+                pairs = np.zeros((3, 3))
+                np.add.at(pairs, (z[:,:-1], z[:,1:]), 1)
+                self.assertAllClose(pairs/S, zz, rtol=0, atol=0.05)
+                self.assertAllClose(np.mean(z[:,0,None] == np.arange(3),
+                                            axis=0),
+                                    z0,
+                                    rtol=0,
+                                    atol=0.02)
+
+        pass
+
+
+class TestViterbi(misc.TestCase):
+    """
+    Unit tests for the Viterbi algorithm
+    """
+
+    def test(self):
+        """
+        Test the most probable state sequence of Markov chains
+        """
+
+        def brute_force(logp0, logP):
+            (N, D) = np.shape(logP)[-3:-1]
+            paths = np.array(list(itertools.product(range(D), repeat=N+1)))
+            logp = (logp0[paths[:,0]]
+                    + np.sum(logP[np.arange(N), paths[:,:-1], paths[:,1:]],
+                             axis=-1))
+            i = np.argmax(logp)
+            return (paths[i], logp[i])
+
+        np.random.seed(42)
+        logp0 = np.random.randn(2, 3)
+        logP = np.random.randn(2, 4, 3, 3)
+        logP[...,0,1] = -np.inf
+        (z, logp) = random.viterbi(logp0, logP)
+        for i in range(2):
+            (y, logq) = brute_force(logp0[i], logP[i])
+            self.assertAllClose(z[i], y)
+            self.assertAllClose(logp[i], logq)
+
+        # Compute in segments
+        segments = {}
+        def consume(start, z_segment):
+            segments[start] = z_segment
+        (y, logq) = random.viterbi(logp0, logP, consume=consume,
+                                   segment_length=2)
+        self.assertEqual(y, None)
+        self.assertEqual(sorted(segments), [0, 2])
+        self.assertAllClose(np.concatenate([segments[0], segments[2]],
+                                           axis=-1),
+                            z)
+        self.assertAllClose(logq, logp)
+
+        pass
+
+
+    def test_homogeneous(self):
+        """
+        Test the most probable state sequence of time-homogeneous Markov chains
+        """
+
+        np.random.seed(42)
+        transitions = np.array([[True, True, False],
+                                [False, True, True],
+                                [True, False, True]])
+        (rows, cols) = np.nonzero(transitions)
+        logp0 = np.random.randn(2, 3)
+        logP = np.random.randn(3, 3)
+        logP[~transitions] = -np.inf
+        logp = np.random.randn(2, 5, 3)
+        (z, logq) = random.viterbi(logp0, logP + logp[...,:,None,:])
+        (y, logp_max) = random.viterbi_homogeneous(logp0, logP, logp)
+        self.assertAllClose(y, z)
+        self.assertAllClose(logp_max, logq)
+        (y, logp_max) = random.viterbi_homogeneous(logp0,
+                                                   logP[rows,cols],
+                                                   logp,
+                                                   transitions=transitions)
+        self.assertAllClose(y, z)
+        self.assertAllClose(logp_max, logq)
+
         pass